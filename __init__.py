@@ -1,41 +1,64 @@
 
 from .spiral import *
 
+import importlib
+import os
 import sys
-import numpy as _numpy
-
-try:
-    import cupy as _cupy
-except ModuleNotFoundError:
-    _cupy = None
+import threading
 
 __version__ = '1.0.1'
     
 # internal names
 
-SW_LIBSDIR  = '.libs'
+SW_LIBSDIR          = '.libs'
+SW_BUILDCACHEDIR    = 'buildcache'
+SW_INDEXFILE        = 'swindex.json'
+SW_LOCKSDIR         = '.locks'
 
 # environment varibles
 
-SW_KEEPTEMP     = 'SW_KEEPTEMP'
-SW_LIBRARY_PATH = 'SW_LIBRARY_PATH'
-SW_WORKDIR      = 'SW_WORKDIR'
+SW_BUILDCACHE       = 'SW_BUILDCACHE'
+SW_KEEPTEMP         = 'SW_KEEPTEMP'
+SW_LIBRARY_PATH     = 'SW_LIBRARY_PATH'
+SW_SERVE_SOCKET     = 'SW_SERVE_SOCKET'
+SW_SPIRAL_SESSIONS  = 'SW_SPIRAL_SESSIONS'
+SW_WORKDIR          = 'SW_WORKDIR'
 
 # options
 
+SW_OPT_BACKGROUND       = 'background'
+SW_OPT_BUILDBACKEND     = 'buildbackend'
+SW_OPT_BUILDCACHE       = 'buildcache'
+SW_OPT_CFLAGS           = 'cflags'
 SW_OPT_COLMAJOR         = 'colmajor'
+SW_OPT_DEFER            = 'defer'
+SW_OPT_FASTMATH         = 'fastmath'
+SW_OPT_ISA              = 'isa'
 SW_OPT_KEEPTEMP         = 'keeptemp'
+SW_OPT_LTO              = 'lto'
+SW_OPT_MARCH            = 'march'
 SW_OPT_METADATA         = 'metadata'
 SW_OPT_MPI              = 'mpi'
+SW_OPT_PERTHREAD        = 'perthread'
 SW_OPT_PLATFORM         = 'platform'
 SW_OPT_PRINTRULETREE    = 'printruletree'
 SW_OPT_REALCTYPE        = 'realctype'
+SW_OPT_REBUILD          = 'rebuild'
+SW_OPT_SPIRALSESSION    = 'spiralsession'
+SW_OPT_SPIRALTIMEOUT    = 'spiraltimeout'
+SW_OPT_THREADS          = 'threads'
+SW_OPT_TUNE             = 'tune'
 
 # transform direction, 'k'
 
 SW_FORWARD  = -1
 SW_INVERSE  = 1
 
+# how solve() computed its result
+
+SW_PATH_LIBRARY = 'library'
+SW_PATH_PYTHON  = 'python'
+
 # platforms
 
 SW_CPU  = 'CPU'
@@ -49,6 +72,9 @@ SW_METADATA_END     = '!!END_METADATA!!'
 SW_METAFILE_EXT     = '_meta.c'
 SW_METAVAR_EXT      = '_metadata'
 
+# extensions of generated files that are compiled
+SW_SOURCE_EXTS      = ['.c', '.cpp', '.cu']
+
 SW_STR_DOUBLE       = 'Double'
 SW_STR_SINGLE       = 'Single'
 
@@ -62,6 +88,7 @@ SW_TRANSFORM_MDRFSCONV  = 'MDRFSCONV'
 SW_TRANSFORM_MDPRDFT    = 'MDPRDFT'
 SW_TRANSFORM_UNKNOWN    = 'UNKNOWN'
 
+SW_KEY_COMPILEFLAGS     = 'CompileFlags'
 SW_KEY_DESTROY          = 'Destroy'
 SW_KEY_DIMENSIONS       = 'Dimensions'
 SW_KEY_DIRECTION        = 'Direction'
@@ -69,14 +96,26 @@ SW_KEY_EXEC             = 'Exec'
 SW_KEY_FILENAME         = 'Filename'
 SW_KEY_FUNCTIONS        = 'Functions'
 SW_KEY_INIT             = 'Init'
+SW_KEY_ISA              = 'ISA'
+SW_KEY_LIBRARIES        = 'Libraries'
 SW_KEY_METADATA         = 'Metadata'
+SW_KEY_MTIME            = 'MTime'
 SW_KEY_NAMES            = 'Names'
+SW_KEY_OPTIONS          = 'Options'
 SW_KEY_PLATFORM         = 'Platform'
 SW_KEY_PRECISION        = 'Precision'
+SW_KEY_REQUIREDFEATURES = 'RequiredFeatures'
+SW_KEY_SECONDS          = 'Seconds'
+SW_KEY_SIZE             = 'Size'
 SW_KEY_SPIRALBUILDINFO  = 'SpiralBuildInfo'
+SW_KEY_THREADS          = 'Threads'
 SW_KEY_TRANSFORMS       = 'Transforms'
 SW_KEY_TRANSFORMTYPE    = 'TransformType'
 SW_KEY_TRANSFORMTYPES   = 'TransformTypes'
+SW_KEY_TUNING           = 'Tuning'
+SW_KEY_VARIANT          = 'Variant'
+SW_KEY_VARIANTS         = 'Variants'
+SW_KEY_VERSION          = 'Version'
 
 if sys.platform == 'win32':
     SW_SHLIB_EXT = '.dll'
@@ -86,16 +125,91 @@ else:
     SW_SHLIB_EXT = '.so'
 
 
+# CuPy takes seconds to import, so it is imported only when first needed
+_cupy = None
+_cupyChecked = False
+_cupyLock = threading.Lock()
+
+def get_cupy():
+    """Return the cupy module, importing it on first use, or None if not installed."""
+    global _cupy, _cupyChecked
+    with _cupyLock:
+        if not _cupyChecked:
+            try:
+                import cupy
+                _cupy = cupy
+            except ModuleNotFoundError:
+                _cupy = None
+            _cupyChecked = True
+        return _cupy
+
+
+def _resetCupyLockAfterFork():
+    # another thread may have held the lock when the process forked
+    global _cupyLock
+    _cupyLock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetCupyLockAfterFork)
+
+
 def get_array_module(*args):
-    if _cupy != None:
-        return _cupy.get_array_module(*args)
+    # CuPy arrays only exist once cupy has been imported by someone
+    cupy = sys.modules.get('cupy')
+    if cupy != None:
+        return cupy.get_array_module(*args)
     else:
-        return _numpy
+        import numpy
+        return numpy
 
 
 def has_ROCm():
-    if _cupy != None:
-        return (_cupy._environment.get_rocm_path() != None)
+    cupy = get_cupy()
+    if cupy != None:
+        return (cupy._environment.get_rocm_path() != None)
     else:
         return False
 
+
+def get_solver(problem, opts={}):
+    """Return a solver for problem from the process-wide registry, building it on first use."""
+    from snowwhite.registry import defaultRegistry
+    return defaultRegistry().getSolver(problem, opts)
+
+
+# solver and problem classes and solver functions, imported from their modules on first access
+_lazyNames = {
+    'SWProblem'          : 'snowwhite.swsolver',
+    'SWSolver'           : 'snowwhite.swsolver',
+    'setWorkspaceBudget' : 'snowwhite.swsolver',
+    'workspaceStats'     : 'snowwhite.swsolver',
+    'BatchMddftProblem'  : 'snowwhite.batchmddftsolver',
+    'BatchMddftSolver'   : 'snowwhite.batchmddftsolver',
+    'BatchCoalescer'     : 'snowwhite.coalescer',
+    'DftProblem'         : 'snowwhite.dftsolver',
+    'DftSolver'          : 'snowwhite.dftsolver',
+    'HockneyProblem'     : 'snowwhite.hockneysolver',
+    'HockneySolver'      : 'snowwhite.hockneysolver',
+    'MddftProblem'       : 'snowwhite.mddftsolver',
+    'MddftSolver'        : 'snowwhite.mddftsolver',
+    'MdprdftProblem'     : 'snowwhite.mdprdftsolver',
+    'MdprdftSolver'      : 'snowwhite.mdprdftsolver',
+    'MdrconvProblem'     : 'snowwhite.mdrconvsolver',
+    'MdrconvSolver'      : 'snowwhite.mdrconvsolver',
+    'MdrfsconvProblem'   : 'snowwhite.mdrfsconvsolver',
+    'MdrfsconvSolver'    : 'snowwhite.mdrfsconvsolver',
+    'SlabSolver'         : 'snowwhite.slabsolver',
+    'StepPhaseProblem'   : 'snowwhite.stepphasesolver',
+    'StepPhaseSolver'    : 'snowwhite.stepphasesolver',
+}
+
+
+def __getattr__(name):
+    module = _lazyNames.get(name)
+    if module == None:
+        raise AttributeError("module 'snowwhite' has no attribute '" + name + "'")
+    return getattr(importlib.import_module(module), name)
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_lazyNames))
@@ -0,0 +1,79 @@
+"""
+SnowWhite command line
+
+usage: python -m snowwhite <command> [options]
+"""
+
+import argparse
+import sys
+
+
+def _prebuild(args):
+    from snowwhite.prebuild import main
+    return main(args)
+
+
+def _cache(args):
+    from snowwhite.libcache import main
+    return main(args)
+
+
+def _packs(args):
+    from snowwhite.packs import main
+    return main(args)
+
+
+def _serve(args):
+    from snowwhite.serve import main
+    return main(args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m snowwhite')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sp = subparsers.add_parser('prebuild', help='build transforms listed in a JSON spec file')
+    sp.add_argument('specfile', help='JSON list of transform specs')
+    sp.add_argument('-j', '--jobs', type=int, default=None, help='number of concurrent builds')
+    sp.add_argument('--force', action='store_true', help='rebuild transforms already installed or cached')
+    sp.set_defaults(func=_prebuild)
+
+    sp = subparsers.add_parser('cache', help='list, verify or garbage collect installed libraries')
+    sp.add_argument('action', choices=['list', 'verify', 'gc'])
+    sp.add_argument('--dir', dest='dirs', action='append',
+                    help='library directory, repeatable, default .libs and SW_LIBRARY_PATH (gc: .libs only)')
+    sp.add_argument('--json', action='store_true', help='list as JSON')
+    sp.add_argument('--quota', help='gc: size to reduce to, e.g. 500M or 2G')
+    sp.add_argument('--dry-run', action='store_true', help='gc: only report what would be removed')
+    sp.set_defaults(func=_cache)
+
+    sp = subparsers.add_parser('pack', help='write prebuilt libraries and their metadata to an archive')
+    sp.add_argument('archive', help='archive to write, .tar, .tar.gz or .tgz')
+    sp.add_argument('libraries', nargs='*', help='library file names, default all')
+    sp.add_argument('--spec', help='JSON list of transform specs to select libraries')
+    sp.add_argument('--dir', dest='dirs', action='append',
+                    help='library directory, repeatable, default .libs and SW_LIBRARY_PATH')
+    sp.set_defaults(func=_packs)
+
+    sp = subparsers.add_parser('unpack', help='install the libraries of an archive written by pack')
+    sp.add_argument('archive', help='archive written by pack')
+    sp.add_argument('--dest', help='directory to install to, default .libs; '
+                    'add other directories to SW_LIBRARY_PATH')
+    sp.add_argument('--force', action='store_true', help='replace libraries already installed')
+    sp.set_defaults(func=_packs)
+
+    sp = subparsers.add_parser('serve', help='serve loaded transforms to local processes')
+    sp.add_argument('--socket', help='Unix domain socket path, default SW_SERVE_SOCKET or '
+                    'snowwhite-<uid>.sock in the temp directory')
+    sp.add_argument('--max-pending', type=int, default=64,
+                    help='requests queued or running before further ones are refused')
+    sp.add_argument('--workers', type=int, default=None,
+                    help='threads running transforms, default number of CPUs')
+    sp.set_defaults(func=_serve)
+
+    args = parser.parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
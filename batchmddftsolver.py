@@ -2,13 +2,6 @@
 from snowwhite import *
 from snowwhite.swsolver import *
 import numpy as np
-try:
-    import cupy as cp
-except ModuleNotFoundError:
-    cp = None
-import ctypes
-import sys
-import random
 
 class BatchMddftProblem(SWProblem):
     """Define Batch MDDFT problem."""
@@ -56,10 +49,10 @@ class BatchMddftSolver(SWSolver):
         
         for i in range(b):
             if self._problem.direction() == SW_FORWARD:
-                dft = xp.fft.fftn(src[i,:,:,:])
+                dft = xp.fft.fftn(src[i])
             else:
-                dft = xp.fft.ifftn(src[i,:,:,:])
-            out[i,:,:,:] = dft 
+                dft = xp.fft.ifftn(src[i])
+            out[i] = dft 
         
         return out
     
@@ -80,7 +73,7 @@ class BatchMddftSolver(SWSolver):
             vi = np.random.random()
             src.itemset(k,vr + vi * 1j)
         if self._genCuda or self._genHIP:    
-            src = cp.asarray(src)
+            src = get_cupy().asarray(src)
         
         return src
         
@@ -90,6 +83,9 @@ class BatchMddftSolver(SWSolver):
     
     def solve(self, src, dst=None):
         """Call SPIRAL-generated function."""
+        
+        if not self._useLibrary():
+            return self._solveDef(dst, src)
     
         if type(dst) == type(None):
             xp = get_array_module(src)
@@ -131,6 +127,8 @@ class BatchMddftSolver(SWSolver):
         else:
             print('conf := LocalConfig.fftx.defaultConf();', file = script_file)
         print('opts := conf.getOpts(t);', file = script_file)
+        self._writeVariantOpts(script_file)
+        self._writeVectorOpts(script_file)
         if self._genCuda:
             print('opts.wrapCFuncs := true;', file = script_file)
         if self._opts.get(SW_OPT_REALCTYPE) == "float":
@@ -0,0 +1,230 @@
+"""
+SnowWhite Build Backends
+========================
+
+Backends compile the sources generated by SPIRAL into a shared library:
+
+    cmake   -- configure and build with the module CMakeLists.txt (default)
+    cc      -- invoke the C compiler directly, CPU only
+    ninja   -- compile sources in parallel with a generated build.ninja on
+               CPU, CMake with the Ninja generator otherwise
+
+Each backend records the time spent in each step in its timings dict.
+"""
+
+from snowwhite import *
+from snowwhite.buildcache import compilerId
+
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+SW_BACKEND_CC       = 'cc'
+SW_BACKEND_CMAKE    = 'cmake'
+SW_BACKEND_NINJA    = 'ninja'
+
+# environment variables with compiler settings, part of every build config
+_envFlags = ['CC', 'CXX', 'CFLAGS', 'CXXFLAGS', 'CUDAFLAGS', 'LDFLAGS']
+
+
+def _run(cmd, cwd):
+    """Run command, print its error output on failure, return exit code."""
+    try:
+        runResult = subprocess.run(cmd, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    except OSError as ex:
+        print(cmd[0] + ': ' + ex.strerror, file=sys.stderr)
+        return 1
+    if runResult.returncode != 0:
+        print(runResult.stdout.decode(errors='replace'), file=sys.stderr)
+        print(runResult.stderr.decode(errors='replace'), file=sys.stderr)
+    return runResult.returncode
+
+
+def spiralIncludeDirs():
+    """Return SPIRAL profiler include directories needed by generated code."""
+    spiralHome = os.getenv('SPIRAL_HOME')
+    if spiralHome == None:
+        raise RuntimeError('SPIRAL_HOME environment variable undefined')
+    targets = os.path.join(spiralHome, 'profiler', 'targets')
+    return [targets, os.path.join(targets, 'include')]
+
+
+class BuildBackend:
+    """Base class for compiling generated sources into a shared library."""
+
+    name = None
+
+    def __init__(self, platform=SW_CPU, mpi=False, openmp=False, flags=[]):
+        self._platform = platform
+        self._mpi = mpi
+        self._openmp = openmp
+        self._flags = list(flags)
+        self.timings = dict()
+
+    def compiler(self):
+        if self._platform == SW_CUDA:
+            return 'nvcc'
+        elif self._platform == SW_HIP:
+            return 'hipcc'
+        return os.getenv('CC', 'cc')
+
+    def config(self, basename, sources):
+        """Describe everything besides the sources that affects the library."""
+        envflags = [v + '=' + os.getenv(v, '') for v in _envFlags]
+        return '\n'.join([self.name, sys.platform, self._platform, str(self._mpi), str(self._openmp),
+                          ' '.join(self._flags), compilerId(self.compiler())] + envflags)
+
+    def build(self, basename, sources, builddir, installdir):
+        """Build lib<basename> from sources in builddir into installdir, return exit code."""
+        raise NotImplementedError()
+
+
+class CMakeBackend(BuildBackend):
+    """Configure and build with the module CMakeLists.txt."""
+
+    name = SW_BACKEND_CMAKE
+
+    def __init__(self, platform=SW_CPU, mpi=False, openmp=False, flags=[], generator=None):
+        super(CMakeBackend, self).__init__(platform, mpi, openmp, flags)
+        self._generator = generator
+
+    def _cmakeListsFile(self):
+        return os.path.join(os.path.dirname(__file__), 'CMakeLists.txt')
+
+    def defines(self, basename, sources):
+        """CMake definitions for the build, apart from paths."""
+        defs = ['-DFILEROOT:STRING=' + basename]
+        if self._platform == SW_CUDA:
+            defs.append('-DHASCUDA=1')
+        elif self._platform == SW_HIP:
+            defs += ['-DHASHIP=1', '-DCMAKE_CXX_COMPILER=hipcc']
+
+        if self._mpi:
+            defs.append('-DHASMPI=1')
+            
+        if self._openmp:
+            defs.append('-DHAS_OPENMP=1')
+            
+        # CMake knows how to link with LTO, the other flags are for compiling
+        if '-flto' in self._flags:
+            defs.append('-DHAS_LTO=1')
+        flags = [f for f in self._flags if f != '-flto']
+        if len(flags) > 0:
+            defs.append('-DEXTRA_C_FLAGS=' + ';'.join(flags))
+
+        if (basename + SW_METAFILE_EXT) in sources:
+            defs.append('-DHAS_METADATA=1')
+            
+        # sources not named after basename, e.g. a bundle of transforms
+        main = [f for f in sources if os.path.splitext(f)[0] == basename]
+        if len(main) == 0:
+            defs.append('-DSOURCE_LIST=' + ';'.join(sources))
+        return defs
+
+    def config(self, basename, sources):
+        with open(self._cmakeListsFile(), 'rb') as f:
+            cmhash = hashlib.sha256(f.read()).hexdigest()
+        return '\n'.join([super(CMakeBackend, self).config(basename, sources), cmhash,
+                          str(self._generator)] + self.defines(basename, sources))
+
+    def build(self, basename, sources, builddir, installdir):
+        ##  Assumes:  SPIRAL_HOME is defined (environment variable) or override on command line
+
+        # copy module CMakeLists to build directory, configure out of source
+        shutil.copy(self._cmakeListsFile(), builddir)
+        bindir = os.path.join(builddir, 'build')
+
+        cmd = ['cmake', '-S', builddir, '-B', bindir]
+        if self._generator != None:
+            cmd += ['-G', self._generator]
+        cmd += self.defines(basename, sources)
+        cmd.append('-DPY_LIBS_DIR=' + installdir)
+
+        t0 = time.perf_counter()
+        ret = _run(cmd, builddir)
+        self.timings['Configure'] = time.perf_counter() - t0
+        if ret != 0:
+            return ret
+
+        cmd = ['cmake', '--build', bindir, '--target', 'install']
+        if sys.platform == 'win32':
+            ##  NOTE: Ensure Python installed on Windows is 64 bit
+            cmd += ['--config', 'Release']
+
+        t0 = time.perf_counter()
+        ret = _run(cmd, builddir)
+        self.timings['Compile'] = time.perf_counter() - t0
+        return ret
+
+
+class CCBackend(BuildBackend):
+    """Compile and link CPU sources with one compiler invocation."""
+
+    name = SW_BACKEND_CC
+
+    def compileFlags(self):
+        flags = ['-O3', '-fPIC'] + (['-fopenmp'] if self._openmp else []) + self._flags
+        flags += os.getenv('CFLAGS', '').split()
+        return flags + ['-I' + d for d in spiralIncludeDirs()]
+
+    def linkFlags(self):
+        # with LTO code is generated when linking, using the compile flags
+        flags = ['-shared'] + (['-fopenmp'] if self._openmp else [])
+        if '-flto' in self._flags:
+            flags += self._flags
+        return flags + os.getenv('LDFLAGS', '').split() + ['-lm']
+
+    def build(self, basename, sources, builddir, installdir):
+        os.makedirs(installdir, exist_ok=True)
+        libpath = os.path.join(installdir, 'lib' + basename + SW_SHLIB_EXT)
+        cmd = [self.compiler()] + self.compileFlags() + sources + ['-o', libpath] + self.linkFlags()
+        t0 = time.perf_counter()
+        ret = _run(cmd, builddir)
+        self.timings['Compile'] = time.perf_counter() - t0
+        return ret
+
+
+class NinjaBackend(CCBackend):
+    """Compile CPU sources in parallel with a generated build.ninja."""
+
+    name = SW_BACKEND_NINJA
+
+    def build(self, basename, sources, builddir, installdir):
+        os.makedirs(installdir, exist_ok=True)
+        libpath = os.path.join(installdir, 'lib' + basename + SW_SHLIB_EXT)
+        objs = [os.path.join('obj', os.path.splitext(src)[0] + '.o') for src in sources]
+        with open(os.path.join(builddir, 'build.ninja'), 'w') as f:
+            print('cc = ' + self.compiler(), file = f)
+            print('cflags = ' + ' '.join(self.compileFlags()), file = f)
+            print('ldflags = ' + ' '.join(self.linkFlags()), file = f)
+            print('rule cc', file = f)
+            print('  command = $cc $cflags -c $in -o $out', file = f)
+            print('rule link', file = f)
+            print('  command = $cc $in -o $out $ldflags', file = f)
+            for (src, obj) in zip(sources, objs):
+                print('build ' + obj + ': cc ' + src, file = f)
+            print('build ' + libpath.replace(':', '$:') + ': link ' + ' '.join(objs), file = f)
+        t0 = time.perf_counter()
+        ret = _run(['ninja', '-C', builddir], builddir)
+        self.timings['Compile'] = time.perf_counter() - t0
+        return ret
+
+
+def buildBackend(name, platform=SW_CPU, mpi=False, openmp=False, flags=[]):
+    """Return backend for name, using CMake where a direct build is not supported.
+    
+    flags are extra C compiler flags, e.g. to enable a vector ISA.
+    """
+    direct = (platform == SW_CPU) and (sys.platform != 'win32')
+    if name == SW_BACKEND_CMAKE:
+        return CMakeBackend(platform, mpi, openmp, flags)
+    elif name == SW_BACKEND_CC:
+        return CCBackend(platform, mpi, openmp, flags) if direct else CMakeBackend(platform, mpi, openmp, flags)
+    elif name == SW_BACKEND_NINJA:
+        if direct:
+            return NinjaBackend(platform, mpi, openmp, flags)
+        return CMakeBackend(platform, mpi, openmp, flags, 'Ninja')
+    raise ValueError('unknown build backend: ' + str(name))
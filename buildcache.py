@@ -0,0 +1,158 @@
+"""
+SnowWhite Build Cache
+=====================
+
+Content-addressed cache of build products, in two levels:
+
+    sources/<hash of SPIRAL script>/       files generated by SPIRAL
+    libs/<hash of sources and build config>/  compiled shared library
+
+The cache directory holds only content-addressed entries, so it can be
+shared between machines, e.g. on a network file system.
+"""
+
+from snowwhite import *
+
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+SW_BUILDCACHE_SOURCES = 'sources'
+SW_BUILDCACHE_LIBS    = 'libs'
+
+
+def installFile(src, dest):
+    """Copy src to dest through a temporary file and atomic rename."""
+    destdir = os.path.dirname(dest)
+    (fd, tmpname) = tempfile.mkstemp('.tmp', '.' + os.path.basename(dest) + '.', destdir)
+    os.close(fd)
+    try:
+        shutil.copy2(src, tmpname)
+        os.replace(tmpname, dest)
+    except:
+        try:
+            os.remove(tmpname)
+        except OSError:
+            pass
+        raise
+
+
+_compilerIds = dict()
+_compilerIdsLock = threading.Lock()
+
+def compilerId(compiler):
+    """Return first line of compiler's version output, cached per process."""
+    with _compilerIdsLock:
+        if compiler in _compilerIds:
+            return _compilerIds[compiler]
+        try:
+            res = subprocess.run([compiler, '--version'], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+            ident = res.stdout.decode(errors='replace').strip().split('\n')[0]
+        except OSError:
+            ident = ''
+        _compilerIds[compiler] = ident
+        return ident
+
+
+def _resetCompilerIdsLockAfterFork():
+    # another thread may have held the lock when the process forked
+    global _compilerIdsLock
+    _compilerIdsLock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetCompilerIdsLockAfterFork)
+
+
+def scriptHash(filename, buildInfo=None):
+    """Hash SPIRAL script, ignoring comment lines such as the generation timestamp.
+
+    buildInfo, the dict from spiralBuildInfo(), identifies the SPIRAL that
+    runs the script, so a different version or build gets a different key.
+    """
+    h = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for line in f:
+            if not line.lstrip().startswith(b'#'):
+                h.update(line)
+    if buildInfo != None:
+        h.update(b'\0' + json.dumps(buildInfo, sort_keys=True).encode())
+    return h.hexdigest()
+
+
+def filesHash(dirname, names, config):
+    """Hash named files in dirname together with a build configuration string."""
+    h = hashlib.sha256()
+    for name in sorted(names):
+        h.update(name.encode() + b'\0')
+        with open(os.path.join(dirname, name), 'rb') as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    h.update(config.encode())
+    return h.hexdigest()
+
+
+def _touch(entry):
+    """Record use of a cache entry for cache gc, ignoring read-only caches."""
+    try:
+        os.utime(entry)
+    except OSError:
+        pass
+
+
+class BuildCache:
+    """Two-level content-addressed cache rooted at a directory."""
+
+    def __init__(self, root):
+        self._root = root
+
+    def _entryDir(self, level, key):
+        return os.path.join(self._root, level, key[:2], key)
+
+    def _store(self, level, key, srcdir, names):
+        """Copy files into a new entry, published with an atomic rename."""
+        entry = self._entryDir(level, key)
+        if os.path.isdir(entry):
+            return
+        tmpdir = None
+        try:
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            tmpdir = tempfile.mkdtemp('.tmp', key + '.', os.path.dirname(entry))
+            for name in names:
+                shutil.copy2(os.path.join(srcdir, name), os.path.join(tmpdir, name))
+            os.rename(tmpdir, entry)
+        except OSError:
+            # lost a race with another process storing the same entry, or
+            # cache not writable, either way nothing to do
+            if tmpdir != None:
+                shutil.rmtree(tmpdir, ignore_errors=True)
+
+    def fetchSources(self, key, destdir):
+        """Copy cached generated sources into destdir, return True on hit."""
+        entry = self._entryDir(SW_BUILDCACHE_SOURCES, key)
+        try:
+            for name in os.listdir(entry):
+                shutil.copy2(os.path.join(entry, name), os.path.join(destdir, name))
+        except OSError:
+            # missing, or removed by cache gc while copying
+            return False
+        _touch(entry)
+        return True
+
+    def storeSources(self, key, srcdir, names):
+        self._store(SW_BUILDCACHE_SOURCES, key, srcdir, names)
+
+    def fetchLibrary(self, key, libname, destdir):
+        """Install cached library libname into destdir, return True on hit."""
+        entry = self._entryDir(SW_BUILDCACHE_LIBS, key)
+        try:
+            installFile(os.path.join(entry, libname), os.path.join(destdir, libname))
+        except OSError:
+            return False
+        _touch(entry)
+        return True
+
+    def storeLibrary(self, key, libpath):
+        self._store(SW_BUILDCACHE_LIBS, key, os.path.dirname(libpath), [os.path.basename(libpath)])
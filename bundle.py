@@ -0,0 +1,129 @@
+"""
+SnowWhite Bundles
+=================
+
+Generate several transforms with one SPIRAL run and compile them into one
+shared library, e.g. forward and inverse pairs or a ladder of sizes:
+
+    problems = [MddftProblem([n,n,n], k) for n in [32, 64, 128] for k in [SW_FORWARD, SW_INVERSE]]
+    solvers = bundleSolvers(problems)
+
+The bundle library has one metadata entry per transform, so solvers created
+later for any of its transforms find their entry points in it.
+"""
+
+from snowwhite import *
+from snowwhite.metadata import findFunctionsWithMetadata, writeMetadataSourceFile
+from snowwhite.registry import solverClassForProblem
+from snowwhite.filelock import FileLock
+from snowwhite.spiral import spiralBuildInfo
+
+import datetime
+import hashlib
+import os
+import sys
+
+
+def _deferredSolvers(problems, opts):
+    """Return solvers describing problems without building, one per distinct transform."""
+    solvers = []
+    namebases = set()
+    for problem in problems:
+        solveropts = dict(opts)
+        solveropts[SW_OPT_DEFER] = True
+        solver = solverClassForProblem(problem)(problem, solveropts)
+        if solver._namebase in namebases:
+            continue
+        namebases.add(solver._namebase)
+        solvers.append(solver)
+    return solvers
+
+
+def _isInstalled(solver):
+    libpath = os.path.join(solver._libsDir, 'lib' + solver._libbase + SW_SHLIB_EXT)
+    if os.path.exists(libpath):
+        return True
+    (path, names) = findFunctionsWithMetadata(solver._metadataForSearch())
+    return path != None
+
+
+def bundleName(problems, opts={}):
+    """Return default library base name for a bundle of problems."""
+    solvers = _deferredSolvers(problems, opts)
+    h = hashlib.sha256('\n'.join(sorted(s._libbase for s in solvers)).encode())
+    return 'bundle_' + h.hexdigest()[:16]
+
+
+def buildBundle(problems, name=None, opts={}, force=False):
+    """Build one library with all problems, return its path.
+
+    Arguments:
+    problems    -- list of problems, any solver type, all built with opts
+    name        -- library base name, default derived from the transforms
+    opts        -- solver options shared by all transforms
+    force       -- build even when every transform is already installed
+
+    Returns None if nothing was built because all transforms were installed.
+    Raises ValueError for problems that cannot share a library.
+    """
+    if len(problems) == 0:
+        raise ValueError('bundle needs at least one problem')
+    if opts.get(SW_OPT_MPI, False):
+        raise ValueError('MPI transforms cannot be bundled')
+    if name == None:
+        name = bundleName(problems, opts)
+    solvers = _deferredSolvers(problems, opts)
+    for solver in solvers:
+        if solver._functionMetadata().get(SW_KEY_TRANSFORMTYPE) == SW_TRANSFORM_UNKNOWN:
+            raise ValueError(type(solver).__name__ + ' has no metadata and cannot be bundled')
+        if solver._libbase == name:
+            raise ValueError('bundle name ' + name + ' is the name of one of its transforms')
+
+    lead = solvers[0]
+    libpath = os.path.join(lead._libsDir, 'lib' + name + SW_SHLIB_EXT)
+    lockfile = os.path.join(lead._libsDir, SW_LOCKSDIR, name + '.lock')
+    with FileLock(lockfile):
+        if not force and all(_isInstalled(s) for s in solvers):
+            return None
+
+        def genScript(filename):
+            try:
+                script_file = open(filename, 'w')
+            except:
+                print('Error: Could not open ' + filename + ' for writing', file=sys.stderr)
+                return
+            timestr = datetime.datetime.now().strftime("%a %b %d %H:%M:%S %Y")
+            print(file = script_file)
+            print('# SPIRAL script generated for bundle ' + name, file = script_file)
+            print('# ' + timestr, file = script_file)
+            for solver in solvers:
+                solver._trace()
+                print(file = script_file)
+                print('# ' + type(solver).__name__ + ' ' + solver._namebase, file = script_file)
+                solver._writeScript(script_file)
+            script_file.close()
+
+        def createMetadata(basename, builddir):
+            transforms = [s._functionMetadata() for s in solvers]
+            types = []
+            for funcmeta in transforms:
+                if funcmeta[SW_KEY_TRANSFORMTYPE] not in types:
+                    types.append(funcmeta[SW_KEY_TRANSFORMTYPE])
+            metadata = dict()
+            metadata[SW_KEY_SPIRALBUILDINFO] = spiralBuildInfo(lead._libsDir)
+            metadata[SW_KEY_TRANSFORMS] = transforms
+            metadata[SW_KEY_TRANSFORMTYPES] = types
+            filename = os.path.join(builddir, basename + SW_METAFILE_EXT)
+            writeMetadataSourceFile(metadata, basename + SW_METAVAR_EXT, filename)
+
+        print('Building bundle ' + name + ' with ' + str(len(solvers)) + ' transforms', flush = True)
+        lead._buildLibrary(name, genScript, createMetadata)
+    if not os.path.exists(libpath):
+        raise RuntimeError('failed to build bundle ' + name)
+    return libpath
+
+
+def bundleSolvers(problems, name=None, opts={}, force=False):
+    """Build bundle if needed, return a solver for each problem in order."""
+    buildBundle(problems, name, opts, force)
+    return [solverClassForProblem(p)(p, dict(opts)) for p in problems]
@@ -0,0 +1,186 @@
+"""
+SnowWhite Request Coalescing
+============================
+
+Gather concurrent solves of the same MDDFT into batched transforms:
+
+    coalescer = BatchCoalescer(MddftProblem([32,32,32]), maxBatch=16, deadline=0.0005)
+    dst = coalescer.solve(src)          # from any number of threads
+
+Requests are queued and collected into one batch buffer until maxBatch
+are waiting or the oldest has waited deadline seconds.  The batch runs as
+one BatchMddftSolver call and each caller's future receives its slice of
+the result.  A request arriving alone runs on the MddftSolver, so latency
+grows by at most the deadline.
+
+Batched libraries are built for powers of two up to maxBatch, a batch of
+five runs on the library for eight, so few sizes need building.
+"""
+
+from snowwhite import *
+
+import concurrent.futures
+import threading
+import time
+
+SW_COALESCE_DEFAULT_BATCH    = 16
+SW_COALESCE_DEFAULT_DEADLINE = 0.001
+
+
+class BatchCoalescer:
+    """Run concurrent solves of one MddftProblem as batched transforms."""
+
+    def __init__(self, problem, opts = {}, maxBatch=SW_COALESCE_DEFAULT_BATCH,
+                 deadline=SW_COALESCE_DEFAULT_DEADLINE):
+        """Set up coalescing for problem.
+
+        Arguments:
+        problem  -- MddftProblem of every request
+        opts     -- solver options, as for MddftSolver
+        maxBatch -- most requests run in one batch
+        deadline -- seconds the oldest request waits for others to join its batch
+        """
+        from snowwhite.mddftsolver import MddftProblem
+        if not isinstance(problem, MddftProblem):
+            raise TypeError("problem must be an MddftProblem")
+        if opts.get(SW_OPT_COLMAJOR, False):
+            raise ValueError('batched transforms need row-major data')
+        self._problem = problem
+        self._opts = dict(opts)
+        self._maxBatch = max(int(maxBatch), 1)
+        self._deadline = float(deadline)
+        self._pending = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._requests = 0
+        self._batches = 0
+        self._batched = 0
+        # the single request solver is set up now, batch solvers on first use
+        self._single = get_solver(problem, self._opts)
+        self._thread = threading.Thread(target=self._dispatch, daemon=True)
+        self._thread.start()
+
+    def maxBatch(self):
+        return self._maxBatch
+
+    def setMaxBatch(self, n):
+        """Set most requests run in one batch."""
+        with self._cond:
+            self._maxBatch = max(int(n), 1)
+            self._cond.notify()
+
+    def deadline(self):
+        return self._deadline
+
+    def setDeadline(self, seconds):
+        """Set seconds the oldest request waits for others to join its batch."""
+        with self._cond:
+            self._deadline = float(seconds)
+            self._cond.notify()
+
+    def submit(self, src):
+        """Queue transform of src, return a concurrent.futures.Future of the result."""
+        if tuple(src.shape) != tuple(self._problem.dimensions()):
+            raise ValueError('src shape ' + str(tuple(src.shape)) + ' does not match problem')
+        future = concurrent.futures.Future()
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('coalescer is closed')
+            self._pending.append((time.monotonic(), src, future))
+            self._requests += 1
+            self._cond.notify()
+        return future
+
+    def solve(self, src):
+        """Transform src, waiting for the batch it joins."""
+        return self.submit(src).result()
+
+    def close(self):
+        """Run the requests still queued and stop the dispatch thread."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+
+    def stats(self):
+        """Return counters for requests and the batches they ran in."""
+        with self._cond:
+            return {'Requests' : self._requests, 'Batches' : self._batches,
+                    'Batched' : self._batched, 'MaxBatch' : self._maxBatch,
+                    'Deadline' : self._deadline}
+
+    def _nextGroup(self):
+        """Wait for a batch to be due, return its requests and maxBatch when collected.
+        
+        Returns ([], maxBatch) once closed and drained.
+        """
+        with self._cond:
+            while True:
+                if len(self._pending) >= self._maxBatch:
+                    break
+                if len(self._pending) > 0:
+                    due = self._pending[0][0] + self._deadline
+                    wait = due - time.monotonic()
+                    if (wait <= 0) or self._closed:
+                        break
+                    self._cond.wait(wait)
+                elif self._closed:
+                    return ([], self._maxBatch)
+                else:
+                    self._cond.wait()
+            # setMaxBatch() may change the limit before the batch runs
+            maxBatch = self._maxBatch
+            group = self._pending[:maxBatch]
+            del self._pending[:maxBatch]
+            return (group, maxBatch)
+
+    def _batchSize(self, n, maxBatch):
+        """Return batch size of library running n requests, a power of two or maxBatch."""
+        b = 1
+        while b < n:
+            b *= 2
+        return min(b, maxBatch)
+
+    def _dispatch(self):
+        while True:
+            (group, maxBatch) = self._nextGroup()
+            if len(group) == 0:
+                return
+            live = [(src, f) for (t, src, f) in group if f.set_running_or_notify_cancel()]
+            if len(live) == 0:
+                continue
+            srcs = [src for (src, f) in live]
+            futures = [f for (src, f) in live]
+            try:
+                if len(srcs) == 1:
+                    results = [self._single.solve(srcs[0])]
+                else:
+                    results = self._solveBatch(srcs, maxBatch)
+            except Exception as ex:
+                for f in futures:
+                    f.set_exception(ex)
+                continue
+            for (f, res) in zip(futures, results):
+                f.set_result(res)
+
+    def _solveBatch(self, srcs, maxBatch):
+        """Gather srcs into a batch buffer, run it, return views of the result per request.
+        
+        maxBatch is the limit when the requests were collected, at least len(srcs).
+        """
+        from snowwhite.batchmddftsolver import BatchMddftProblem
+        b = self._batchSize(len(srcs), maxBatch)
+        dims = self._problem.dimensions()
+        problem = BatchMddftProblem(dims, b, self._problem.direction())
+        solver = get_solver(problem, self._opts)
+
+        xp = get_array_module(srcs[0])
+        buf = xp.zeros((b,) + tuple(dims), srcs[0].dtype)
+        for (i, src) in enumerate(srcs):
+            buf[i] = src
+        dst = solver.solve(buf)
+        with self._cond:
+            self._batches += 1
+            self._batched += len(srcs)
+        # each caller gets its slice, the batch output is freed with the last one
+        return [dst[i] for i in range(len(srcs))]
@@ -0,0 +1,158 @@
+"""
+SnowWhite CPU Features
+======================
+
+Host CPU feature detection and the SIMD instruction sets SnowWhite can
+ask SPIRAL to generate code for.
+"""
+
+from snowwhite import *
+
+import os
+import threading
+
+SW_ISA_SSE2     = 'sse2'
+SW_ISA_AVX      = 'avx'
+SW_ISA_AVX2     = 'avx2'
+SW_ISA_AVX512   = 'avx512'
+
+# ISA -> SPIRAL vector ISA per precision, compiler flags, required CPU flags
+_isaTable = {
+    SW_ISA_SSE2   : {SW_STR_DOUBLE : 'SSE_2x64f',    SW_STR_SINGLE : 'SSE_4x32f',
+                     'Flags' : ['-msse2'],            'Features' : ['sse2']},
+    SW_ISA_AVX    : {SW_STR_DOUBLE : 'AVX_4x64f',    SW_STR_SINGLE : 'AVX_8x32f',
+                     'Flags' : ['-mavx'],             'Features' : ['avx']},
+    SW_ISA_AVX2   : {SW_STR_DOUBLE : 'AVX_4x64f',    SW_STR_SINGLE : 'AVX_8x32f',
+                     'Flags' : ['-mavx2', '-mfma'],   'Features' : ['avx2', 'fma']},
+    SW_ISA_AVX512 : {SW_STR_DOUBLE : 'AVX512_8x64f', SW_STR_SINGLE : 'AVX512_16x32f',
+                     'Flags' : ['-mavx512f'],         'Features' : ['avx512f']},
+}
+
+_hostFeatures = None
+_hostFeaturesRead = False
+_hostFeaturesLock = threading.Lock()
+
+
+def _readCPUInfo():
+    """Return set of CPU flags in /proc/cpuinfo, None if not available."""
+    try:
+        with open('/proc/cpuinfo', 'r') as f:
+            for line in f:
+                (key, sep, value) = line.partition(':')
+                # 'flags' on x86, 'Features' on ARM, identical for every core
+                if sep and (key.strip() in ('flags', 'Features')):
+                    return set(value.split())
+    except OSError:
+        pass
+    return None
+
+
+def hostCPUFeatures():
+    """Return frozenset of host CPU feature flags, None if unknown."""
+    global _hostFeatures, _hostFeaturesRead
+    with _hostFeaturesLock:
+        if not _hostFeaturesRead:
+            features = _readCPUInfo()
+            _hostFeatures = None if features == None else frozenset(features)
+            _hostFeaturesRead = True
+        return _hostFeatures
+
+
+def _resetHostFeaturesLockAfterFork():
+    # another thread may have held the lock when the process forked
+    global _hostFeaturesLock
+    _hostFeaturesLock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetHostFeaturesLockAfterFork)
+
+
+def isaNames():
+    """Return names of the supported vector ISAs."""
+    return sorted(_isaTable)
+
+
+def isaSpiralName(isa, precision=SW_STR_DOUBLE):
+    """Return SPIRAL vector ISA for isa and precision ('Double' or 'Single')."""
+    if isa not in _isaTable:
+        raise ValueError('unknown vector ISA: ' + str(isa))
+    return _isaTable[isa][precision]
+
+
+def isaCompileFlags(isa):
+    """Return C compiler flags enabling isa."""
+    if isa not in _isaTable:
+        raise ValueError('unknown vector ISA: ' + str(isa))
+    return list(_isaTable[isa]['Flags'])
+
+
+def isaFeatures(isa):
+    """Return CPU feature flags required to run code for isa."""
+    if isa not in _isaTable:
+        raise ValueError('unknown vector ISA: ' + str(isa))
+    return list(_isaTable[isa]['Features'])
+
+
+def isaSupported(isa, features=None):
+    """Return True if the host, or a CPU with features, can run code for isa."""
+    if isa not in _isaTable:
+        return False
+    return featuresSupported(_isaTable[isa]['Features'], features)
+
+
+# x86 extensions compilers may use with -march, in /proc/cpuinfo spelling
+# (pni is SSE3)
+_x86Extensions = ['pni', 'ssse3', 'sse4_1', 'sse4_2', 'popcnt', 'avx', 'avx2', 'fma', 'f16c',
+                  'bmi1', 'bmi2', 'movbe', 'abm', 'adx', 'avx512f', 'avx512cd', 'avx512dq',
+                  'avx512bw', 'avx512vl', 'avx512_vnni', 'avx512_bf16']
+
+_x86v2 = ['pni', 'ssse3', 'sse4_1', 'sse4_2', 'popcnt']
+_x86v3 = _x86v2 + ['avx', 'avx2', 'fma', 'f16c', 'bmi1', 'bmi2', 'movbe', 'abm']
+_x86v4 = _x86v3 + ['avx512f', 'avx512cd', 'avx512dq', 'avx512bw', 'avx512vl']
+
+# -march value -> CPU flags the generated code may require
+_marchTable = {
+    'x86-64'         : [],
+    'x86-64-v2'      : _x86v2,
+    'x86-64-v3'      : _x86v3,
+    'x86-64-v4'      : _x86v4,
+    'haswell'        : _x86v3,
+    'broadwell'      : _x86v3 + ['adx'],
+    'skylake'        : _x86v3 + ['adx'],
+    'skylake-avx512' : _x86v4 + ['adx'],
+    'cascadelake'    : _x86v4 + ['adx', 'avx512_vnni'],
+    'icelake-server' : _x86v4 + ['adx', 'avx512_vnni'],
+    'sapphirerapids' : _x86v4 + ['adx', 'avx512_vnni', 'avx512_bf16'],
+    'znver2'         : _x86v3 + ['adx'],
+    'znver3'         : _x86v3 + ['adx'],
+    'znver4'         : _x86v4 + ['adx', 'avx512_vnni', 'avx512_bf16'],
+}
+
+
+def marchFeatures(march):
+    """Return CPU flags required by code compiled with -march=march, None if unknown.
+    
+    For 'native' these are the extensions of the host CPU.
+    """
+    if march == None:
+        return []
+    if march == 'native':
+        host = hostCPUFeatures()
+        if host == None:
+            return None
+        return [f for f in _x86Extensions if f in host]
+    features = _marchTable.get(march)
+    return None if features == None else list(features)
+
+
+def featuresSupported(features, hostFeatures=None):
+    """Return True if the host, or a CPU with hostFeatures, has all features.
+    
+    If the host's features are unknown, e.g. without /proc/cpuinfo, they are
+    assumed to be supported rather than rejecting all specific code.
+    """
+    if hostFeatures == None:
+        hostFeatures = hostCPUFeatures()
+        if hostFeatures == None:
+            return True
+    return all(f in hostFeatures for f in features)
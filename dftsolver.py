@@ -2,13 +2,6 @@
 from snowwhite import *
 from snowwhite.swsolver import *
 import numpy as np
-try:
-    import cupy as cp
-except ModuleNotFoundError:
-    cp = None
-import ctypes
-import sys
-import random
 
 class DftProblem(SWProblem):
     """Define 1D DFT problem."""
@@ -56,12 +49,31 @@ class DftSolver(SWSolver):
 
         return FFT
         
+    def buildTestInput(self):
+        n = self._problem.dimN()
+        cxtype = np.csingle if self._opts.get(SW_OPT_REALCTYPE) == "float" else np.cdouble
+        src = (np.random.random(n) + 1j * np.random.random(n)).astype(cxtype)
+        if self._genCuda or self._genHIP:
+            src = get_cupy().asarray(src)
+        return src
+
+    def _tuneVariants(self, count):
+        if self._genCuda or self._genHIP:
+            return self._unrollingVariants(count)
+        # default rule tree, then random rule trees
+        variants = [dict()]
+        for seed in range(1, count):
+            variants.append({'RuleTree' : 'Random', 'Seed' : seed})
+        return variants
+        
     def _trace(self):
         pass
 
     def solve(self, src, dst=None):
         """Call SPIRAL-generated function."""
         ##  print('DftSolver.solve:')
+        if not self._useLibrary():
+            return self._solveDef(dst, src)
         if type(dst) == type(None):
             xp = get_array_module(src)
             n = self._problem.dimN()
@@ -100,6 +112,8 @@ class DftSolver(SWSolver):
         else:
             print("conf := LocalConfig.fftx.defaultConf();", file = script_file) 
         print("opts := conf.getOpts(t);", file = script_file)
+        self._writeVariantOpts(script_file)
+        self._writeVectorOpts(script_file)
         print('opts.wrapCFuncs := true;', file = script_file)
 
         if self._opts.get(SW_OPT_REALCTYPE) == "float":
@@ -120,7 +134,12 @@ class DftSolver(SWSolver):
         nameroot = self._namebase
         filetype = '.c'
         
-        print("opts := SpiralDefaults;", file = script_file)
+        if self._isa != None:
+            # SIMD opts set the real type from the vector ISA
+            print("Import(paradigms.vector);", file = script_file)
+            print("opts := SIMDGlobals.getOpts(" + self._spiralISA() + ");", file = script_file)
+        else:
+            print("opts := SpiralDefaults;", file = script_file)
         
         if self._opts.get(SW_OPT_REALCTYPE) == "float":
             print('opts.TRealCtype := "float";', file = script_file)
@@ -134,7 +153,14 @@ class DftSolver(SWSolver):
             print('transform := Scale(1/n, DFT(n, ' + str (self._problem.direction()) + '));', file = script_file)
         else:
             print('transform := DFT(n, ' + str (self._problem.direction()) + ');', file = script_file)
-        print('ruletree  := RuleTreeMid(transform, opts);', file = script_file)
+        if self._isa != None:
+            # vector rules work on complex data as interleaved real vectors
+            print('transform := TRC(transform).withTags(opts.tags);', file = script_file)
+        if self._variant.get('RuleTree') == 'Random':
+            print('RandomSeed(' + str(self._variant.get('Seed', 1)) + ');', file = script_file)
+            print('ruletree  := RandomRuleTree(transform, opts);', file = script_file)
+        else:
+            print('ruletree  := RuleTreeMid(transform, opts);', file = script_file)
         print('code      := CodeRuleTree(ruletree, opts);', file = script_file)
         print('PrintTo("' + nameroot + filetype + '", PrintCode(nameroot, code, opts));', 
             file = script_file)
@@ -14,6 +14,10 @@ usage: run-dft.py size [ F|I [ d|s [ GPU|CPU ]]]
 import snowwhite as sw
 from snowwhite.dftsolver import *
 import numpy as np
+try:
+    import cupy as cp
+except ModuleNotFoundError:
+    cp = None
 import sys
 
 def usage():
@@ -28,6 +28,8 @@ class HockneyProblem(SWProblem):
 
 
 class HockneySolver(SWSolver):
+    _threadsSupported = True
+    
     def __init__(self, problem: HockneyProblem, opts = {}):
         if not isinstance(problem, HockneyProblem):
             raise TypeError("problem must be a HockneyProblem")
@@ -89,6 +91,13 @@ class HockneySolver(SWSolver):
     def solve(self, src, dst=None):
         """Call SPIRAL-generated code"""
         
+        if not self._useLibrary():
+            # solve() output is unscaled, see scale()
+            N = self._problem.dimN()
+            dst = self._solveDef(dst, src)
+            dst *= N**3
+            return dst
+        
         if type(dst) == type(None):
             Nd = self._problem.dimND()
             dst = np.zeros((Nd,Nd,Nd), dtype=np.double)
@@ -134,11 +143,16 @@ class HockneySolver(SWSolver):
         if self._genCuda:
             print("conf := FFTXGlobals.confHockneyMlcCUDADevice();", file = script_file)
             print("opts := FFTXGlobals.getOpts(conf);", file = script_file)
+            self._writeVariantOpts(script_file)
+            self._writeVectorOpts(script_file)
             print("opts.devFunc := true;", file = script_file)
             print('opts.wrapCFuncs := true;', file = script_file)
         else:
             print("conf := FFTXGlobals.mdRConv();", file = script_file)
             print("opts := FFTXGlobals.getOpts(conf);", file = script_file)
+            self._writeVariantOpts(script_file)
+            self._writeVectorOpts(script_file)
+            self._writeThreadOpts(script_file)
             print("opts.preProcess := (self, t) >> t;", file = script_file)
         if self._printRuleTree:
             print("opts.printRuleTree := true;", file = script_file)
@@ -0,0 +1,302 @@
+"""
+SnowWhite Library Cache Housekeeping
+====================================
+
+List, verify and garbage collect the libraries in .libs and the
+directories in SW_LIBRARY_PATH, and the build cache entries.
+
+The last use of a library is recorded by touching a marker file in the
+.usage subdirectory of its directory when a process first loads it, since
+access times are often not maintained.  Library metadata comes from the
+directory index, so listing never rescans unchanged libraries.
+"""
+
+from snowwhite import *
+from snowwhite.metadata import libraryDirs, metadataIndexForDir
+from snowwhite.filelock import FileLock
+from snowwhite.buildcache import SW_BUILDCACHE_SOURCES, SW_BUILDCACHE_LIBS
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+
+SW_USAGEDIR = '.usage'
+
+
+def _usageMarker(path):
+    return os.path.join(os.path.dirname(path), SW_USAGEDIR, os.path.basename(path))
+
+
+def markLibraryUsed(path):
+    """Record that the library at path was loaded now, ignoring read-only directories."""
+    marker = _usageMarker(path)
+    try:
+        try:
+            os.utime(marker)
+        except FileNotFoundError:
+            os.makedirs(os.path.dirname(marker), exist_ok=True)
+            with open(marker, 'a'):
+                pass
+    except OSError:
+        pass
+
+
+def lastUse(path):
+    """Return time of last recorded use of library, or its modification time."""
+    try:
+        return os.stat(_usageMarker(path)).st_mtime
+    except OSError:
+        pass
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return 0.0
+
+
+def _libraryBasename(filename):
+    """Return namebase of library file name, as used for its build lock."""
+    name = filename[:-len(SW_SHLIB_EXT)] if filename.endswith(SW_SHLIB_EXT) else filename
+    return name[3:] if name.startswith('lib') else name
+
+
+def cacheEntries(dirs=None):
+    """Return list of dicts describing installed libraries, least recently used first.
+
+    Each has Path, Size, LastUse (seconds since the epoch) and Metadata (None
+    for libraries without metadata).
+    """
+    if dirs == None:
+        dirs = libraryDirs()
+    entries = []
+    for libdir in dirs:
+        if not os.path.isdir(libdir):
+            continue
+        for (filename, metadata) in metadataIndexForDir(libdir).items():
+            path = os.path.join(libdir, filename)
+            try:
+                size = os.stat(path).st_size
+            except OSError:
+                continue
+            entries.append({'Path' : path, 'Size' : size, 'LastUse' : lastUse(path),
+                            'Metadata' : metadata})
+    entries.sort(key = lambda e: e['LastUse'])
+    return entries
+
+
+# run in a separate process, so a library that crashes on load cannot take us down
+_verifyScript = '''
+import ctypes, json, sys
+lib = ctypes.CDLL(sys.argv[1])
+missing = [n for n in json.loads(sys.argv[2]) if getattr(lib, n, None) == None]
+if len(missing) > 0:
+    print('missing functions: ' + ' '.join(missing))
+    sys.exit(1)
+'''
+
+
+def verifyLibrary(path, metadata=None):
+    """Check that the library loads and has the functions in its metadata.
+
+    Returns (ok, message).
+    """
+    names = []
+    if type(metadata) is dict:
+        for xform in metadata.get(SW_KEY_TRANSFORMS, []):
+            names += list(xform.get(SW_KEY_NAMES, {}).values())
+    try:
+        res = subprocess.run([sys.executable, '-c', _verifyScript, path, json.dumps(names)],
+                             stdout=subprocess.PIPE, stderr=subprocess.STDOUT, timeout=60)
+    except subprocess.TimeoutExpired:
+        return (False, 'timed out loading library')
+    output = res.stdout.decode(errors='replace').strip()
+    if res.returncode != 0:
+        lines = output.split('\n')
+        return (False, lines[-1] if output else 'exit code ' + str(res.returncode))
+    return (True, 'ok')
+
+
+def _removeLibrary(path):
+    """Remove library and its usage marker under its build lock, return True if removed."""
+    from snowwhite.swsolver import libraryInUse
+    libdir = os.path.dirname(path)
+    lockfile = os.path.join(libdir, SW_LOCKSDIR, _libraryBasename(os.path.basename(path)) + '.lock')
+    lock = FileLock(lockfile)
+    try:
+        # skip libraries being built rather than wait for the build
+        if not lock.acquire(blocking=False):
+            return False
+        try:
+            # processes that loaded the library keep their mapping, but this
+            # process would reload a different file under the same name
+            if libraryInUse(path):
+                return False
+            os.remove(path)
+        finally:
+            lock.release()
+    except OSError:
+        return False
+    try:
+        os.remove(_usageMarker(path))
+    except OSError:
+        pass
+    return True
+
+
+def _buildCacheRoots(dirs):
+    """Return build cache directories of the library directories dirs, or the default one."""
+    if dirs == None:
+        return [os.getenv(SW_BUILDCACHE, os.path.join(libraryDirs()[0], SW_BUILDCACHEDIR))]
+    return [os.path.join(d, SW_BUILDCACHEDIR) for d in dirs]
+
+
+def buildCacheEntries(roots):
+    """Return list of dicts describing build cache entries, least recently used first.
+
+    Each has Path of the entry directory, Size of its files and LastUse.
+    """
+    entries = []
+    for root in roots:
+        for level in [SW_BUILDCACHE_SOURCES, SW_BUILDCACHE_LIBS]:
+            leveldir = os.path.join(root, level)
+            if not os.path.isdir(leveldir):
+                continue
+            for prefix in os.listdir(leveldir):
+                prefixdir = os.path.join(leveldir, prefix)
+                if not os.path.isdir(prefixdir):
+                    continue
+                for key in os.listdir(prefixdir):
+                    # entries being stored are temporary directories
+                    if key.endswith('.tmp'):
+                        continue
+                    path = os.path.join(prefixdir, key)
+                    try:
+                        size = sum(os.stat(os.path.join(path, f)).st_size for f in os.listdir(path))
+                        last = os.stat(path).st_mtime
+                    except OSError:
+                        continue
+                    entries.append({'Path' : path, 'Size' : size, 'LastUse' : last})
+    entries.sort(key = lambda e: e['LastUse'])
+    return entries
+
+
+def _removeBuildCacheEntry(path):
+    """Remove build cache entry, return True if removed.
+
+    The entry is renamed first, so a build never sees it half removed.
+    """
+    trash = path + '.' + str(os.getpid()) + '.del.tmp'
+    try:
+        os.rename(path, trash)
+    except OSError:
+        return False
+    shutil.rmtree(trash, ignore_errors=True)
+    return True
+
+
+def collectGarbage(quota, dirs=None, dryRun=False):
+    """Remove least recently used libraries and build cache entries until
+    those of dirs use at most quota bytes.
+
+    dirs defaults to .libs only, with the build cache SW_BUILDCACHE or
+    .libs/buildcache.  Directories shared through SW_LIBRARY_PATH are cleaned
+    only when listed explicitly, with their buildcache subdirectory.
+    Libraries that are being built or loaded by this process are kept.
+    Returns the list of entries removed, or that would be removed with dryRun.
+    """
+    roots = _buildCacheRoots(dirs)
+    if dirs == None:
+        dirs = libraryDirs()[:1]
+    candidates = [(e, _removeLibrary) for e in cacheEntries(dirs)]
+    candidates += [(e, _removeBuildCacheEntry) for e in buildCacheEntries(roots)]
+    candidates.sort(key = lambda c: c[0]['LastUse'])
+    total = sum(e['Size'] for (e, remove) in candidates)
+    removed = []
+    for (entry, remove) in candidates:
+        if total <= quota:
+            break
+        if dryRun or remove(entry['Path']):
+            total -= entry['Size']
+            removed.append(entry)
+
+    # bring the directory indexes up to date now, rather than on next lookup
+    if not dryRun:
+        for libdir in dirs:
+            if os.path.isdir(libdir):
+                metadataIndexForDir(libdir)
+    return removed
+
+
+def parseSize(text):
+    """Return bytes for a size such as 500M or 2G."""
+    units = {'K' : 1 << 10, 'M' : 1 << 20, 'G' : 1 << 30, 'T' : 1 << 40}
+    text = text.strip().upper().rstrip('B')
+    if (len(text) > 0) and (text[-1] in units):
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def formatSize(n):
+    for unit in ['B', 'K', 'M', 'G']:
+        if n < 1024:
+            return '{:.0f}{}'.format(n, unit) if unit == 'B' else '{:.1f}{}'.format(n, unit)
+        n /= 1024.0
+    return '{:.1f}T'.format(n)
+
+
+def _describe(metadata):
+    """Return short description of the transforms in a library's metadata."""
+    if not type(metadata) is dict:
+        return '(no metadata)'
+    descs = []
+    for xform in metadata.get(SW_KEY_TRANSFORMS, []):
+        dims = 'x'.join(str(n) for n in xform.get(SW_KEY_DIMENSIONS, []))
+        descs.append(' '.join(str(x) for x in [xform.get(SW_KEY_TRANSFORMTYPE), dims,
+                     xform.get(SW_KEY_DIRECTION), xform.get(SW_KEY_PRECISION),
+                     xform.get(SW_KEY_PLATFORM)]))
+    return '; '.join(descs)
+
+
+def main(args):
+    """Command line entry: cache list, verify and gc."""
+    dirs = args.dirs if args.dirs else None
+
+    if args.action == 'list':
+        entries = cacheEntries(dirs)
+        if args.json:
+            print(json.dumps(entries, indent=1, sort_keys=True))
+            return 0
+        for e in entries:
+            stamp = time.strftime('%Y-%m-%d %H:%M', time.localtime(e['LastUse']))
+            print('{:>8}  {}  {}  {}'.format(formatSize(e['Size']), stamp, e['Path'], _describe(e['Metadata'])))
+        print('{} libraries, {}'.format(len(entries), formatSize(sum(e['Size'] for e in entries))))
+        return 0
+
+    if args.action == 'verify':
+        nfailed = 0
+        for e in cacheEntries(dirs):
+            (ok, msg) = verifyLibrary(e['Path'], e['Metadata'])
+            if not ok:
+                nfailed += 1
+            print('{:6}  {}{}'.format('ok' if ok else 'FAILED', e['Path'], '' if ok else '  (' + msg + ')'))
+        return 1 if nfailed > 0 else 0
+
+    if args.action == 'gc':
+        if args.quota == None:
+            print('gc needs --quota', file=sys.stderr)
+            return 2
+        try:
+            quota = parseSize(args.quota)
+        except ValueError:
+            quota = -1
+        if quota < 0:
+            print('Could not read --quota ' + args.quota + ', expected a size such as 500M or 2G', file=sys.stderr)
+            return 1
+        removed = collectGarbage(quota, dirs, args.dry_run)
+        for e in removed:
+            print(('would remove ' if args.dry_run else 'removed ') + e['Path'])
+        print('{} entries, {} freed'.format(len(removed), formatSize(sum(e['Size'] for e in removed))))
+        return 0
+    return 2
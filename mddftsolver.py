@@ -3,11 +3,6 @@ from snowwhite import *
 from snowwhite.swsolver import *
 import numpy as np
 
-try:
-    import cupy as cp
-except ModuleNotFoundError:
-    cp = None
-
 
 class MddftProblem(SWProblem):
     """Define Multi-dimention DFT problem."""
@@ -23,6 +18,8 @@ class MddftProblem(SWProblem):
         
 
 class MddftSolver(SWSolver):
+    _threadsSupported = True
+    
     def __init__(self, problem: MddftProblem, opts = {}):
         if not isinstance(problem, MddftProblem):
             raise TypeError("problem must be an MddftProblem")
@@ -56,11 +53,26 @@ class MddftSolver(SWSolver):
 
         return FFT
         
+    def buildTestInput(self):
+        dims = tuple(self._problem.dimensions())
+        cxtype = np.csingle if self._opts.get(SW_OPT_REALCTYPE) == "float" else np.cdouble
+        ordc = 'F' if self._colMajor else 'C'
+        src = np.asarray(np.random.random(dims) + 1j * np.random.random(dims), cxtype, order=ordc)
+        if self._genCuda or self._genHIP:
+            src = get_cupy().asarray(src, order=ordc)
+        return src
+
+    def _tuneVariants(self, count):
+        return self._unrollingVariants(count)
+        
     def _trace(self):
         pass
 
     def solve(self, src, dst=None):
         """Call SPIRAL-generated function."""
+        
+        if not self._useLibrary():
+            return self._solveDef(dst, src)
    
         if type(dst) == type(None):
             xp = get_array_module(src)
@@ -105,6 +117,9 @@ class MddftSolver(SWSolver):
 
         print('', file = script_file)
         print("opts := conf.getOpts(t);", file = script_file)
+        self._writeVariantOpts(script_file)
+        self._writeVectorOpts(script_file)
+        self._writeThreadOpts(script_file)
         if self._genCuda or self._genHIP:
             print('opts.wrapCFuncs := true;', file = script_file)
 
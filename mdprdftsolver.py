@@ -7,11 +7,6 @@ from snowwhite import *
 from snowwhite.swsolver import *
 import numpy as np
 
-try:
-    import cupy as cp
-except ModuleNotFoundError:
-    cp = None
-
 
 class MdprdftProblem(SWProblem):
     """
@@ -37,6 +32,8 @@ class MdprdftProblem(SWProblem):
         
 
 class MdprdftSolver(SWSolver):
+    _threadsSupported = True
+    
     def __init__(self, problem: MdprdftProblem, opts = {}):
         if not isinstance(problem, MdprdftProblem):
             raise TypeError("problem must be an MddftProblem")
@@ -74,12 +71,30 @@ class MdprdftSolver(SWSolver):
 
         return dst
         
+    def buildTestInput(self):
+        dims = tuple(self._problem.dimensions())
+        src = np.random.random(dims).astype(self._ftype)
+        if self._problem.direction() == SW_INVERSE:
+            # spectrum of a real array, so the inverse is real
+            src = np.fft.rfftn(src).astype(self._cxtype)
+        ordc = 'F' if self._colMajor else 'C'
+        src = np.asarray(src, order=ordc)
+        if self._genCuda or self._genHIP:
+            src = get_cupy().asarray(src, order=ordc)
+        return src
+
+    def _tuneVariants(self, count):
+        return self._unrollingVariants(count)
+        
     def _trace(self):
         pass
 
     def solve(self, src, dst=None):
         """Call SPIRAL-generated function."""
         
+        if not self._useLibrary():
+            return self._solveDef(dst, src)
+        
         if type(dst) == type(None):
             xp = get_array_module(src)
             if self._problem.direction() == SW_FORWARD:
@@ -130,6 +145,9 @@ class MdprdftSolver(SWSolver):
         print(");", file = script_file)        
 
         print("opts := conf.getOpts(t);", file = script_file)
+        self._writeVariantOpts(script_file)
+        self._writeVectorOpts(script_file)
+        self._writeThreadOpts(script_file)
         if self._genCuda or self._genHIP:
             print('opts.wrapCFuncs := true;', file = script_file)
 
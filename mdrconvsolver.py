@@ -11,11 +11,6 @@ import numpy as np
 import ctypes
 import sys
 
-try:
-    import cupy as cp
-except ModuleNotFoundError:
-    cp = None
-
 class MdrconvProblem(SWProblem):
     """define cyclic convolution problem."""
 
@@ -32,6 +27,8 @@ class MdrconvProblem(SWProblem):
 
 
 class MdrconvSolver(SWSolver):
+    _threadsSupported = True
+    
     def __init__(self, problem: MdrconvProblem, opts = {}):
         if not isinstance(problem, MdrconvProblem):
             raise TypeError("problem must be an MdrconvProblem")
@@ -81,6 +78,9 @@ class MdrconvSolver(SWSolver):
             N = shape[0]
             Nx = (N // 2) + 1
             sym = xp.ascontiguousarray(sym[:, :, :Nx])
+        
+        if not self._useLibrary():
+            return self._solveDef(dst, src, sym)
                 
         N = self._problem.dimN()        
         if type(dst) == type(None):
@@ -143,6 +143,9 @@ class MdrconvSolver(SWSolver):
         print(");", file = script_file)
         print("", file = script_file)
         print("opts := conf.getOpts(t);", file = script_file)
+        self._writeVariantOpts(script_file)
+        self._writeVectorOpts(script_file)
+        self._writeThreadOpts(script_file)
 
         if self._genCuda or self._genHIP:
             print('opts.wrapCFuncs := true;', file = script_file)
@@ -162,7 +165,7 @@ class MdrconvSolver(SWSolver):
     def buildTestInput(self):
         """ Build test input cube """
         
-        xp = cp if self._genCuda or self._genHIP else np
+        xp = get_cupy() if self._genCuda or self._genHIP else np
         n = self._problem.dimN()
         
         testSrc = xp.random.rand(n,n,n).astype(self._ftype)
@@ -176,6 +179,9 @@ class MdrconvSolver(SWSolver):
         
         return (testSrc, testSym)
     
+    def _tuneVariants(self, count):
+        return self._unrollingVariants(count)
+        
     def _setFunctionMetadata(self, obj):
         obj[SW_KEY_TRANSFORMTYPE] = SW_TRANSFORM_MDRCONV
      
@@ -5,11 +5,6 @@ import numpy as np
 import ctypes
 import sys
 
-try:
-    import cupy as cp
-except ModuleNotFoundError:
-    cp = None
-
 class MdrfsconvProblem(SWProblem):
     """Define Mdrfsconv problem."""
 
@@ -81,6 +76,9 @@ class MdrfsconvSolver(SWSolver):
             N = shape[0]
             Nx = (N // 2) + 1
             sym = xp.ascontiguousarray(sym[:, :, :Nx])
+        
+        if not self._useLibrary():
+            return self._solveDef(dst, src, sym)
                 
         N = self._problem.dimN()        
         if type(dst) == type(None):
@@ -143,6 +141,8 @@ class MdrfsconvSolver(SWSolver):
         print(");", file = script_file)
         print("", file = script_file)
         print("opts := conf.getOpts(t);", file = script_file)
+        self._writeVariantOpts(script_file)
+        self._writeVectorOpts(script_file)
 
         if self._genCuda or self._genHIP:
             print('opts.wrapCFuncs := true;', file = script_file)
@@ -162,7 +162,7 @@ class MdrfsconvSolver(SWSolver):
     def buildTestInput(self):
         """ Build test input cube """
         
-        xp = cp if self._genCuda or self._genHIP else np
+        xp = get_cupy() if self._genCuda or self._genHIP else np
         n = self._problem.dimN()
         
         testSrc = xp.random.rand(n,n,n).astype(self._ftype)
@@ -172,6 +172,9 @@ class MdrfsconvSolver(SWSolver):
         
         return (testSrc, testSym)
     
+    def _tuneVariants(self, count):
+        return self._unrollingVariants(count)
+        
     def _setFunctionMetadata(self, obj):
         obj[SW_KEY_TRANSFORMTYPE] = SW_TRANSFORM_MDRFSCONV
      
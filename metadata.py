@@ -1,39 +1,300 @@
 
 from snowwhite import *
+from snowwhite.cpufeatures import isaSupported, featuresSupported
 
 import json
 import glob
+import mmap
 import os
+import struct
 import sys
+import tempfile
+import threading
+import time
 
-def metadataInFile(filename):
-    """extract metadata from binary file."""
+# version of the on-disk metadata index format
+SW_INDEX_VERSION = 1
+# seconds between checks of indexed libraries for in-place replacement
+SW_INDEX_RECHECK_SECONDS = 5.0
+
+# directory of libraries built by SnowWhite itself
+_moduleLibsDir = os.path.join(os.path.dirname(os.path.realpath(__file__)), SW_LIBSDIR)
+
+# per-process caches of directory indexes and lookup results
+_indexLock = threading.RLock()
+_dirIndexes = dict()
+_lookupCache = dict()
+_indexStats = {'Hits' : 0, 'Misses' : 0, 'NegativeHits' : 0, 'FilesScanned' : 0}
+# bumped whenever a directory index is rebuilt, lookup results of older generations are stale
+_indexGeneration = 0
+
+def _resetIndexLockAfterFork():
+    # another thread may have held the lock when the process forked
+    global _indexLock
+    _indexLock = threading.RLock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetIndexLockAfterFork)
+
+
+def _elfDataSections(buff):
+    """Return list of (offset, size) of ELF data sections, or None if not ELF."""
+    if buff[:4] != b'\x7fELF':
+        return None
+    endian = '<' if buff[5] == 1 else '>'
+    try:
+        if buff[4] == 2:
+            # 64-bit
+            (shoff,) = struct.unpack_from(endian + 'Q', buff, 0x28)
+            (shentsize, shnum, shstrndx) = struct.unpack_from(endian + 'HHH', buff, 0x3A)
+            hdrfmt = endian + 'II8x8xQQ'
+        else:
+            # 32-bit
+            (shoff,) = struct.unpack_from(endian + 'I', buff, 0x20)
+            (shentsize, shnum, shstrndx) = struct.unpack_from(endian + 'HHH', buff, 0x2E)
+            hdrfmt = endian + 'II4x4xII'
+        headers = [struct.unpack_from(hdrfmt, buff, shoff + i * shentsize) for i in range(shnum)]
+        stroff = headers[shstrndx][2]
+        sections = []
+        for (name, shtype, offset, size) in headers:
+            # skip SHT_NOBITS (.bss), it has no file contents
+            if shtype == 8:
+                continue
+            nameend = buff.find(b'\0', stroff + name)
+            secname = buff[stroff + name:nameend]
+            if secname.startswith(b'.rodata') or secname.startswith(b'.data'):
+                sections.append((offset, size))
+        return sections
+    except (struct.error, IndexError):
+        return None
+
+
+def _metadataInRange(buff, start, end):
     bstr = bytes(SW_METADATA_START, 'utf-8')
     estr = bytes(SW_METADATA_END, 'utf-8')
-    with open(filename, 'rb') as f:
-        buff = f.read()
-        if bstr in buff:
-            b = buff.find(bstr) + len(bstr)
-            e = buff.find(estr)
-            metabytes = buff[b:e]
-            metaobj = json.loads(metabytes)
-            return metaobj
-        else:
+    b = buff.find(bstr, start, end)
+    if b < 0:
+        return None
+    b = b + len(bstr)
+    e = buff.find(estr, b, end)
+    if e < 0:
+        return None
+    return json.loads(buff[b:e])
+
+
+def metadataInFile(filename):
+    """extract metadata from binary file."""
+    try:
+        with open(filename, 'rb') as f:
+            buff = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        # unreadable or empty file
+        return None
+    with buff:
+        # search only data sections of ELF libraries, which keeps large
+        # GPU fat binaries from being paged in
+        sections = _elfDataSections(buff)
+        if sections != None:
+            for (offset, size) in sections:
+                metaobj = _metadataInRange(buff, offset, offset + size)
+                if metaobj != None:
+                    return metaobj
+            # the compiler puts the metadata string in a data section, an
+            # ELF library without it there has none
             return None
+        # not ELF, e.g. a DLL, search the whole file
+        return _metadataInRange(buff, 0, len(buff))
 
 
 def metadataInDir(path):
     """Assemble metadata from shared library files in directory."""
+    libs = metadataIndexForDir(path)
     metalist = []
-    filepat = os.path.join(path, '*' + SW_SHLIB_EXT)
-    files = glob.glob(filepat)
-    for filename in files:
-        metaobj = metadataInFile(filename)
+    for filename in sorted(libs):
+        metaobj = libs[filename]
         if metaobj != None:
-            metalist.append({SW_KEY_FILENAME:filename, SW_KEY_METADATA:metaobj})
+            metalist.append({SW_KEY_FILENAME:os.path.join(path, filename), SW_KEY_METADATA:metaobj})
     return metalist
 
 
+def _fileSignature(path):
+    try:
+        st = os.stat(path)
+        return (st.st_mtime_ns, st.st_size)
+    except OSError:
+        return None
+
+
+def _dirSignature(path):
+    """Return signature of directory and its index file, None if no directory.
+    
+    Rewriting the index leaves the directory mtime alone, so the index file
+    is part of the signature.  So does replacing a library in place, which
+    _dirIndex() notices by checking the indexed files every
+    SW_INDEX_RECHECK_SECONDS.
+    """
+    dirsig = _fileSignature(path)
+    if dirsig == None:
+        return None
+    return (dirsig[0], _fileSignature(os.path.join(path, SW_INDEXFILE)))
+
+
+def _filesUnchanged(path, libs):
+    """Return True if every indexed library still has its recorded mtime and size."""
+    for (filename, entry) in libs.items():
+        sig = _fileSignature(os.path.join(path, filename))
+        if sig != (entry.get(SW_KEY_MTIME), entry.get(SW_KEY_SIZE)):
+            return False
+    return True
+
+
+def _writeIndexFile(path, libs):
+    """Atomically replace the index file in path, ignoring unwritable directories."""
+    index = {SW_KEY_VERSION : SW_INDEX_VERSION, SW_KEY_LIBRARIES : libs}
+    try:
+        (fd, tmpname) = tempfile.mkstemp('.tmp', SW_INDEXFILE + '.', path)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f, sort_keys=True)
+        os.chmod(tmpname, 0o644)
+        os.replace(tmpname, os.path.join(path, SW_INDEXFILE))
+    except OSError:
+        try:
+            os.remove(tmpname)
+        except:
+            pass
+
+
+def _readIndexFile(path):
+    try:
+        with open(os.path.join(path, SW_INDEXFILE), 'r') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return dict()
+    if not type(index) is dict or index.get(SW_KEY_VERSION) != SW_INDEX_VERSION:
+        return dict()
+    return index.get(SW_KEY_LIBRARIES, dict())
+
+
+def _refreshDirIndex(path):
+    """Bring the on-disk index of path up to date, scanning only new or changed libraries."""
+    entries = _readIndexFile(path)
+    libs = dict()
+    changed = False
+    filepat = os.path.join(path, '*' + SW_SHLIB_EXT)
+    for fullname in glob.glob(filepat):
+        filename = os.path.basename(fullname)
+        try:
+            st = os.stat(fullname)
+        except OSError:
+            continue
+        entry = entries.get(filename)
+        if ((type(entry) is dict) and (entry.get(SW_KEY_MTIME) == st.st_mtime_ns) and 
+            (entry.get(SW_KEY_SIZE) == st.st_size)):
+            libs[filename] = entry
+            continue
+        _indexStats['FilesScanned'] += 1
+        libs[filename] = {SW_KEY_MTIME : st.st_mtime_ns, SW_KEY_SIZE : st.st_size,
+                          SW_KEY_METADATA : metadataInFile(fullname)}
+        changed = True
+    if changed or (len(libs) != len(entries)):
+        _writeIndexFile(path, libs)
+    return libs
+
+
+def addToDirIndex(path, libmetadata):
+    """Record metadata of libraries already installed in path, so they are never scanned.
+    
+    libmetadata maps library file names in path to their metadata.
+    """
+    with _indexLock:
+        libs = _readIndexFile(path)
+        for (filename, metadata) in libmetadata.items():
+            try:
+                st = os.stat(os.path.join(path, filename))
+            except OSError:
+                continue
+            libs[filename] = {SW_KEY_MTIME : st.st_mtime_ns, SW_KEY_SIZE : st.st_size,
+                              SW_KEY_METADATA : metadata}
+        _writeIndexFile(path, libs)
+
+
+def metadataKey(metavals):
+    """Return the index key of a transform's metadata."""
+    dims = metavals.get(SW_KEY_DIMENSIONS)
+    if type(dims) is list:
+        dims = tuple(dims)
+    return (metavals.get(SW_KEY_TRANSFORMTYPE), dims, metavals.get(SW_KEY_DIRECTION),
+            metavals.get(SW_KEY_PRECISION), metavals.get(SW_KEY_PLATFORM))
+
+
+def _dirIndex(path):
+    """Return (signature, libs, lookup, generation, checked) for directory, cached until it or its libraries change.
+    
+    Only the directory and its index file are checked on every call, the
+    libraries themselves at most every SW_INDEX_RECHECK_SECONDS.
+    """
+    global _indexGeneration
+    sig = _dirSignature(path)
+    cached = _dirIndexes.get(path)
+    if (cached != None) and (cached[0] == sig):
+        now = time.monotonic()
+        if now - cached[4] < SW_INDEX_RECHECK_SECONDS:
+            return cached
+        if _filesUnchanged(path, cached[1]):
+            cached = cached[:4] + (now,)
+            _dirIndexes[path] = cached
+            return cached
+    libs = _refreshDirIndex(path) if sig != None else dict()
+    lookup = dict()
+    for filename in sorted(libs):
+        filemd = libs[filename].get(SW_KEY_METADATA)
+        if not type(filemd) is dict:
+            continue
+        for xform in filemd.get(SW_KEY_TRANSFORMS, []):
+            cand = (os.path.join(path, filename), xform)
+            lookup.setdefault(metadataKey(xform), []).append(cand)
+    # writing the index may have touched the directory
+    _indexGeneration += 1
+    cached = (_dirSignature(path), libs, lookup, _indexGeneration, time.monotonic())
+    _dirIndexes[path] = cached
+    return cached
+
+
+def metadataIndexForDir(path):
+    """Return dict of library file name to metadata (or None) for directory, using its index."""
+    with _indexLock:
+        libs = _dirIndex(path)[1]
+    return dict((k, v.get(SW_KEY_METADATA)) for k,v in libs.items())
+
+
+def metadataIndexStats():
+    """Return counters for metadata lookups and library scans."""
+    with _indexLock:
+        return dict(_indexStats)
+
+
+def clearMetadataIndexCache():
+    """Forget cached directory indexes and lookup results in this process."""
+    with _indexLock:
+        _dirIndexes.clear()
+        _lookupCache.clear()
+
+
+def libraryDirs(libdir=None):
+    """Return list of directories searched for libraries, .libs first."""
+    if libdir == None:
+        libdir = _moduleLibsDir
+        
+    dirlist = [libdir]
+    
+    libpath = os.getenv(SW_LIBRARY_PATH)
+    if libpath != None:
+        sep = ';' if sys.platform == 'win32' else ':'
+        paths = [p for p in libpath.split(sep) if p != '']
+        dirlist = dirlist + paths
+    return dirlist
+
+
 def writeMetadataSourceFile(metadata, varname, path, spaces=0):
     """Write metadata JSON as compileable C string."""
     try:
@@ -58,11 +319,37 @@ def metadataMatches(metadata, metavals):
             return False
         if v != metadata[k]:
             return False
+    # values not asked for are ignored, except that a request without Threads
+    # only matches sequential code and one without CompileFlags only code
+    # compiled with default flags
+    if (SW_KEY_THREADS not in metavals) and (metadata.get(SW_KEY_THREADS, 1) != 1):
+        return False
+    if (SW_KEY_COMPILEFLAGS not in metavals) and (len(metadata.get(SW_KEY_COMPILEFLAGS, [])) > 0):
+        return False
     return True
     
     
+def _usable(xform):
+    """Return True if the host CPU can run the transform's code."""
+    isa = xform.get(SW_KEY_ISA)
+    if (isa != None) and not isaSupported(isa):
+        return False
+    return featuresSupported(xform.get(SW_KEY_REQUIREDFEATURES, []))
+
+
+def _matchRank(xform):
+    """Sort key of a matching transform, lower is better.
+    
+    Tuned transforms rank by their measured time, ahead of untuned ones.
+    """
+    tuning = xform.get(SW_KEY_TUNING)
+    if (type(tuning) is dict) and (type(tuning.get(SW_KEY_SECONDS)) in (int, float)):
+        return tuning[SW_KEY_SECONDS]
+    return float('inf')
+
+
 def findFunctionsWithMetadata(metavals, libdir=None):
-    """Search for matching metadata in libraries."""
+    """Search for matching metadata in libraries, return (path, names) of the best match."""
     if not type(metavals) is dict:
         return(None, None)
         
@@ -70,28 +357,34 @@ def findFunctionsWithMetadata(metavals, libdir=None):
     if transformType == None:
         return(None, None)    
         
-    if libdir == None:
-        moduleDir = os.path.dirname(os.path.realpath(__file__))
-        libdir = os.path.join(moduleDir, SW_LIBSDIR)
-        
-    dirlist = [libdir]
+    dirlist = libraryDirs(libdir)
+    key = metadataKey(metavals)
+    cachekey = (tuple(dirlist), json.dumps(metavals, sort_keys=True))
     
-    libpath = os.getenv(SW_LIBRARY_PATH)
-    if libpath != None:
-        sep = ';' if sys.platform == 'win32' else ':'
-        paths = libpath.split(sep)
-        dirlist = dirlist + paths
+    with _indexLock:
+        indexes = [_dirIndex(d) for d in dirlist]
+        gens = tuple(index[3] for index in indexes)
+        cached = _lookupCache.get(cachekey)
+        if (cached != None) and (cached[0] == gens):
+            if cached[1][0] == None:
+                _indexStats['NegativeHits'] += 1
+            else:
+                _indexStats['Hits'] += 1
+            return cached[1]
+        _indexStats['Misses'] += 1
         
-    for libdir in dirlist:    
-        mdlist = metadataInDir(libdir)
-        for filedict in mdlist:
-            filemd = filedict.get(SW_KEY_METADATA, {})
-            if transformType not in filemd.get(SW_KEY_TRANSFORMTYPES, []):
-                continue
-            for xform in filemd.get(SW_KEY_TRANSFORMS, []):
-                if metadataMatches(xform, metavals):
-                    return(filedict.get(SW_KEY_FILENAME), xform.get(SW_KEY_NAMES, {}))
-            
-    return (None, None)
-
+        # among several matches prefer the best ranked, then the first found
+        result = (None, None)
+        best = None
+        for index in indexes:
+            for (filename, xform) in index[2].get(key, []):
+                if metadataMatches(xform, metavals) and _usable(xform):
+                    rank = _matchRank(xform)
+                    if (best == None) or (rank < best):
+                        best = rank
+                        result = (filename, xform.get(SW_KEY_NAMES, {}))
+                
+        _lookupCache[cachekey] = (gens, result)
+        
+    return result
 
@@ -0,0 +1,203 @@
+"""
+SnowWhite Library Packs
+=======================
+
+A pack is one archive with prebuilt libraries and their metadata, for
+installing transforms on machines without SPIRAL or a compiler:
+
+    python -m snowwhite pack mypack.tar.gz --spec specs.json
+    python -m snowwhite unpack mypack.tar.gz
+
+The archive holds the libraries and a manifest, swpack.json, with each
+library's size, SHA-256 hash and metadata.  Unpacking installs the
+libraries and writes their metadata straight into the directory index, so
+solvers find the transforms without building or scanning any library.
+"""
+
+from snowwhite import *
+from snowwhite.metadata import libraryDirs, metadataIndexForDir, metadataMatches, addToDirIndex
+from snowwhite.registry import searchMetadataForSpec, libraryNameForSpec
+
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+
+SW_PACK_MANIFEST = 'swpack.json'
+SW_PACK_VERSION  = 1
+
+
+def _fileHash(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _matchesQueries(filename, metadata, queries):
+    for (query, libname) in queries:
+        # solvers find libraries without metadata by name
+        if filename == libname:
+            return True
+        if not type(metadata) is dict:
+            continue
+        for xform in metadata.get(SW_KEY_TRANSFORMS, []):
+            if metadataMatches(xform, query):
+                return True
+    return False
+
+
+def selectLibraries(specs=None, names=None, dirs=None):
+    """Return dict of library file name to (path, metadata) for a pack.
+
+    Libraries come from dirs, default .libs and SW_LIBRARY_PATH, the first
+    directory providing a file name wins.  With specs, only libraries with a
+    transform matching one of the transform spec dicts, or named as the
+    spec's solver names its library, are selected, with names only those
+    file names.  The metadata of libraries without it is None.
+    """
+    if dirs == None:
+        dirs = libraryDirs()
+    queries = None
+    if specs != None:
+        queries = [(searchMetadataForSpec(spec), libraryNameForSpec(spec)) for spec in specs]
+    selected = dict()
+    for libdir in dirs:
+        if not os.path.isdir(libdir):
+            continue
+        for (filename, metadata) in sorted(metadataIndexForDir(libdir).items()):
+            if (filename in selected) or not filename.startswith('lib'):
+                continue
+            if (names != None) and (filename not in names):
+                continue
+            if (queries != None) and not _matchesQueries(filename, metadata, queries):
+                continue
+            selected[filename] = (os.path.join(libdir, filename), metadata)
+    return selected
+
+
+def pack(archive, specs=None, names=None, dirs=None):
+    """Write pack archive (.tar, .tar.gz or .tgz) with selected libraries, return their names."""
+    selected = selectLibraries(specs, names, dirs)
+    libs = dict()
+    for (filename, (path, metadata)) in selected.items():
+        libs[filename] = {SW_KEY_SIZE : os.path.getsize(path), 'SHA256' : _fileHash(path),
+                          SW_KEY_METADATA : metadata}
+    manifest = json.dumps({SW_KEY_VERSION : SW_PACK_VERSION, SW_KEY_LIBRARIES : libs},
+                          indent=1, sort_keys=True).encode()
+
+    mode = 'w:gz' if archive.endswith(('.gz', '.tgz')) else 'w'
+    (fd, tmpname) = tempfile.mkstemp('.tmp', '.' + os.path.basename(archive) + '.',
+                                     os.path.dirname(os.path.abspath(archive)))
+    os.close(fd)
+    try:
+        with tarfile.open(tmpname, mode) as tar:
+            info = tarfile.TarInfo(SW_PACK_MANIFEST)
+            info.size = len(manifest)
+            info.mode = 0o644
+            tar.addfile(info, io.BytesIO(manifest))
+            for filename in sorted(selected):
+                tar.add(selected[filename][0], arcname=filename)
+        os.chmod(tmpname, 0o644)
+        os.replace(tmpname, archive)
+    except:
+        try:
+            os.remove(tmpname)
+        except OSError:
+            pass
+        raise
+    return sorted(selected)
+
+
+def unpack(archive, destdir=None, force=False):
+    """Install the libraries of a pack into destdir, default .libs, return their names.
+
+    Existing libraries with the same name are kept unless force is set.
+    Raises ValueError for archives that are not valid packs.
+    """
+    if destdir == None:
+        destdir = libraryDirs()[0]
+    os.makedirs(destdir, exist_ok=True)
+
+    with tarfile.open(archive, 'r:*') as tar:
+        try:
+            manifest = json.load(tar.extractfile(SW_PACK_MANIFEST))
+        except (KeyError, ValueError) as ex:
+            raise ValueError(archive + ' is not a SnowWhite pack: ' + str(ex))
+        if (not type(manifest) is dict) or (manifest.get(SW_KEY_VERSION) != SW_PACK_VERSION):
+            raise ValueError(archive + ': unsupported pack version')
+        libs = manifest.get(SW_KEY_LIBRARIES, {})
+
+        # extract and verify every library before installing any, so a bad
+        # pack installs nothing
+        staged = dict()
+        tmpdir = tempfile.mkdtemp('.tmp', '.unpack.', destdir)
+        try:
+            for (filename, entry) in sorted(libs.items()):
+                # only plain library files directly in the directory
+                if (os.path.basename(filename) != filename) or not filename.endswith(SW_SHLIB_EXT):
+                    raise ValueError(archive + ': invalid library name ' + filename)
+                dest = os.path.join(destdir, filename)
+                if os.path.exists(dest) and not force:
+                    continue
+                try:
+                    member = tar.getmember(filename)
+                except KeyError:
+                    raise ValueError(archive + ': malformed pack, ' + filename + ' is missing')
+                if not member.isfile():
+                    raise ValueError(archive + ': ' + filename + ' is not a file')
+                path = os.path.join(tmpdir, filename)
+                with tar.extractfile(member) as src, open(path, 'wb') as dst:
+                    shutil.copyfileobj(src, dst)
+                if _fileHash(path) != entry.get('SHA256'):
+                    raise ValueError(archive + ': ' + filename + ' is corrupt')
+                os.chmod(path, 0o755)
+                staged[filename] = path
+
+            installed = dict()
+            try:
+                for (filename, path) in sorted(staged.items()):
+                    # atomic rename, processes never load a partially written file
+                    os.replace(path, os.path.join(destdir, filename))
+                    installed[filename] = libs[filename].get(SW_KEY_METADATA)
+            finally:
+                # also index what was installed before a failure
+                addToDirIndex(destdir, installed)
+        finally:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+
+    return sorted(installed)
+
+
+def main(args):
+    """Command line entry: pack and unpack."""
+    if args.command == 'pack':
+        specs = None
+        if args.spec != None:
+            try:
+                with open(args.spec, 'r') as f:
+                    specs = json.load(f)
+            except (OSError, ValueError) as ex:
+                print('Could not read ' + args.spec + ': ' + str(ex), file=sys.stderr)
+                return 1
+        names = args.libraries if len(args.libraries) > 0 else None
+        try:
+            packed = pack(args.archive, specs, names, args.dirs)
+        except ValueError as ex:
+            print('Could not pack: ' + str(ex), file=sys.stderr)
+            return 1
+        print('Packed {} libraries into {}'.format(len(packed), args.archive))
+        return 0 if len(packed) > 0 else 1
+
+    try:
+        installed = unpack(args.archive, args.dest, args.force)
+    except (OSError, ValueError, tarfile.TarError) as ex:
+        print('Could not unpack ' + args.archive + ': ' + str(ex), file=sys.stderr)
+        return 1
+    print('Installed {} libraries'.format(len(installed)))
+    return 0
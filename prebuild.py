@@ -0,0 +1,116 @@
+"""
+SnowWhite Prebuild
+==================
+
+Build many transforms ahead of time on a bounded pool of worker processes.
+
+Transforms are described by specs, dicts using the metadata keys, e.g.:
+
+    {"TransformType": "MDDFT", "Dimensions": [64, 64, 64],
+     "Direction": "Forward", "Precision": "Double", "Platform": "CPU"}
+"""
+
+from snowwhite import *
+from snowwhite.metadata import findFunctionsWithMetadata
+from snowwhite.registry import problemFromSpec, searchMetadataForSpec, solverClassForProblem
+
+import concurrent.futures
+import json
+import os
+import sys
+import time
+
+SW_PREBUILD_BUILT   = 'built'
+SW_PREBUILD_SKIPPED = 'skipped'
+SW_PREBUILD_FAILED  = 'failed'
+
+
+def _buildSpec(spec, force=False):
+    """Build one transform in a worker process, return (status, seconds, error)."""
+    t0 = time.perf_counter()
+    try:
+        (problem, opts) = problemFromSpec(spec)
+        if force:
+            opts[SW_OPT_REBUILD] = True
+        solver = solverClassForProblem(problem)(problem, opts)
+        del solver
+    except Exception as ex:
+        return (SW_PREBUILD_FAILED, time.perf_counter() - t0, str(ex))
+    return (SW_PREBUILD_BUILT, time.perf_counter() - t0, None)
+
+
+def prebuild(specs, maxWorkers=None, force=False, progress=None):
+    """Build transforms in specs concurrently.
+
+    Arguments:
+    specs       -- list of transform spec dicts
+    maxWorkers  -- maximum number of concurrent builds, default CPU count
+    force       -- build even when a matching library is already installed or cached
+    progress    -- optional function called with each result as it completes
+
+    Returns a list of result dicts in the order of specs, each with the spec
+    and its Status ('built', 'skipped' or 'failed'), Seconds and Error.
+    """
+    results = [None] * len(specs)
+    pending = []
+    for i, spec in enumerate(specs):
+        if not force:
+            try:
+                (path, names) = findFunctionsWithMetadata(searchMetadataForSpec(spec))
+            except (ValueError, TypeError):
+                # invalid spec, the build reports the error
+                path = None
+            if path != None:
+                results[i] = {'Spec' : spec, 'Status' : SW_PREBUILD_SKIPPED,
+                              'Seconds' : 0.0, 'Error' : None}
+                if progress != None:
+                    progress(results[i])
+                continue
+        pending.append(i)
+
+    if len(pending) > 0:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=maxWorkers) as pool:
+            futures = dict((pool.submit(_buildSpec, specs[i], force), i) for i in pending)
+            for future in concurrent.futures.as_completed(futures):
+                i = futures[future]
+                try:
+                    (status, secs, err) = future.result()
+                except Exception as ex:
+                    (status, secs, err) = (SW_PREBUILD_FAILED, 0.0, str(ex))
+                results[i] = {'Spec' : specs[i], 'Status' : status,
+                              'Seconds' : secs, 'Error' : err}
+                if progress != None:
+                    progress(results[i])
+
+    return results
+
+
+def specName(spec):
+    """Return short printable description of a transform spec."""
+    dims = 'x'.join(str(n) for n in spec.get(SW_KEY_DIMENSIONS, []))
+    return ' '.join([str(spec.get(SW_KEY_TRANSFORMTYPE)), dims,
+                     spec.get(SW_KEY_DIRECTION, SW_STR_FORWARD),
+                     spec.get(SW_KEY_PRECISION, SW_STR_DOUBLE),
+                     spec.get(SW_KEY_PLATFORM, SW_CPU)])
+
+
+def main(args):
+    """Command line entry: prebuild transforms listed in a JSON file."""
+    try:
+        with open(args.specfile, 'r') as f:
+            specs = json.load(f)
+    except (OSError, ValueError) as ex:
+        print('Could not read ' + args.specfile + ': ' + str(ex), file=sys.stderr)
+        return 1
+
+    def report(res):
+        line = '{:8} {:8.2f}s  {}'.format(res['Status'], res['Seconds'], specName(res['Spec']))
+        if res['Error'] != None:
+            line += '  (' + res['Error'] + ')'
+        print(line, flush=True)
+
+    results = prebuild(specs, args.jobs, args.force, report)
+    nfailed = sum(1 for r in results if r['Status'] == SW_PREBUILD_FAILED)
+    nbuilt = sum(1 for r in results if r['Status'] == SW_PREBUILD_BUILT)
+    print('{} built, {} skipped, {} failed'.format(nbuilt, len(results) - nbuilt - nfailed, nfailed))
+    return 1 if nfailed > 0 else 0
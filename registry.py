@@ -0,0 +1,205 @@
+"""
+SnowWhite Solver Registry
+=========================
+
+Process-wide cache of solvers keyed by problem and options, so repeated
+requests for the same transform return an already loaded solver.
+"""
+
+from snowwhite import *
+
+import collections
+import importlib
+import json
+import os
+import threading
+import weakref
+
+SW_REGISTRY_DEFAULT_SIZE = 32
+
+# problem class name -> (solver module, solver class name)
+_solverClasses = {
+    'BatchMddftProblem' : ('snowwhite.batchmddftsolver', 'BatchMddftSolver'),
+    'DftProblem'        : ('snowwhite.dftsolver',        'DftSolver'),
+    'HockneyProblem'    : ('snowwhite.hockneysolver',    'HockneySolver'),
+    'MddftProblem'      : ('snowwhite.mddftsolver',      'MddftSolver'),
+    'MdprdftProblem'    : ('snowwhite.mdprdftsolver',    'MdprdftSolver'),
+    'MdrconvProblem'    : ('snowwhite.mdrconvsolver',    'MdrconvSolver'),
+    'MdrfsconvProblem'  : ('snowwhite.mdrfsconvsolver',  'MdrfsconvSolver'),
+    'StepPhaseProblem'  : ('snowwhite.stepphasesolver',  'StepPhaseSolver'),
+}
+
+
+def solverClassForProblem(problem):
+    """Return the solver class that handles problem."""
+    entry = _solverClasses.get(type(problem).__name__)
+    if entry == None:
+        raise TypeError('no solver for problem type ' + type(problem).__name__)
+    module = importlib.import_module(entry[0])
+    return getattr(module, entry[1])
+
+
+# transform type -> (problem module, problem class name, constructor from (cls, dims, k))
+_problemFactories = {
+    SW_TRANSFORM_DFT       : ('snowwhite.dftsolver',       'DftProblem',       lambda cls, dims, k: cls(dims[0], k)),
+    SW_TRANSFORM_MDDFT     : ('snowwhite.mddftsolver',     'MddftProblem',     lambda cls, dims, k: cls(dims, k)),
+    SW_TRANSFORM_MDPRDFT   : ('snowwhite.mdprdftsolver',   'MdprdftProblem',   lambda cls, dims, k: cls(dims, k)),
+    SW_TRANSFORM_MDRCONV   : ('snowwhite.mdrconvsolver',   'MdrconvProblem',   lambda cls, dims, k: cls(dims[0])),
+    SW_TRANSFORM_MDRFSCONV : ('snowwhite.mdrfsconvsolver', 'MdrfsconvProblem', lambda cls, dims, k: cls(dims[0])),
+}
+
+
+def problemFromSpec(spec):
+    """Return (problem, opts) for a transform spec.
+    
+    A spec is a dict using the metadata keys TransformType, Dimensions,
+    Direction, Precision and Platform, plus optional extra solver options
+    under Options.
+    """
+    ttype = spec.get(SW_KEY_TRANSFORMTYPE)
+    entry = _problemFactories.get(ttype)
+    if entry == None:
+        raise ValueError('unsupported transform type: ' + str(ttype))
+    cls = getattr(importlib.import_module(entry[0]), entry[1])
+    dims = list(spec.get(SW_KEY_DIMENSIONS))
+    k = SW_INVERSE if spec.get(SW_KEY_DIRECTION) == SW_STR_INVERSE else SW_FORWARD
+    problem = entry[2](cls, dims, k)
+    opts = dict(spec.get(SW_KEY_OPTIONS, {}))
+    opts[SW_OPT_PLATFORM] = spec.get(SW_KEY_PLATFORM, SW_CPU)
+    if spec.get(SW_KEY_PRECISION) == SW_STR_SINGLE:
+        opts[SW_OPT_REALCTYPE] = 'float'
+    return (problem, opts)
+
+
+def _deferredSolverForSpec(spec):
+    (problem, opts) = problemFromSpec(spec)
+    # a deferred solver only describes its transform, nothing is built
+    opts[SW_OPT_DEFER] = True
+    return solverClassForProblem(problem)(problem, opts)
+
+
+def searchMetadataForSpec(spec):
+    """Return metadata search values for a transform spec.
+    
+    These are the values the spec's solver searches for, so spec Options
+    such as threads, isa or compiler flags select the same libraries.
+    Raises ValueError for unsupported transform types.
+    """
+    return _deferredSolverForSpec(spec)._metadataForSearch()
+
+
+def libraryNameForSpec(spec):
+    """Return file name of the library the spec's solver builds, found by name if it has no metadata."""
+    return 'lib' + _deferredSolverForSpec(spec)._libbase + SW_SHLIB_EXT
+
+
+def _optsKey(opts):
+    return json.dumps(opts, sort_keys=True, default=str)
+
+
+# every registry, so a forked child can replace their locks
+_registries = weakref.WeakSet()
+
+
+class SolverRegistry:
+    """LRU cache of solvers keyed by canonical problem and options.
+    
+    The limit counts solvers, not memory; to bound the memory of loaded
+    workspaces use setWorkspaceBudget().
+    """
+
+    def __init__(self, maxSize=SW_REGISTRY_DEFAULT_SIZE):
+        self._maxSize = maxSize
+        self._solvers = collections.OrderedDict()
+        self._buildLocks = dict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+        _registries.add(self)
+
+    def getSolver(self, problem, opts = {}):
+        """Return cached solver for problem and opts, creating it on first use."""
+        cls = solverClassForProblem(problem)
+        key = (cls.__name__, problem.canonicalKey(), _optsKey(opts))
+        with self._lock:
+            solver = self._solvers.get(key)
+            if solver != None:
+                self._solvers.move_to_end(key)
+                self._hits += 1
+                return solver
+            buildLock = self._buildLocks.setdefault(key, threading.Lock())
+
+        # construct outside the registry lock, a build can take minutes
+        with buildLock:
+            with self._lock:
+                solver = self._solvers.get(key)
+                if solver != None:
+                    self._solvers.move_to_end(key)
+                    self._hits += 1
+                    return solver
+            try:
+                # solvers modify their opts, so give them a copy
+                solver = cls(problem, dict(opts))
+                with self._lock:
+                    self._misses += 1
+                    self._solvers[key] = solver
+                    self._evict()
+            finally:
+                # also after a failed build, so failed problems do not accumulate locks
+                with self._lock:
+                    self._buildLocks.pop(key, None)
+        return solver
+
+    def _evict(self):
+        # solvers still referenced by callers stay alive, the library
+        # they share is released when the last one goes away
+        while len(self._solvers) > self._maxSize:
+            self._solvers.popitem(last=False)
+            self._evictions += 1
+
+    def setMaxSize(self, maxSize):
+        """Set number of solvers kept, evicting least recently used ones.
+        
+        Only the count is limited, whatever the size of the transforms.
+        """
+        with self._lock:
+            self._maxSize = maxSize
+            self._evict()
+
+    def clear(self):
+        """Drop all cached solvers."""
+        with self._lock:
+            self._solvers.clear()
+
+    def stats(self):
+        """Return counters for registry use."""
+        with self._lock:
+            return {'Size' : len(self._solvers), 'MaxSize' : self._maxSize,
+                    'Hits' : self._hits, 'Misses' : self._misses,
+                    'Evictions' : self._evictions}
+
+
+_defaultRegistry = None
+_defaultRegistryLock = threading.Lock()
+
+def defaultRegistry():
+    """Return the process-wide solver registry."""
+    global _defaultRegistry
+    with _defaultRegistryLock:
+        if _defaultRegistry == None:
+            _defaultRegistry = SolverRegistry()
+        return _defaultRegistry
+
+
+def _resetLocksAfterFork():
+    # another thread may have held a lock when the process forked, and
+    # builds in progress belong to the parent's threads
+    global _defaultRegistryLock
+    _defaultRegistryLock = threading.Lock()
+    for registry in list(_registries):
+        registry._lock = threading.Lock()
+        registry._buildLocks.clear()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_resetLocksAfterFork)
@@ -0,0 +1,575 @@
+"""
+SnowWhite Solver Service
+========================
+
+A local daemon holding loaded solvers for all processes on a node, so each
+transform's library and workspace exist once rather than in every process:
+
+    python -m snowwhite serve --max-pending 64
+
+Clients connect over a Unix domain socket and pass arrays in
+multiprocessing.shared_memory segments, which the daemon maps and
+transforms in place:
+
+    with SolverClient() as client:
+        src = client.empty((64,64,64), np.complex128)
+        dst = client.empty((64,64,64), np.complex128)
+        ...fill src...
+        client.solve(spec, src, out=dst)
+
+Transforms are named by specs, dicts using the metadata keys as for
+prebuild.  Requests run on a pool of worker threads.  Those of one
+transform run one at a time and in order, since a library's generated code
+is not reentrant, while different transforms run in parallel.  At most
+max-pending requests are queued or running, further requests are refused
+with a busy reply rather than queued without bound.
+
+Messages are JSON objects, each preceded by its length as 4-byte big
+endian integer.  CPU transforms only.
+"""
+
+from snowwhite import *
+from snowwhite.registry import problemFromSpec, solverClassForProblem
+
+import collections
+import concurrent.futures
+import errno
+import json
+import os
+import signal
+import socket
+import struct
+import sys
+import tempfile
+import threading
+
+from multiprocessing import shared_memory, resource_tracker
+
+import numpy as np
+
+SW_SERVE_DEFAULT_PENDING = 64
+
+# message keys and values
+SW_SERVE_OP        = 'Op'
+SW_SERVE_SPEC      = 'Spec'
+SW_SERVE_ARGS      = 'Args'
+SW_SERVE_OUT       = 'Out'
+SW_SERVE_STATUS    = 'Status'
+SW_SERVE_MESSAGE   = 'Message'
+SW_SERVE_SEGMENT   = 'Segment'
+SW_SERVE_OFFSET    = 'Offset'
+SW_SERVE_SHAPE     = 'Shape'
+SW_SERVE_DTYPE     = 'DType'
+SW_SERVE_STATS     = 'Stats'
+
+SW_SERVE_OP_SOLVE   = 'Solve'
+SW_SERVE_OP_RELEASE = 'Release'
+SW_SERVE_OP_STATS   = 'Stats'
+
+SW_SERVE_OK    = 'OK'
+SW_SERVE_BUSY  = 'Busy'
+SW_SERVE_ERROR = 'Error'
+
+
+def defaultSocketPath():
+    """Return socket path from SW_SERVE_SOCKET, default per user in the temp directory."""
+    path = os.getenv(SW_SERVE_SOCKET)
+    if path == None:
+        path = os.path.join(tempfile.gettempdir(), 'snowwhite-' + str(os.getuid()) + '.sock')
+    return path
+
+
+def _sendMessage(sock, obj):
+    data = json.dumps(obj).encode()
+    sock.sendall(struct.pack('>I', len(data)) + data)
+
+
+def _recvExactly(sock, n):
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(n)
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recvMessage(sock):
+    """Return next message, or None when the peer closed the connection."""
+    header = _recvExactly(sock, 4)
+    if header == None:
+        return None
+    data = _recvExactly(sock, struct.unpack('>I', header)[0])
+    if data == None:
+        return None
+    return json.loads(data)
+
+
+def _openSegment(name=None, size=0):
+    """Create or attach shared memory segment the owner, not this process, unlinks."""
+    create = (name == None)
+    try:
+        return shared_memory.SharedMemory(name, create, size, track=False)
+    except TypeError:
+        # before Python 3.13 segments are always tracked, and the tracker
+        # would unlink the other process's segments when this one exits
+        shm = shared_memory.SharedMemory(name, create, size)
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        return shm
+
+
+def _unlinkSegment(shm):
+    """Remove segment created by _openSegment, ignoring one the client already removed."""
+    if not hasattr(shm, '_track'):
+        # unlink() unregisters the segment _openSegment unregistered
+        resource_tracker.register(shm._name, 'shared_memory')
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        if not hasattr(shm, '_track'):
+            resource_tracker.unregister(shm._name, 'shared_memory')
+
+
+def _closeSegment(shm):
+    try:
+        shm.close()
+    except BufferError:
+        # an array still refers to it, the mapping goes with the array
+        pass
+
+
+def _descriptor(name, offset, arr):
+    return {SW_SERVE_SEGMENT : name, SW_SERVE_OFFSET : offset,
+            SW_SERVE_SHAPE : list(arr.shape), SW_SERVE_DTYPE : arr.dtype.str}
+
+
+def _arrayInSegment(shm, desc):
+    dtype = np.dtype(desc[SW_SERVE_DTYPE])
+    shape = tuple(desc[SW_SERVE_SHAPE])
+    offset = int(desc.get(SW_SERVE_OFFSET, 0))
+    nbytes = int(np.prod(shape)) * dtype.itemsize
+    if (offset < 0) or (offset + nbytes > shm.size):
+        raise ValueError('array exceeds shared memory segment ' + shm.name)
+    return np.ndarray(shape, dtype, buffer=shm.buf, offset=offset)
+
+
+class _Job:
+    """One solve request, completed by a transform's worker thread."""
+
+    def __init__(self, args, out):
+        self.args = args
+        self.out = out
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+
+    def run(self, solver):
+        try:
+            if self.out is None:
+                self.result = solver.solve(*self.args)
+            else:
+                res = solver.solve(*self.args, dst=self.out)
+                # solvers falling back to their Python definition may not write dst
+                if res is not self.out:
+                    np.copyto(self.out, res)
+                self.result = self.out
+        except Exception as ex:
+            self.error = str(ex)
+        self.done.set()
+
+
+class _Transform:
+    """Solver of one transform, running its requests in order on the service's thread pool."""
+
+    def __init__(self, spec, executor):
+        self._spec = spec
+        self._executor = executor
+        self._jobs = collections.deque()
+        self._lock = threading.Lock()
+        # True while a pool task is due to run the next job
+        self._scheduled = False
+        self._solver = None
+
+    def submit(self, job):
+        with self._lock:
+            self._jobs.append(job)
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self._executor.submit(self._runNext)
+
+    def _setUpSolver(self):
+        """Set up the solver, return None or the error message if it failed."""
+        # set up on the pool, so a transform still building does not hold up
+        # the connection threads
+        try:
+            (problem, opts) = problemFromSpec(self._spec)
+            if opts.get(SW_OPT_PLATFORM, SW_CPU) != SW_CPU:
+                raise ValueError('only CPU transforms can be served')
+            self._solver = solverClassForProblem(problem)(problem, opts)
+        except Exception as ex:
+            return 'could not set up transform: ' + str(ex)
+        return None
+
+    def _runNext(self):
+        if self._solver == None:
+            error = self._setUpSolver()
+            if error != None:
+                # fail the requests that waited for this attempt, the failure
+                # is not kept and the next request tries again
+                self._cancel(error)
+                return
+        with self._lock:
+            job = self._jobs.popleft()
+        job.run(self._solver)
+        # one job per task, so busy transforms take turns on the pool
+        with self._lock:
+            if len(self._jobs) == 0:
+                self._scheduled = False
+                return
+        try:
+            self._executor.submit(self._runNext)
+        except RuntimeError:
+            # pool shut down, fail the jobs left
+            self._cancel('solver service closed')
+
+    def _cancel(self, message):
+        with self._lock:
+            jobs = list(self._jobs)
+            self._jobs.clear()
+            self._scheduled = False
+        for job in jobs:
+            job.error = message
+            job.done.set()
+
+
+class SolverServer:
+    """Serve transforms to local processes over a Unix domain socket."""
+
+    def __init__(self, path=None, maxPending=SW_SERVE_DEFAULT_PENDING, maxWorkers=None):
+        self._path = defaultSocketPath() if path == None else path
+        self._maxPending = maxPending
+        self._slots = threading.BoundedSemaphore(maxPending)
+        self._maxWorkers = maxWorkers if maxWorkers != None else (os.cpu_count() or 1)
+        self._executor = concurrent.futures.ThreadPoolExecutor(self._maxWorkers)
+        self._transforms = dict()
+        self._lock = threading.Lock()
+        self._sock = None
+        self._served = 0
+        self._rejected = 0
+
+    def path(self):
+        return self._path
+
+    def _removeStaleSocket(self):
+        if not os.path.exists(self._path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self._path)
+        except OSError as ex:
+            if ex.errno in (errno.ECONNREFUSED, errno.ENOENT):
+                os.remove(self._path)
+                return
+            raise
+        finally:
+            probe.close()
+        raise RuntimeError('a solver service is already running on ' + self._path)
+
+    def start(self):
+        """Bind and listen on the socket."""
+        self._removeStaleSocket()
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(self._path)
+        os.chmod(self._path, 0o600)
+        sock.listen(128)
+        self._sock = sock
+
+    def serveForever(self):
+        """Accept connections until closed, each served by its own thread."""
+        if self._sock == None:
+            self.start()
+        sock = self._sock
+        while True:
+            try:
+                (conn, addr) = sock.accept()
+            except OSError:
+                # socket closed
+                break
+            t = threading.Thread(target=self._serveConnection, args=(conn,), daemon=True)
+            t.start()
+
+    def close(self):
+        """Stop accepting connections and the worker threads."""
+        if self._sock != None:
+            # shutdown wakes a thread blocked in accept, close alone does not
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            self._sock.close()
+            self._sock = None
+            try:
+                os.remove(self._path)
+            except OSError:
+                pass
+        self._executor.shutdown(wait=False)
+        with self._lock:
+            transforms = list(self._transforms.values())
+            self._transforms.clear()
+        for transform in transforms:
+            transform._cancel('solver service closed')
+
+    def stats(self):
+        """Return counters for the service."""
+        with self._lock:
+            return {'Transforms' : len(self._transforms), 'MaxPending' : self._maxPending,
+                    'Workers' : self._maxWorkers, 'Served' : self._served, 'Rejected' : self._rejected}
+
+    def _transform(self, spec):
+        key = json.dumps(spec, sort_keys=True)
+        with self._lock:
+            transform = self._transforms.get(key)
+            if transform == None:
+                transform = _Transform(spec, self._executor)
+                self._transforms[key] = transform
+            return transform
+
+    def _serveConnection(self, conn):
+        # segments stay mapped for the connection, clients reuse their buffers
+        segments = dict()
+        # result segments created for the client, unlinked when it disconnects
+        # in case it never attached them, the client's own mapping stays valid
+        results = dict()
+        try:
+            while True:
+                try:
+                    msg = _recvMessage(conn)
+                except (OSError, ValueError):
+                    break
+                if msg == None:
+                    break
+                op = msg.get(SW_SERVE_OP)
+                if op == SW_SERVE_OP_SOLVE:
+                    reply = self._solve(msg, segments, results)
+                elif op == SW_SERVE_OP_RELEASE:
+                    # the client unlinks released result segments itself
+                    results.pop(msg.get(SW_SERVE_SEGMENT), None)
+                    shm = segments.pop(msg.get(SW_SERVE_SEGMENT), None)
+                    if shm != None:
+                        _closeSegment(shm)
+                    reply = {SW_SERVE_STATUS : SW_SERVE_OK}
+                elif op == SW_SERVE_OP_STATS:
+                    reply = {SW_SERVE_STATUS : SW_SERVE_OK, SW_SERVE_STATS : self.stats()}
+                else:
+                    reply = {SW_SERVE_STATUS : SW_SERVE_ERROR, SW_SERVE_MESSAGE : 'unknown request ' + str(op)}
+                try:
+                    _sendMessage(conn, reply)
+                except OSError:
+                    break
+        finally:
+            conn.close()
+            for shm in segments.values():
+                _closeSegment(shm)
+            for shm in results.values():
+                _unlinkSegment(shm)
+
+    def _segment(self, segments, name):
+        shm = segments.get(name)
+        if shm == None:
+            shm = _openSegment(name)
+            segments[name] = shm
+        return shm
+
+    def _solve(self, msg, segments, results):
+        # admission control, refuse rather than queue without bound
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._rejected += 1
+            return {SW_SERVE_STATUS : SW_SERVE_BUSY}
+        try:
+            try:
+                args = [_arrayInSegment(self._segment(segments, d[SW_SERVE_SEGMENT]), d)
+                        for d in msg.get(SW_SERVE_ARGS, [])]
+                outdesc = msg.get(SW_SERVE_OUT)
+                out = None
+                if outdesc != None:
+                    out = _arrayInSegment(self._segment(segments, outdesc[SW_SERVE_SEGMENT]), outdesc)
+                transform = self._transform(msg.get(SW_SERVE_SPEC, {}))
+            except (OSError, ValueError, KeyError, TypeError) as ex:
+                return {SW_SERVE_STATUS : SW_SERVE_ERROR, SW_SERVE_MESSAGE : str(ex)}
+
+            job = _Job(args, out)
+            try:
+                transform.submit(job)
+            except RuntimeError:
+                return {SW_SERVE_STATUS : SW_SERVE_ERROR, SW_SERVE_MESSAGE : 'solver service closed'}
+            job.done.wait()
+            if job.error != None:
+                return {SW_SERVE_STATUS : SW_SERVE_ERROR, SW_SERVE_MESSAGE : job.error}
+            with self._lock:
+                self._served += 1
+            if outdesc != None:
+                return {SW_SERVE_STATUS : SW_SERVE_OK, SW_SERVE_OUT : outdesc}
+
+            # no output buffer given, hand the result over in a new segment
+            # the client owns and unlinks
+            result = np.ascontiguousarray(job.result)
+            shm = _openSegment(None, max(result.nbytes, 1))
+            results[shm.name] = shm
+            view = np.ndarray(result.shape, result.dtype, buffer=shm.buf)
+            view[...] = result
+            desc = _descriptor(shm.name, 0, result)
+            del view
+            _closeSegment(shm)
+            return {SW_SERVE_STATUS : SW_SERVE_OK, SW_SERVE_OUT : desc}
+        finally:
+            self._slots.release()
+
+
+class SolverClient:
+    """Connection to a solver service, with the shared memory arrays passed to it.
+
+    Arrays from empty() are exchanged without copying, other arrays are
+    copied into a temporary segment for each request.  One request at a
+    time is sent per client, threads wanting to run requests concurrently
+    use their own clients.
+    """
+
+    def __init__(self, path=None):
+        self._path = defaultSocketPath() if path == None else path
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._sock.connect(self._path)
+        self._lock = threading.Lock()
+        # segment name -> (SharedMemory, base address)
+        self._segments = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _addSegment(self, shm):
+        base = np.frombuffer(shm.buf, np.uint8).ctypes.data
+        self._segments[shm.name] = (shm, base)
+
+    def empty(self, shape, dtype=np.complex128):
+        """Return uninitialized array in shared memory owned by this client."""
+        dtype = np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        shm = shared_memory.SharedMemory(None, True, max(nbytes, 1))
+        self._addSegment(shm)
+        return np.ndarray(shape, dtype, buffer=shm.buf)
+
+    def _find(self, arr):
+        """Return descriptor of C-contiguous array in one of our segments, or None."""
+        if not arr.flags.c_contiguous:
+            return None
+        addr = arr.ctypes.data
+        for (name, (shm, base)) in self._segments.items():
+            if (base <= addr) and (addr + arr.nbytes <= base + shm.size):
+                return _descriptor(name, addr - base, arr)
+        return None
+
+    def _request(self, msg):
+        with self._lock:
+            _sendMessage(self._sock, msg)
+            reply = _recvMessage(self._sock)
+        if reply == None:
+            raise RuntimeError('solver service closed the connection')
+        status = reply.get(SW_SERVE_STATUS)
+        if status == SW_SERVE_BUSY:
+            raise RuntimeError('solver service busy, try again later')
+        if status != SW_SERVE_OK:
+            raise RuntimeError(reply.get(SW_SERVE_MESSAGE, 'solver service error'))
+        return reply
+
+    def solve(self, spec, *args, out=None):
+        """Run the transform of spec on args, return out or a new shared memory array.
+
+        Raises RuntimeError if the service is busy or the transform fails.
+        """
+        temps = []
+        try:
+            descs = []
+            for arr in args:
+                desc = self._find(arr)
+                if desc == None:
+                    tmp = self.empty(arr.shape, arr.dtype)
+                    tmp[...] = arr
+                    temps.append(tmp)
+                    desc = self._find(tmp)
+                descs.append(desc)
+            msg = {SW_SERVE_OP : SW_SERVE_OP_SOLVE, SW_SERVE_SPEC : spec, SW_SERVE_ARGS : descs}
+            outtmp = None
+            if out is not None:
+                msg[SW_SERVE_OUT] = self._find(out)
+                if msg[SW_SERVE_OUT] == None:
+                    outtmp = self.empty(out.shape, out.dtype)
+                    temps.append(outtmp)
+                    msg[SW_SERVE_OUT] = self._find(outtmp)
+            reply = self._request(msg)
+            if out is not None:
+                if outtmp is not None:
+                    out[...] = outtmp
+                return out
+
+            desc = reply[SW_SERVE_OUT]
+            shm = shared_memory.SharedMemory(desc[SW_SERVE_SEGMENT])
+            self._addSegment(shm)
+            return _arrayInSegment(shm, desc)
+        finally:
+            for tmp in temps:
+                self.free(tmp)
+
+    def free(self, arr):
+        """Release the shared memory segment holding arr, which must not be used afterwards."""
+        desc = self._find(arr)
+        if desc == None:
+            return
+        name = desc[SW_SERVE_SEGMENT]
+        (shm, base) = self._segments.pop(name)
+        try:
+            self._request({SW_SERVE_OP : SW_SERVE_OP_RELEASE, SW_SERVE_SEGMENT : name})
+        except (OSError, RuntimeError):
+            pass
+        _closeSegment(shm)
+        shm.unlink()
+
+    def stats(self):
+        """Return the service's counters."""
+        return self._request({SW_SERVE_OP : SW_SERVE_OP_STATS})[SW_SERVE_STATS]
+
+    def close(self):
+        """Close the connection and release all shared memory of this client."""
+        self._sock.close()
+        for (shm, base) in self._segments.values():
+            _closeSegment(shm)
+            try:
+                shm.unlink()
+            except OSError:
+                pass
+        self._segments.clear()
+
+
+def main(args):
+    """Command line entry: serve."""
+    server = SolverServer(args.socket, args.max_pending, args.workers)
+    try:
+        server.start()
+    except (OSError, RuntimeError) as ex:
+        print('Could not serve: ' + str(ex), file=sys.stderr)
+        return 1
+    # remove the socket on kill as on Ctrl-C
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print('Serving transforms on ' + server.path())
+    sys.stdout.flush()
+    try:
+        server.serveForever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
@@ -0,0 +1,179 @@
+"""
+SnowWhite Slab Decomposition
+============================
+
+Run a large CPU MDDFT or MDPRDFT on several cores without OpenMP in the
+generated code, by splitting it into smaller generated transforms run on a
+thread pool:
+
+    solver = SlabSolver(MddftProblem([256,256,256]), threads=16)
+    dst = solver.solve(src)
+
+An N-D transform of dimensions [n0, n1, ...] is done in two stages.  The
+slab stage transforms the (N-1)-D planes src[i], in slabs of consecutive
+planes, for MDDFT with batched MDDFTs, for MDPRDFT plane by plane.  The
+column stage runs batched 1D DFTs of length n0 along the first axis.  Its
+columns are gathered in chunks of a size that fits in cache, transposed
+locally so each 1D DFT reads contiguous data, and scattered back.  The
+inverse MDPRDFT runs the column stage first.
+
+Every stage solver uses the perthread option, so the pool's threads run
+the generated code concurrently, each with its own workspace.  The last
+slab or chunk, if smaller, is padded to the batch size, so each stage
+needs one library.
+"""
+
+from snowwhite import *
+
+import concurrent.futures
+import math
+import os
+
+import numpy as np
+
+# bytes of one column chunk, sized to stay in cache while transposed
+SW_SLAB_CHUNK_BYTES = 1 << 18
+
+
+def _runBatch(solver, batch, src, dst):
+    """Run batched solver on the first axis of src, fewer than batch items padded."""
+    k = src.shape[0]
+    if k == batch:
+        res = solver.solve(src, dst)
+        if res is not dst:
+            dst[...] = res
+        return
+    tmp = np.zeros((batch,) + src.shape[1:], src.dtype)
+    tmp[:k] = src
+    dst[...] = solver.solve(tmp)[:k]
+
+
+class SlabSolver:
+    """Solve a CPU MddftProblem or MdprdftProblem as slabs on a thread pool."""
+
+    def __init__(self, problem, opts = {}, threads=None):
+        """Set up stage solvers for problem.
+
+        Arguments:
+        problem -- MddftProblem or MdprdftProblem of at least 2 dimensions
+        opts    -- solver options of the stage solvers
+        threads -- pool size, default number of CPUs
+        """
+        from snowwhite.mddftsolver import MddftProblem
+        from snowwhite.mdprdftsolver import MdprdftProblem
+        from snowwhite.batchmddftsolver import BatchMddftProblem
+        if not isinstance(problem, (MddftProblem, MdprdftProblem)):
+            raise TypeError("problem must be an MddftProblem or MdprdftProblem")
+        if len(problem.dimensions()) < 2:
+            raise ValueError('slab decomposition needs at least 2 dimensions')
+        if opts.get(SW_OPT_PLATFORM, SW_CPU) != SW_CPU:
+            raise ValueError('slab decomposition runs on the CPU')
+        if opts.get(SW_OPT_COLMAJOR, False):
+            raise ValueError('slab decomposition needs row-major data')
+
+        self._problem = problem
+        self._real = isinstance(problem, MdprdftProblem)
+        self._threads = max(int(threads if threads != None else (os.cpu_count() or 1)), 1)
+        single = (opts.get(SW_OPT_REALCTYPE) == 'float')
+        self._ftype = np.single if single else np.double
+        self._cxtype = np.csingle if single else np.cdouble
+
+        dims = list(problem.dimensions())
+        k = problem.direction()
+        n0 = dims[0]
+        stageOpts = dict(opts)
+        stageOpts[SW_OPT_PERTHREAD] = True
+
+        # slab stage, consecutive planes per thread
+        if self._real:
+            self._slab = 1
+            self._planeSolver = get_solver(MdprdftProblem(dims[1:], k), stageOpts)
+            cxdims = problem.dimensionsCX()
+        else:
+            self._slab = math.ceil(n0 / self._threads)
+            self._planeSolver = get_solver(BatchMddftProblem(dims[1:], self._slab, k), stageOpts)
+            cxdims = dims
+
+        # column stage, chunks of columns small enough to stay in cache
+        self._columns = int(np.prod(cxdims[1:]))
+        itemsize = np.dtype(self._cxtype).itemsize
+        chunk = min(math.ceil(self._columns / self._threads),
+                    max(SW_SLAB_CHUNK_BYTES // (n0 * itemsize), 1))
+        self._chunk = max(chunk, 1)
+        self._columnSolver = get_solver(BatchMddftProblem([n0], self._chunk, k), stageOpts)
+        self._cxdims = tuple(cxdims)
+
+        self._pool = concurrent.futures.ThreadPoolExecutor(self._threads)
+
+    def threads(self):
+        return self._threads
+
+    def close(self):
+        """Stop the thread pool."""
+        self._pool.shutdown()
+
+    def runDef(self, src):
+        """Solve using internal Python definition."""
+        if self._real:
+            if self._problem.direction() == SW_FORWARD:
+                return np.fft.rfftn(src)
+            return np.fft.irfftn(src, tuple(self._problem.dimensions()))
+        if self._problem.direction() == SW_FORWARD:
+            return np.fft.fftn(src)
+        return np.fft.ifftn(src)
+
+    def _slabs(self, n, size):
+        return [(a, min(a + size, n)) for a in range(0, n, size)]
+
+    def _planeStage(self, src, dst):
+        """Transform the planes src[i] into dst[i]."""
+        n0 = src.shape[0]
+        if self._real:
+            def work(r):
+                for i in range(r[0], r[1]):
+                    plane = dst[i]
+                    res = self._planeSolver.solve(src[i], plane)
+                    if res is not plane:
+                        plane[...] = res
+            # one range of planes per thread
+            ranges = self._slabs(n0, math.ceil(n0 / self._threads))
+        else:
+            def work(r):
+                _runBatch(self._planeSolver, self._slab, src[r[0]:r[1]], dst[r[0]:r[1]])
+            ranges = self._slabs(n0, self._slab)
+        list(self._pool.map(work, ranges))
+
+    def _columnStage(self, src, dst):
+        """Transform along the first axis from src into dst, which may be the same array."""
+        n0 = src.shape[0]
+        src2 = src.reshape(n0, self._columns)
+        dst2 = dst.reshape(n0, self._columns)
+        def work(r):
+            # local transpose, each 1D DFT then reads contiguous data
+            block = np.ascontiguousarray(src2[:, r[0]:r[1]].T)
+            out = np.empty_like(block)
+            _runBatch(self._columnSolver, self._chunk, block, out)
+            dst2[:, r[0]:r[1]] = out.T
+        list(self._pool.map(work, self._slabs(self._columns, self._chunk)))
+
+    def solve(self, src, dst=None):
+        """Transform src with the stage solvers on the thread pool."""
+        src = np.ascontiguousarray(src)
+        forward = (self._problem.direction() == SW_FORWARD)
+        if type(dst) == type(None):
+            if self._real and not forward:
+                dst = np.zeros(tuple(self._problem.dimensions()), self._ftype)
+            else:
+                dst = np.zeros(self._cxdims, self._cxtype)
+        elif not dst.flags.c_contiguous:
+            raise ValueError('dst must be a C-contiguous array')
+
+        if self._real and not forward:
+            # complex to real, the column stage works on the complex half
+            tmp = np.empty(self._cxdims, self._cxtype)
+            self._columnStage(src, tmp)
+            self._planeStage(tmp, dst)
+        else:
+            self._planeStage(src, dst)
+            self._columnStage(dst, dst)
+        return dst
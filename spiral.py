@@ -1,6 +1,15 @@
 
 import sys
+import json
+import os
+import queue
+import re
+import shutil
 import subprocess
+import tempfile
+import threading
+import time
+import uuid
 
 
 SPIRAL_KEY_CMAKEVERSION     =  'CMakeVersion'
@@ -16,13 +25,20 @@ SPIRAL_KEY_VERSION          =  'Version'
 SPIRAL_RET_OK   = 0
 SPIRAL_RET_ERR  = 1
 
+# commands every session runs once at startup, dropped from scripts sent to a session
+SPIRAL_SESSION_PREAMBLE = ['Load(fftx);', 'ImportAll(fftx);']
+SPIRAL_SENTINEL = 'SW_SPIRAL_DONE_'
+
+# file name of on-disk cache of build info
+SPIRAL_BUILDINFO_FILE = 'spiralbuildinfo.json'
+
 if sys.platform == 'win32':
     SPIRAL_EXE = 'spiral.bat'
 else:
     SPIRAL_EXE = 'spiral'
 
 
-def spiralBuildInfo():
+def _runSpiralBuildInfo():
     # -B option signals Spiral to print build info and exit early in startup
     # use BuildInfo() and quit commands for older Spiral version w/o -B option
     fallthroughstr = b'BuildInfo();\nquit;\n'
@@ -41,18 +57,255 @@ def spiralBuildInfo():
     return bdd
 
 
-def callSpiralWithFile(filename):
+def _spiralExeKey():
+    """Identify the installed SPIRAL executable by path, mtime and inode."""
+    exe = shutil.which(SPIRAL_EXE)
+    if exe == None:
+        return None
+    exe = os.path.realpath(exe)
+    try:
+        st = os.stat(exe)
+    except OSError:
+        return None
+    return '{}:{}:{}'.format(exe, st.st_mtime_ns, st.st_ino)
+
+
+_buildInfoCache = dict()
+_buildInfoLock = threading.Lock()
+
+def spiralBuildInfo(cachedir=None):
+    """Return SPIRAL build info, cached per executable in process and in cachedir."""
+    key = _spiralExeKey()
+    if key == None:
+        return _runSpiralBuildInfo()
+    with _buildInfoLock:
+        if key in _buildInfoCache:
+            return dict(_buildInfoCache[key])
+        cachefile = None if cachedir == None else os.path.join(cachedir, SPIRAL_BUILDINFO_FILE)
+        saved = dict()
+        if cachefile != None:
+            try:
+                with open(cachefile, 'r') as f:
+                    saved = json.load(f)
+            except (OSError, ValueError):
+                saved = dict()
+            if (type(saved) is dict) and (type(saved.get(key)) is dict):
+                _buildInfoCache[key] = saved[key]
+                return dict(saved[key])
+        bdd = _runSpiralBuildInfo()
+        if len(bdd) == 0:
+            return bdd
+        _buildInfoCache[key] = bdd
+        if cachefile != None:
+            # only the entry for the current executable is kept
+            try:
+                (fd, tmpname) = tempfile.mkstemp('.tmp', SPIRAL_BUILDINFO_FILE + '.', cachedir)
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({key : bdd}, f)
+                os.chmod(tmpname, 0o644)
+                os.replace(tmpname, cachefile)
+            except OSError:
+                pass
+        return dict(bdd)
+
+
+def callSpiralWithFile(filename, cwd=None, timeout=None):
+    """Run SPIRAL on script file, with generated files written to cwd, killed after timeout seconds."""
     try:
         with open(filename, 'r') as f:
-            runResult = subprocess.run(SPIRAL_EXE, stdin=f, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            runResult = subprocess.run(SPIRAL_EXE, stdin=f, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       timeout=timeout)
             if runResult.returncode == 0:
                 return SPIRAL_RET_OK
             else:
                 print(runResult.stderr.decode(), file=sys.stderr)
                 return SPIRAL_RET_ERR
+    except subprocess.TimeoutExpired:
+        print('SPIRAL timed out after ' + str(timeout) + ' seconds', file=sys.stderr)
     except OSError as ex:
         print(ex.strerror, file=sys.stderr)
     except:
         pass
     return SPIRAL_RET_ERR
 
+
+
+class SpiralSession:
+    """Long-lived SPIRAL process driven over stdin/stdout.
+    
+    Each script is followed by a command printing a unique sentinel line,
+    output up to the sentinel belongs to that script.  Generated files are
+    written to a private session directory and moved to the caller's
+    directory afterwards.  A session that reports an error, exits, or takes
+    longer than the timeout for one script is closed and started again on
+    next use.  timeout is the default for run(), None waits indefinitely.
+    
+    SPIRAL variables set by one script stay set for the following scripts
+    of the session, only a restart clears them.  Scripts must therefore
+    assign every variable they use, as SnowWhite's generated scripts do.
+    """
+    
+    _errorPat = re.compile(r'(^|\s)(Error,|brk>)')
+
+    def __init__(self, preamble=SPIRAL_SESSION_PREAMBLE, timeout=None):
+        self._preamble = preamble
+        self._timeout = timeout
+        self._proc = None
+        self._dir = None
+        self._lines = None
+
+    def _start(self, timeout):
+        self._dir = tempfile.mkdtemp(None, 'spiralsession_')
+        self._proc = subprocess.Popen(SPIRAL_EXE, stdin=subprocess.PIPE, stdout=subprocess.PIPE, 
+                                      stderr=subprocess.STDOUT, cwd=self._dir, 
+                                      universal_newlines=True, bufsize=1)
+        # output is read on its own thread, so waiting for it can time out
+        self._lines = queue.Queue()
+        reader = threading.Thread(target=self._readOutput, args=(self._proc.stdout, self._lines), daemon=True)
+        reader.start()
+        (ok, out) = self._exchange('\n'.join(self._preamble), timeout)
+        if not ok:
+            print(out, file=sys.stderr)
+            self.close()
+        return ok
+
+    @staticmethod
+    def _readOutput(stream, lines):
+        try:
+            for line in stream:
+                lines.put(line)
+        except (OSError, ValueError):
+            pass
+        # end of output, SPIRAL exited
+        lines.put(None)
+
+    def _exchange(self, text, timeout):
+        """Send text and read output up to the sentinel, return (ok, output)."""
+        tag = SPIRAL_SENTINEL + uuid.uuid4().hex
+        lines = []
+        deadline = None if timeout == None else time.monotonic() + timeout
+        try:
+            self._proc.stdin.write(text + '\nPrint("' + tag + '", "\\n");\n')
+            self._proc.stdin.flush()
+        except OSError:
+            return (False, '')
+        while True:
+            try:
+                if deadline == None:
+                    line = self._lines.get()
+                else:
+                    line = self._lines.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                # a hung SPIRAL would not exit on closing its input
+                self._proc.kill()
+                lines.append('SPIRAL session timed out after ' + str(timeout) + ' seconds\n')
+                return (False, ''.join(lines))
+            if line == None:
+                # SPIRAL exited before printing the sentinel
+                return (False, ''.join(lines))
+            if (tag in line) and ('Print(' not in line):
+                # keep anything printed ahead of the sentinel, e.g. a prompt
+                lines.append(line[:line.index(tag)])
+                out = ''.join(lines)
+                return (self._errorPat.search(out) == None, out)
+            lines.append(line)
+
+    def alive(self):
+        return (self._proc != None) and (self._proc.poll() == None)
+
+    def run(self, filename, cwd=None, timeout=None):
+        """Run script file in the session, moving generated files to cwd.
+        
+        timeout overrides the session's timeout for this script.
+        """
+        if timeout == None:
+            timeout = self._timeout
+        if not self.alive():
+            self.close()
+            if not self._start(timeout):
+                return SPIRAL_RET_ERR
+        try:
+            with open(filename, 'r') as f:
+                lines = [l for l in f if l.strip() not in self._preamble]
+        except OSError as ex:
+            print(ex.strerror, file=sys.stderr)
+            return SPIRAL_RET_ERR
+        (ok, out) = self._exchange(''.join(lines), timeout)
+        dest = os.getcwd() if cwd == None else cwd
+        for name in os.listdir(self._dir):
+            shutil.move(os.path.join(self._dir, name), os.path.join(dest, name))
+        if ok:
+            return SPIRAL_RET_OK
+        print(out, file=sys.stderr)
+        # state after an error is unknown, start over next time
+        self.close()
+        return SPIRAL_RET_ERR
+
+    def close(self):
+        if self._proc != None:
+            try:
+                self._proc.stdin.close()
+                self._proc.wait(timeout=5)
+            except:
+                self._proc.kill()
+                self._proc.wait()
+            self._proc = None
+        if self._dir != None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
+
+class SpiralSessionPool:
+    """Fixed number of SPIRAL sessions shared by concurrent builds."""
+    
+    def __init__(self, size=1, timeout=None):
+        self._sessions = [SpiralSession(timeout=timeout) for i in range(max(size, 1))]
+        self._free = queue.Queue()
+        for s in self._sessions:
+            self._free.put(s)
+
+    def run(self, filename, cwd=None, timeout=None):
+        session = self._free.get()
+        try:
+            return session.run(filename, cwd, timeout)
+        finally:
+            self._free.put(session)
+
+    def close(self):
+        for s in self._sessions:
+            s.close()
+
+
+_sessionPool = None
+_sessionPoolLock = threading.Lock()
+
+def callSpiralInSession(filename, cwd=None, poolSize=1, timeout=None):
+    """Run script file on a persistent SPIRAL session, starting the pool on first use.
+    
+    A session taking longer than timeout seconds is killed and restarted.
+    """
+    global _sessionPool
+    with _sessionPoolLock:
+        if _sessionPool == None:
+            import atexit
+            _sessionPool = SpiralSessionPool(poolSize)
+            atexit.register(_sessionPool.close)
+        pool = _sessionPool
+    return pool.run(filename, cwd, timeout)
+
+
+def _forgetSessionsAfterFork():
+    """In a forked child, leave the parent's SPIRAL sessions to the parent and reset locks."""
+    global _sessionPool, _sessionPoolLock, _buildInfoLock
+    if _sessionPool != None:
+        # the processes are not our children, the pool's atexit close must not touch them
+        for s in _sessionPool._sessions:
+            s._proc = None
+            s._dir = None
+    _sessionPool = None
+    _sessionPoolLock = threading.Lock()
+    # another thread may have held it when the process forked
+    _buildInfoLock = threading.Lock()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_forgetSessionsAfterFork)
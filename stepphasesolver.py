@@ -3,11 +3,6 @@ from snowwhite import *
 from snowwhite.swsolver import *
 import numpy as np
 
-try:
-    import cupy as cp
-except ModuleNotFoundError:
-    cp = None
-
 import ctypes
 import sys
 
@@ -67,6 +62,9 @@ class StepPhaseSolver(SWSolver):
     def solve(self, src, amplitudes, dst=None):
         """Call SPIRAL-generated function."""
         
+        if not self._useLibrary():
+            return self._solveDef(dst, src, amplitudes)
+        
         xp = get_array_module(src)
         
         if type(dst) == type(None):
@@ -127,6 +125,8 @@ class StepPhaseSolver(SWSolver):
         print('    rec(fname := name, params := [symvar]));', file = script_file)
         print('', file = script_file)
         print('opts := conf.getOpts(t);', file = script_file)
+        self._writeVariantOpts(script_file)
+        self._writeVectorOpts(script_file)
         if self._genCuda or self._genHIP:
             print ( 'opts.wrapCFuncs := true;', file = script_file )
         if self._opts.get(SW_OPT_REALCTYPE) == "float":
@@ -2,9 +2,17 @@
 from snowwhite import *
 import snowwhite as sw
 from snowwhite.metadata import *
+from snowwhite.buildcache import BuildCache, scriptHash, filesHash, installFile
+from snowwhite.filelock import FileLock
+from snowwhite.libcache import markLibraryUsed
+from snowwhite.buildbackends import buildBackend, SW_BACKEND_CMAKE
+from snowwhite.cpufeatures import isaSupported, isaSpiralName, isaCompileFlags, isaFeatures
+from snowwhite.cpufeatures import marchFeatures, featuresSupported
 
 import datetime
+import hashlib
 import subprocess
+import time
 import os
 import sys
 import json
@@ -14,14 +22,10 @@ import shutil
 
 import numpy as np
 
-try:
-    import cupy as cp
-except ModuleNotFoundError:
-    cp = None
-
 import ctypes
 import sys
-
+import threading
+import weakref
 
 
 class SWProblem:
@@ -39,11 +43,313 @@ class SWProblem:
         
     def direction(self):
         return self._k
-        
+
+    def canonicalKey(self):
+        """Return hashable key identifying the problem type and parameters."""
+        return (type(self).__name__, _hashableValue(vars(self)))
+
+
+def _hashableValue(v):
+    if type(v) is dict:
+        return tuple((k, _hashableValue(v[k])) for k in sorted(v))
+    if type(v) in (list, tuple):
+        return tuple(_hashableValue(x) for x in v)
+    return v
+
+
+class _SharedLibrary:
+    """Shared library loaded once per process with reference counted init/destroy."""
+    
+    def __init__(self, path, initName, destroyName, gpu=False):
+        self.path = path
+        self.initName = initName
+        self.destroyName = destroyName
+        self.gpu = gpu
+        # reason the library cannot run in this process, or None
+        self.unusable = None
+        self.refCount = 0
+        self.initialized = False
+        # bytes allocated by init, measured on first init, and workspace use
+        self.workspaceBytes = None
+        self.active = 0
+        self.lastUse = 0
+        self.access = ctypes.CDLL(path)
+
+    def key(self):
+        return (self.path, self.initName, self.destroyName)
+
+    def initFunc(self):
+        """Call the SPIRAL generated init function"""
+        if self.unusable != None:
+            raise RuntimeError(self.unusable)
+        gf = getattr(self.access, self.initName, None)
+        if gf != None:
+            # the allocation counters are process-wide: inits run one at a
+            # time and hold the GIL, so neither another init nor Python code
+            # in other threads allocates while one is measured
+            gf = _InitFuncType(ctypes.cast(gf, ctypes.c_void_p).value)
+            with _initLock:
+                before = _allocatedBytes()
+                ret = gf()
+                after = _allocatedBytes()
+            self.initialized = True
+            # every init shows what this library allocates, except that the
+            # process size only grows on the first, later ones reuse its memory
+            if (before != None) and ((_mallinfo2 != None) or (self.workspaceBytes == None)):
+                self.workspaceBytes = max(after - before, 0)
+            return ret
+        else:
+            msg = 'could not find function: ' + self.initName
+            raise RuntimeError(msg)
+
+    def destroyFunc(self):
+        """Call the SPIRAL generated destroy function"""
+        gf = getattr(self.access, self.destroyName, None)
+        self.initialized = False
+        if gf != None:
+            return gf()
+        else:
+            msg = 'could not find function: ' + self.destroyName
+            raise RuntimeError(msg)
+
+
+# init functions are called through this type, which keeps the GIL held
+_InitFuncType = ctypes.PYFUNCTYPE(ctypes.c_int)
+_initLock = threading.Lock()
+
+
+class _MallInfo2(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_size_t) for name in ['arena', 'ordblks', 'smblks', 'hblks', 'hblkhd',
+                                                      'usmblks', 'fsmblks', 'uordblks', 'fordblks', 'keepcost']]
+
+
+def _findMallinfo2():
+    """Return glibc's mallinfo2 function, or None."""
+    try:
+        func = ctypes.CDLL(None).mallinfo2
+    except (OSError, AttributeError, TypeError):
+        return None
+    func.restype = _MallInfo2
+    func.argtypes = []
+    return func
+
+_mallinfo2 = _findMallinfo2()
+
+
+def _allocatedBytes():
+    """Return bytes allocated by malloc, or the process size without glibc, None if unknown."""
+    if _mallinfo2 != None:
+        info = _mallinfo2()
+        # small blocks from the heap and large ones mapped on their own
+        return info.uordblks + info.hblkhd
+    return _processSize()
+
+
+def _processSize():
+    """Return virtual memory size of this process in bytes, None if unknown."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+# libraries in use, keyed by (path, init name, destroy name)
+_sharedLibraries = dict()
+_sharedLibrariesLock = threading.RLock()
+
+# solvers in this process, so a forked child can replace their locks
+_solvers = weakref.WeakSet()
+
+# limit on bytes of initialized workspaces, see setWorkspaceBudget()
+_workspaceBudget = None
+_workspaceUses = 0
+_workspaceStats = {'Reinits' : 0, 'Evictions' : 0}
+
+
+def _residentWorkspaces():
+    # private copies count too, though only shared libraries are ever evicted
+    libs = list(_sharedLibraries.values()) + list(_privateCopies)
+    return sum(lib.workspaceBytes or 0 for lib in libs if lib.initialized)
+
+
+def _evictWorkspaces(needed=0, keep=None):
+    """Destroy workspaces of idle libraries, least recently used first, until needed bytes fit the budget."""
+    if _workspaceBudget == None:
+        return
+    resident = _residentWorkspaces()
+    while resident + needed > _workspaceBudget:
+        idle = [lib for lib in _sharedLibraries.values()
+                if lib.initialized and (lib.active == 0) and (lib is not keep)]
+        if len(idle) == 0:
+            # running transforms keep their workspaces, the budget is exceeded until they finish
+            return
+        lib = min(idle, key = lambda l: l.lastUse)
+        lib.destroyFunc()
+        _workspaceStats['Evictions'] += 1
+        resident -= lib.workspaceBytes or 0
+
+
+def _beginWorkspaceUse(lib):
+    """Mark library running, running its init function again if its workspace was evicted."""
+    global _workspaceUses
+    with _sharedLibrariesLock:
+        _workspaceUses += 1
+        lib.lastUse = _workspaceUses
+        if not lib.initialized:
+            _evictWorkspaces(lib.workspaceBytes or 0, lib)
+            lib.initFunc()
+            _workspaceStats['Reinits'] += 1
+        lib.active += 1
+
+
+def _endWorkspaceUse(lib):
+    with _sharedLibrariesLock:
+        lib.active -= 1
+        _evictWorkspaces()
+
+
+def setWorkspaceBudget(nbytes):
+    """Limit memory held by the workspaces of loaded libraries to nbytes, None for no limit.
+    
+    The generated init functions allocate the workspaces, which stay until
+    destroy.  With a budget, workspaces of idle libraries are destroyed,
+    least recently used first, to keep the total within the budget, and
+    set up again by init when their library next runs.  Running transforms
+    always keep theirs, as do the private copies of perthread solvers,
+    which count against the budget.  Workspace sizes are measured as the
+    memory allocated by each init, from glibc's malloc statistics or else the
+    growth of the process, on systems without either nothing is limited.
+    Allocations by other threads between the counter reads around an init
+    can still skew its size.  GPU memory allocated by init is not seen by either, so the device
+    workspaces of CUDA and HIP libraries are not counted.
+    """
+    global _workspaceBudget
+    with _sharedLibrariesLock:
+        _workspaceBudget = None if nbytes == None else int(nbytes)
+        if _workspaceBudget == None:
+            # without a budget solve() expects its library initialized
+            for lib in _sharedLibraries.values():
+                if (not lib.initialized) and (lib.unusable == None):
+                    lib.initFunc()
+                    _workspaceStats['Reinits'] += 1
+        _evictWorkspaces()
+
+
+def workspaceStats():
+    """Return budget, bytes of initialized workspaces and counters of the workspace budget."""
+    with _sharedLibrariesLock:
+        stats = dict(_workspaceStats)
+        stats['Budget'] = _workspaceBudget
+        stats['Resident'] = _residentWorkspaces()
+        stats['Initialized'] = sum(1 for lib in _sharedLibraries.values() if lib.initialized)
+        stats['Libraries'] = len(_sharedLibraries)
+        stats['PrivateCopies'] = sum(1 for lib in _privateCopies if lib.initialized)
+        return stats
+
+
+def _acquireLibrary(path, initName, destroyName, gpu=False):
+    """Load library and run its init function unless already done for another solver."""
+    key = (os.path.realpath(path), initName, destroyName)
+    with _sharedLibrariesLock:
+        lib = _sharedLibraries.get(key)
+        if lib == None:
+            lib = _SharedLibrary(key[0], initName, destroyName, gpu)
+            markLibraryUsed(key[0])
+        if not lib.initialized:
+            lib.initFunc()
+        lib.refCount += 1
+        _sharedLibraries[key] = lib
+        _evictWorkspaces(0, lib)
+        return lib
+
+
+# private library copies of per-thread solvers, see SWSolver._privateMainFunc
+_privateCopies = weakref.WeakSet()
+
+
+def _loadPrivateCopy(shared):
+    """Load a private copy of shared library with its own static data and run its init function.
+    
+    Loading the same file again returns the already loaded library, so the
+    copy is loaded from a temporary file, removed once loaded where the
+    system allows.
+    """
+    (fd, tmpname) = tempfile.mkstemp(SW_SHLIB_EXT, 'swcopy_')
+    with os.fdopen(fd, 'wb') as dst, open(shared.path, 'rb') as src:
+        shutil.copyfileobj(src, dst)
+    try:
+        with _sharedLibrariesLock:
+            # make room for the copy's workspace, measured by its own init
+            _evictWorkspaces(shared.workspaceBytes or 0)
+            lib = _SharedLibrary(tmpname, shared.initName, shared.destroyName, shared.gpu)
+            lib.initFunc()
+            _privateCopies.add(lib)
+    finally:
+        try:
+            os.remove(tmpname)
+        except OSError:
+            pass
+    return lib
+
+
+def libraryInUse(path):
+    """Return True if a solver in this process uses the library at path."""
+    path = os.path.realpath(path)
+    with _sharedLibrariesLock:
+        return any(k[0] == path for k in _sharedLibraries)
+
+
+def _releaseLibrary(lib):
+    """Drop one reference to library, running its destroy function with the last one."""
+    with _sharedLibrariesLock:
+        lib.refCount -= 1
+        if lib.refCount > 0:
+            return
+        _sharedLibraries.pop(lib.key(), None)
+        if lib.initialized:
+            lib.destroyFunc()
+
+
+def _reinitLibrariesAfterFork():
+    """Run init functions of CPU libraries again in a forked child.
+    
+    The child's copy of the state set up by init is shared copy-on-write with
+    the parent, so the child gets its own.  CUDA and HIP state does not
+    survive fork and cannot be set up again in the child, so GPU libraries
+    loaded before the fork are marked unusable.
+    """
+    global _sharedLibrariesLock, _initLock
+    # another thread may have held a lock when the process forked
+    _sharedLibrariesLock = threading.RLock()
+    _initLock = threading.Lock()
+    for solver in list(_solvers):
+        solver._traceLock = threading.Lock()
+        solver._libraryLock = threading.Lock()
+        solver._privateLock = threading.Lock()
+    for lib in list(_sharedLibraries.values()) + list(_privateCopies):
+        if lib.gpu:
+            # neither init nor destroy may touch the GPU in the child
+            lib.initialized = False
+            lib.unusable = ('GPU library ' + lib.path + ' was loaded before fork and cannot run in the '
+                            'forked child, create GPU solvers after forking or use spawn')
+        elif lib.initialized:
+            try:
+                lib.initFunc()
+            except Exception as ex:
+                print('Could not initialize ' + lib.path + ' after fork: ' + str(ex), file=sys.stderr)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reinitLibrariesAfterFork)
+
+
 
 class SWSolver:
     """Base class for SnowWhite solver."""
     
+    # True for solvers whose CPU scripts support SPIRAL's SMP parallelization
+    _threadsSupported = False
+    
     def __init__(self, problem: SWProblem, namebase = 'func', opts = {}):
         self._problem = problem
         self._opts = opts
@@ -53,18 +359,50 @@ class SWSolver:
         self._keeptemp = self._opts.get(SW_OPT_KEEPTEMP, os.getenv(SW_KEEPTEMP) != None)
         self._withMPI = self._opts.get(SW_OPT_MPI, False)
         self._printRuleTree = self._opts.get(SW_OPT_PRINTRULETREE, False)
+        self._spiralSession = self._opts.get(SW_OPT_SPIRALSESSION, os.getenv(SW_SPIRAL_SESSIONS) != None)
+        self._spiralTimeout = self._opts.get(SW_OPT_SPIRALTIMEOUT)
         self._tracingOn = False
         self._callGraph = []
+        self._traceLock = threading.Lock()
+        self._libraryLock = threading.Lock()
+        self._library = None
         self._SharedLibAccess = None
+        self._perThread = self._opts.get(SW_OPT_PERTHREAD, False)
+        self._ownerThread = threading.current_thread()
+        self._threadLocal = threading.local()
+        self._privateLibraries = []
+        self._privateLock = threading.Lock()
+        _solvers.add(self)
         self._MainFunc = None
         self._spiralname = 'spiral'
         self._metadata = dict()
         self._includeMetadata = self._opts.get(SW_OPT_METADATA, False)
         self._workdir = os.getenv(SW_WORKDIR)
+        # rebuild even if the library is installed or in the build cache
+        self._rebuild = self._opts.get(SW_OPT_REBUILD, False)
+        self._useBuildCache = self._opts.get(SW_OPT_BUILDCACHE, True) and not self._rebuild
+        self._buildBackendName = self._opts.get(SW_OPT_BUILDBACKEND, SW_BACKEND_CMAKE)
+        self._buildTimings = dict()
+        self._deferred = self._opts.get(SW_OPT_DEFER, False)
+        self._tune = int(self._opts.get(SW_OPT_TUNE, 0))
+        self._variant = dict()
+        self._tuning = None
+        self._threads = 0
+        if self._threadsSupported and (self._opts.get(SW_OPT_PLATFORM, SW_CPU) == SW_CPU):
+            self._threads = int(self._opts.get(SW_OPT_THREADS, 0))
+        self._numThreads = self._threads
+        self._ompSetNumThreads = None
+        self._isa = None
+        if self._opts.get(SW_OPT_PLATFORM, SW_CPU) == SW_CPU:
+            self._isa = self._opts.get(SW_OPT_ISA)
+        if (self._isa != None) and not isaSupported(self._isa):
+            print('Vector ISA ' + str(self._isa) + ' not supported by host CPU, generating scalar code',
+                  file=sys.stderr)
+            self._isa = None
+        self._setupCompileFlags()
         
         # find and possibly create the .libs subdirectory
-        moduleDir = os.path.dirname(os.path.realpath(__file__))
-        self._libsDir = os.path.join(moduleDir, SW_LIBSDIR)
+        self._libsDir = libraryDirs()[0]
         os.makedirs(self._libsDir, mode=0o777, exist_ok=True)
         
         if self._genCuda:
@@ -73,38 +411,305 @@ class SWSolver:
             self._namebase = namebase + '_hip'
         else:
             self._namebase = namebase
+        if self._isa != None:
+            self._namebase = self._namebase + '_' + self._isa
+        if self._threads > 0:
+            self._namebase = self._namebase + '_t' + str(self._threads)
+        # the compile flags change only the library, not the SPIRAL script
+        # or the names of its functions
+        self._libbase = self._namebase
+        if self._flagsSuffix != None:
+            self._libbase = self._libbase + self._flagsSuffix
             
         self._mainFuncName = self._namebase
         self._initFuncName = 'init_' + self._namebase
         self._destroyFuncName = 'destroy_' + self._namebase
         
-        # check first for library built for this specific transform
-        sharedLibFullPath = os.path.join(self._libsDir, 'lib' + self._namebase + SW_SHLIB_EXT)
+        self._background = self._opts.get(SW_OPT_BACKGROUND, False)
+        self._buildThread = None
+        self._buildError = None
+        self._buildDone = threading.Event()
+        self._ready = threading.Event()
+        self._lastSolvePath = None
+        self._solvePathCounts = {SW_PATH_LIBRARY : 0, SW_PATH_PYTHON : 0}
+        
+        # deferred solvers only describe a transform, e.g. for building a bundle
+        if self._deferred:
+            return
+        
+        sharedLibFullPath = None if self._rebuild else self._findSharedLibrary()
+        if sharedLibFullPath == None:
+            if self._background:
+                # solve() uses runDef until the build thread loads the library
+                self._buildThread = threading.Thread(target=self._buildInBackground, daemon=True)
+                self._buildThread.start()
+                return
+            sharedLibFullPath = self._buildSharedLibrary()
+        self._loadSharedLibrary(sharedLibFullPath)
+
+    def __getstate__(self):
+        """Pickle only problem and options, the library is found again on unpickling."""
+        opts = dict(self._opts)
+        # a copy solves right away rather than building or describing a transform
+        opts.pop(SW_OPT_DEFER, None)
+        opts.pop(SW_OPT_BACKGROUND, None)
+        opts.pop(SW_OPT_REBUILD, None)
+        return {'problem' : self._problem, 'opts' : opts}
+
+    def __setstate__(self, state):
+        """Set up solver from pickled problem and options.
+        
+        The library is found in the installed libraries or by its metadata,
+        as for a new solver, and only built if no longer installed.
+        """
+        type(self).__init__(self, state['problem'], dict(state['opts']))
 
-        # if no matching specific library, look in metadata of installed libraries
-        # and create one if no matching transform is in an existing installed library
-        if not os.path.exists(sharedLibFullPath):
-            searchmd = self._metadataForSearch()
-            (path, names) = findFunctionsWithMetadata(searchmd)
-            if (type(path) is str) and (type(names) is dict) and (len(names) > 2):
-                sharedLibFullPath = path
+    def _setupCompileFlags(self):
+        """Set compiler flags and the CPU features they require from the options."""
+        self._compileFlags = []
+        self._requiredFeatures = []
+        self._flagsSuffix = None
+        if self._opts.get(SW_OPT_PLATFORM, SW_CPU) != SW_CPU:
+            return
+        
+        march = self._opts.get(SW_OPT_MARCH)
+        features = marchFeatures(march)
+        if features == None:
+            print('Unknown CPU features of -march=' + march + ', not checked before use', file=sys.stderr)
+            features = []
+        elif not featuresSupported(features):
+            print('Host CPU does not support -march=' + march + ', compiling for generic CPU', file=sys.stderr)
+            march = None
+            features = []
+        
+        flags = []
+        if march != None:
+            flags.append('-march=' + march)
+        if self._opts.get(SW_OPT_FASTMATH, False):
+            flags.append('-ffast-math')
+        if self._opts.get(SW_OPT_LTO, False):
+            flags.append('-flto')
+        flags += list(self._opts.get(SW_OPT_CFLAGS, []))
+        if self._isa != None:
+            features = features + isaFeatures(self._isa)
+        self._requiredFeatures = sorted(set(features))
+        
+        # libraries built with other flags are different libraries, -march=native
+        # differs per host so its features are part of the library name
+        if len(flags) > 0:
+            h = hashlib.sha256((' '.join(flags) + '\n' + ' '.join(self._requiredFeatures)).encode())
+            self._flagsSuffix = '_f' + h.hexdigest()[:8]
+        if self._isa != None:
+            flags = isaCompileFlags(self._isa) + flags
+        self._compileFlags = flags
+
+    def _findSharedLibrary(self):
+        """Return path of installed library with this transform, or None."""
+        if self._tunable():
+            return self._findTunedLibrary()
+        
+        # look first in metadata of installed libraries, which finds the best
+        # library the host can run
+        searchmd = self._metadataForSearch()
+        (path, names) = findFunctionsWithMetadata(searchmd)
+        if (type(path) is str) and (type(names) is dict) and (len(names) > 2):
+            self._mainFuncName    = names.get(SW_KEY_EXEC, self._mainFuncName)
+            self._initFuncName    = names.get(SW_KEY_INIT, self._initFuncName)
+            self._destroyFuncName = names.get(SW_KEY_DESTROY, self._destroyFuncName)
+            return path
+        
+        # then for library built for this specific transform without metadata
+        sharedLibFullPath = os.path.join(self._libsDir, 'lib' + self._libbase + SW_SHLIB_EXT)
+        if os.path.exists(sharedLibFullPath):
+            return sharedLibFullPath
+        return None
+
+    def _findTunedLibrary(self):
+        """Return path of installed library with this transform tuned, or None."""
+        # tuned libraries rank ahead of untuned ones, so if the best match is
+        # not tuned none is
+        (path, names) = findFunctionsWithMetadata(self._metadataForSearch())
+        if (type(path) is not str) or (type(names) is not dict) or (len(names) < 3):
+            return None
+        metadata = metadataInFile(path)
+        if metadata == None:
+            return None
+        for xform in metadata.get(SW_KEY_TRANSFORMS, []):
+            if (xform.get(SW_KEY_NAMES) == names) and (SW_KEY_TUNING in xform):
                 self._mainFuncName    = names.get(SW_KEY_EXEC, self._mainFuncName)
                 self._initFuncName    = names.get(SW_KEY_INIT, self._initFuncName)
                 self._destroyFuncName = names.get(SW_KEY_DESTROY, self._destroyFuncName)
-            else:
-                self._setupCFuncs(self._namebase)
+                return path
+        return None
+
+    def _buildSharedLibrary(self):
+        """Build library unless another process builds it first, return its path."""
+        lockfile = os.path.join(self._libsDir, SW_LOCKSDIR, self._libbase + '.lock')
+        with FileLock(lockfile):
+            # recheck, the library may have been installed while waiting
+            sharedLibFullPath = None if self._rebuild else self._findSharedLibrary()
+            if sharedLibFullPath == None:
+                if self._tunable():
+                    self._tuneLibrary(self._namebase)
+                else:
+                    self._setupCFuncs(self._namebase)
+                sharedLibFullPath = os.path.join(self._libsDir, 'lib' + self._libbase + SW_SHLIB_EXT)
+        return sharedLibFullPath
 
-        self._SharedLibAccess = ctypes.CDLL(sharedLibFullPath)
-        self._MainFunc = getattr(self._SharedLibAccess, self._mainFuncName)
-        if self._MainFunc == None:
+    def _loadSharedLibrary(self, sharedLibFullPath):
+        library = _acquireLibrary(sharedLibFullPath, self._initFuncName, self._destroyFuncName,
+                                  self._genCuda or self._genHIP)
+        mainFunc = getattr(library.access, self._mainFuncName, None)
+        if mainFunc == None:
+            _releaseLibrary(library)
             msg = 'could not find function: ' + self._mainFuncName
             raise RuntimeError(msg)
-        self._initFunc()
+        with self._libraryLock:
+            self._library = library
+            self._SharedLibAccess = library.access
+            self._MainFunc = mainFunc
+            if self._threads > 0:
+                self._ompSetNumThreads = getattr(self._SharedLibAccess, 'omp_set_num_threads', None)
+            # switch solve() to the library only once it is fully set up
+            self._ready.set()
+        self._buildDone.set()
+
+    def _buildInBackground(self):
+        try:
+            self._loadSharedLibrary(self._buildSharedLibrary())
+        except Exception as ex:
+            self._buildError = ex
+            print('Background build of ' + self._namebase + ' failed: ' + str(ex), file=sys.stderr)
+        finally:
+            self._buildDone.set()
+
+    def isReady(self):
+        """Return True if solve() calls the generated library."""
+        return self._ready.is_set()
+
+    def waitReady(self, timeout=None):
+        """Wait for a background build, return True if the library is loaded.
+        
+        Raises RuntimeError if the background build failed.
+        """
+        self._buildDone.wait(timeout)
+        if self._buildError != None:
+            raise RuntimeError('background build failed: ' + str(self._buildError))
+        return self._ready.is_set()
+
+    def solvePath(self):
+        """Return how the last solve() was computed, SW_PATH_LIBRARY or SW_PATH_PYTHON."""
+        return self._lastSolvePath
+
+    def solvePathCounts(self):
+        """Return number of solve() calls computed by each path."""
+        return dict(self._solvePathCounts)
+
+    def _useLibrary(self):
+        """Choose and record the path for a solve() call."""
+        if getattr(self._threadLocal, 'variantFunc', None) != None:
+            # timing a tuning variant, not counted as a solve
+            if (self._threads > 0) and (self._threadLocal.variantOmp != None):
+                self._threadLocal.variantOmp(self._numThreads)
+            return True
+        path = SW_PATH_LIBRARY if self._ready.is_set() else SW_PATH_PYTHON
+        self._lastSolvePath = path
+        self._solvePathCounts[path] += 1
+        if (path == SW_PATH_LIBRARY) and (self._ompSetNumThreads != None):
+            # OpenMP thread count is per calling thread, set it for every call
+            self._ompSetNumThreads(self._numThreads)
+        return path == SW_PATH_LIBRARY
+
+    @property
+    def _MainFunc(self):
+        """Main function for the calling thread.
+        
+        With the perthread option, threads other than the one that created
+        the solver each call a private copy of the library, whose generated
+        code has its own static workspace, so they can solve concurrently.
+        """
+        variant = getattr(self._threadLocal, 'variantFunc', None)
+        if variant != None:
+            return variant
+        if self._perThread and (self._library != None) and (threading.current_thread() != self._ownerThread):
+            return self._privateMainFunc()
+        if self._library != None:
+            # counted as running even without a budget, one may be set meanwhile
+            return self._callWithWorkspace
+        return self._sharedMainFunc
+
+    def _callWithWorkspace(self, *args):
+        """Call main function, with the library's workspace set up and kept while it runs."""
+        _beginWorkspaceUse(self._library)
+        try:
+            return self._sharedMainFunc(*args)
+        finally:
+            _endWorkspaceUse(self._library)
+
+    @_MainFunc.setter
+    def _MainFunc(self, func):
+        self._sharedMainFunc = func
+
+    def _privateMainFunc(self):
+        func = getattr(self._threadLocal, 'mainFunc', None)
+        if func != None:
+            return func
+        me = threading.current_thread()
+        with self._privateLock:
+            # take over the copy of a thread that has exited
+            lib = None
+            for (i, (thread, copy)) in enumerate(self._privateLibraries):
+                if not thread.is_alive():
+                    lib = copy
+                    self._privateLibraries[i] = (me, lib)
+                    break
+            if lib == None:
+                lib = _loadPrivateCopy(self._library)
+                self._privateLibraries.append((me, lib))
+        func = getattr(lib.access, self._mainFuncName)
+        self._threadLocal.mainFunc = func
+        return func
+
+    def privateCopies(self):
+        """Return number of private library copies of a perthread solver."""
+        with self._privateLock:
+            return len(self._privateLibraries)
+
+    def threads(self):
+        """Return number of OpenMP threads used by solve(), 0 for sequential code."""
+        return self._numThreads if self._threads > 0 else 0
+
+    def setThreads(self, n):
+        """Set number of OpenMP threads used by solve() of a multithreaded build.
+        
+        The generated code divides the work for the thread count it was built
+        for, usually the best choice, fewer threads share the parts.
+        """
+        if self._threads == 0:
+            raise RuntimeError(type(self).__name__ + ' was not built with threads')
+        if n < 1:
+            raise ValueError('thread count must be positive')
+        self._numThreads = int(n)
+
+    def _solveDef(self, dst, *args):
+        """Compute with runDef while the library is not available."""
+        with self._traceLock:
+            ret = self.runDef(*args)
+        if type(dst) == type(None):
+            return ret
+        dst[...] = ret
+        return dst
 
     def __del__(self):
         try:
             # destroy function may not exist if cleaning up after error
-            self._destroyFunc()
+            for (thread, lib) in self._privateLibraries:
+                if lib.initialized:
+                    lib.destroyFunc()
+            self._privateLibraries = []
+            if self._library != None:
+                _releaseLibrary(self._library)
+                self._library = None
         except:
             pass
     
@@ -118,28 +723,29 @@ class SWSolver:
         raise NotImplementedError()
     
     def _genScript(self, filename : str):
-        self._trace()
-        try:
-            script_file = open(filename, 'w')
-        except:
-            print('Error: Could not open ' + filename + ' for writing', file=sys.stderr)
-            return
-        timestr = datetime.datetime.now().strftime("%a %b %d %H:%M:%S %Y")
-        print(file = script_file)
-        print("# SPIRAL script generated by " + type(self).__name__, file = script_file)
-        print('# ' + timestr, file = script_file)
-        print(file = script_file)
-        self._writeScript(script_file)
-        script_file.close()
+        # tracing records into the solver's call graph, so solve() must not
+        # run runDef while a background build traces
+        with self._traceLock:
+            self._trace()
+            try:
+                script_file = open(filename, 'w')
+            except:
+                print('Error: Could not open ' + filename + ' for writing', file=sys.stderr)
+                return
+            timestr = datetime.datetime.now().strftime("%a %b %d %H:%M:%S %Y")
+            print(file = script_file)
+            print("# SPIRAL script generated by " + type(self).__name__, file = script_file)
+            print('# ' + timestr, file = script_file)
+            print(file = script_file)
+            self._writeScript(script_file)
+            script_file.close()
         
     def _setFunctionMetadata(self, obj):
         pass
         
-    def _buildMetadata(self):
-        md = self._metadata
-        md[SW_KEY_SPIRALBUILDINFO] = spiralBuildInfo()
+    def _functionMetadata(self):
+        """Return metadata describing this solver's transform and entry points."""
         funcmeta = dict()
-        md[SW_KEY_TRANSFORMS] = [ funcmeta ]
         funcmeta[SW_KEY_DIRECTION]  = SW_STR_INVERSE if self._problem.direction() == SW_INVERSE else SW_STR_FORWARD
         funcmeta[SW_KEY_PRECISION] = SW_STR_SINGLE if self._opts.get(SW_OPT_REALCTYPE) == "float" else SW_STR_DOUBLE
         funcmeta[SW_KEY_TRANSFORMTYPE] = SW_TRANSFORM_UNKNOWN
@@ -150,13 +756,30 @@ class SWSolver:
         names[SW_KEY_EXEC] = self._mainFuncName
         names[SW_KEY_INIT] = self._initFuncName
         names[SW_KEY_DESTROY] = 'destroy_' + self._namebase
+        if self._threads > 0:
+            funcmeta[SW_KEY_THREADS] = self._threads
+        if self._isa != None:
+            funcmeta[SW_KEY_ISA] = self._isa
+        if len(self._compileFlags) > 0:
+            funcmeta[SW_KEY_COMPILEFLAGS] = self._compileFlags
+        if len(self._requiredFeatures) > 0:
+            funcmeta[SW_KEY_REQUIREDFEATURES] = self._requiredFeatures
+        if self._tuning != None:
+            funcmeta[SW_KEY_TUNING] = self._tuning
         self._setFunctionMetadata(funcmeta)
+        return funcmeta
+
+    def _buildMetadata(self):
+        md = self._metadata
+        md[SW_KEY_SPIRALBUILDINFO] = spiralBuildInfo(self._libsDir)
+        funcmeta = self._functionMetadata()
+        md[SW_KEY_TRANSFORMS] = [ funcmeta ]
         md[SW_KEY_TRANSFORMTYPES] = [ funcmeta.get(SW_KEY_TRANSFORMTYPE) ]
     
-    def _createMetadataFile(self, basename):
+    def _createMetadataFile(self, basename, builddir):
         """Write metadata source file."""
         varname  = basename + SW_METAVAR_EXT
-        filename = basename + SW_METAFILE_EXT
+        filename = os.path.join(builddir, basename + SW_METAFILE_EXT)
         self._buildMetadata()
         writeMetadataSourceFile(self._metadata, varname, filename) 
 
@@ -167,97 +790,279 @@ class SWSolver:
         funcmeta[SW_KEY_TRANSFORMTYPE] = SW_TRANSFORM_UNKNOWN
         funcmeta[SW_KEY_DIMENSIONS] = self._problem.dimensions()
         funcmeta[SW_KEY_PLATFORM] = self._opts.get(SW_OPT_PLATFORM, SW_CPU)
+        if self._threads > 0:
+            funcmeta[SW_KEY_THREADS] = self._threads
+        if self._isa != None:
+            funcmeta[SW_KEY_ISA] = self._isa
+        if len(self._compileFlags) > 0:
+            funcmeta[SW_KEY_COMPILEFLAGS] = self._compileFlags
         self._setFunctionMetadata(funcmeta)
         return funcmeta
 
-    def _callSpiral(self, script):
-        """Run SPIRAL with script as input."""
+    def _callSpiral(self, script, builddir):
+        """Run SPIRAL with script as input in builddir."""
         if self._genCuda:
             print ( 'Generating CUDA', flush = True )
         elif self._genHIP:
             print ( 'Generating HIP', flush = True )
         else:
             print ( 'Generating C', flush = True )
-        return callSpiralWithFile(script)
+        if self._spiralSession:
+            try:
+                poolSize = int(os.getenv(SW_SPIRAL_SESSIONS, '1'))
+            except ValueError:
+                poolSize = 1
+            return callSpiralInSession(script, builddir, poolSize, self._spiralTimeout)
+        return callSpiralWithFile(script, builddir, self._spiralTimeout)
 
-    def _callCMake (self, basename):
-        ##  Assumes:  SPIRAL_HOME is defined (environment variable) or override on command line
-        ##  FILEROOT = basename;
-        
-        print("Compiling and linking");
-        
-        # copy module CMakeLists to current directory
-        module_dir = os.path.dirname(__file__)
-        cmfile = os.path.join(module_dir, 'CMakeLists.txt')
-        shutil.copy(cmfile, os.getcwd())
+    def _buildBackend(self):
+        platform = self._opts.get(SW_OPT_PLATFORM, SW_CPU)
+        return buildBackend(self._buildBackendName, platform, self._withMPI, self._threads > 0,
+                            self._compileFlags)
 
-        cmake_defroot = '-DFILEROOT:STRING=' + basename
-        
-        cmd = 'cmake ' + cmake_defroot
-        if self._genCuda:
-            cmd += ' -DHASCUDA=1'
-        elif self._genHIP:
-            cmd += ' -DHASHIP=1 -DCMAKE_CXX_COMPILER=hipcc'    
-            
-        if self._withMPI:
-            cmd += ' -DHASMPI=1'
-            
-        if self._includeMetadata:
-            cmd += ' -DHAS_METADATA=1'
+    def _buildCache(self):
+        """Return the build cache, or None if disabled."""
+        if not self._useBuildCache:
+            return None
+        root = os.getenv(SW_BUILDCACHE, os.path.join(self._libsDir, SW_BUILDCACHEDIR))
+        return BuildCache(root)
 
-        cmd += ' -DPY_LIBS_DIR=' + self._libsDir
-        
-        if sys.platform == 'win32':
-            ##  NOTE: Ensure Python installed on Windows is 64 bit
-            cmd += ' . && cmake --build . --config Release --target install'
-        else:
-            cmd += ' . && make install'
-            
-        runResult = subprocess.run(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        if runResult.returncode != 0:
-            print(runResult.stderr.decode(), file=sys.stderr)
-        
-        return runResult.returncode
+    def _buildParentDir(self):
+        """Return absolute path of the parent of temporary build directories."""
+        if self._workdir != None:
+            if os.path.isdir(self._workdir):
+                return os.path.abspath(self._workdir)
+            print('Could not find workdir "' + str(self._workdir) + '". Using current directory.')
+        return os.getcwd()
             
     def _setupCFuncs(self, basename):
-        # if workdir specified, cd to it
-        if self._workdir != None:
-            try:
-                os.chdir(self._workdir)
-            except:
-                print('Could not find workdir "' + str(self._workdir) + '". Using current directory.')
-    
-        # create temporary build directory and cd to it
-        cwd = os.getcwd()
-        tempdir = tempfile.mkdtemp(None, basename + '_', cwd)
-        os.chdir(tempdir)
+        createMetadata = self._createMetadataFile if self._includeMetadata else None
+        self._buildLibrary(basename, self._genScript, createMetadata, libbase=self._libbase)
+
+    def _buildLibrary(self, basename, genScript, createMetadata, libsDir=None, libbase=None):
+        """Generate, compile and install lib<basename> using this solver's settings.
+        
+        genScript(path) writes the SPIRAL script, createMetadata(basename, builddir)
+        the metadata source file, if not None.  The library is installed in
+        libsDir, default the module library directory, as lib<libbase> if
+        libbase is given.
+        """
+        if libsDir == None:
+            libsDir = self._libsDir
+        if libbase == None:
+            libbase = basename
+        # create temporary build directory, every step below uses explicit
+        # paths so the process working directory is never changed
+        tempdir = tempfile.mkdtemp(None, basename + '_', self._buildParentDir())
+        cache = self._buildCache()
+        backend = self._buildBackend()
+        timings = {'Backend' : backend.name}
+        self._buildTimings = timings
+        tstart = time.perf_counter()
     
-        script = basename + ".g"
-        self._genScript(script)
-        ret = self._callSpiral(script)
-        if ret == SPIRAL_RET_OK:
-            if self._includeMetadata:
-                self._createMetadataFile(basename)
+        scriptname = basename + ".g"
+        script = os.path.join(tempdir, scriptname)
+        genScript(script)
+        
+        # identical scripts run by the same SPIRAL generate identical sources
+        t0 = time.perf_counter()
+        srckey = None
+        if cache != None:
+            srckey = scriptHash(script, spiralBuildInfo(self._libsDir))
+        if (cache != None) and cache.fetchSources(srckey, tempdir):
+            print('Using cached generated source', flush = True)
         else:
-            # return to original working directory and raise error
-            os.chdir(cwd)
-            msg = 'SPIRAL error'
-            raise RuntimeError(msg)
+            ret = self._callSpiral(script, tempdir)
+            if ret != SPIRAL_RET_OK:
+                msg = 'SPIRAL error'
+                raise RuntimeError(msg)
+            if cache != None:
+                generated = [f for f in os.listdir(tempdir) if f != scriptname]
+                cache.storeSources(srckey, tempdir, generated)
+        timings['Generate'] = time.perf_counter() - t0
         
-        ret = self._callCMake(basename)
+        if createMetadata != None:
+            createMetadata(basename, tempdir)
+        files = sorted(f for f in os.listdir(tempdir) if f != scriptname)
+        sources = [f for f in files if os.path.splitext(f)[1] in SW_SOURCE_EXTS]
         
-        # return to original working directory
-        os.chdir(cwd)
+        # identical sources and build configuration give identical libraries
+        libname = 'lib' + libbase + SW_SHLIB_EXT
+        if cache != None:
+            libkey = filesHash(tempdir, files, backend.config(basename, sources))
+            if cache.fetchLibrary(libkey, libname, libsDir):
+                print('Using cached library', flush = True)
+                timings['Total'] = time.perf_counter() - tstart
+                if (not self._keeptemp):
+                    shutil.rmtree(tempdir, ignore_errors=True)
+                return
+        
+        print("Compiling and linking", flush = True)
+        installdir = os.path.join(tempdir, 'install')
+        ret = backend.build(basename, sources, tempdir, installdir)
+        timings.update(backend.timings)
         
         if ret != 0:
-            msg = "CMake error"
+            msg = backend.name + " build error"
             raise RuntimeError(msg)
         
+        # the backend installs to the build directory, publish the library with
+        # an atomic rename so no process ever loads a partially written file
+        staged = os.path.join(installdir, 'lib' + basename + SW_SHLIB_EXT)
+        installFile(staged, os.path.join(libsDir, libname))
+        
+        if cache != None:
+            cache.storeLibrary(libkey, staged)
+        timings['Total'] = time.perf_counter() - tstart
+        print('Built ' + basename + ' in ' + 
+              ', '.join('{} {:.2f}s'.format(k, v) for (k, v) in timings.items() if k != 'Backend') +
+              ' (' + backend.name + ')', flush = True)
+        
         # optionally remove temp dir
         if (not self._keeptemp):
             shutil.rmtree(tempdir, ignore_errors=True)
         
         return
+
+    def _tuneVariants(self, count):
+        """Return up to count generation variants to compare when tuning.
+        
+        Each variant is a dict describing changes to the default script, the
+        first is the default.  Solvers that cannot be tuned return [].
+        """
+        return []
+
+    def _tunable(self):
+        """Return True if builds are tuned.
+        
+        Tuning needs variants to compare, and metadata to record the result
+        in, otherwise the default is built and found as usual.
+        """
+        return (self._tune > 1) and self._includeMetadata and (len(self._tuneVariants(self._tune)) > 1)
+
+    def _unrollingVariants(self, count):
+        """Variants of the FFTX scripts differing in the unrolling threshold."""
+        variants = [dict()]
+        for unroll in [16, 32, 64, 128, 256, 512]:
+            variants.append({'Opts' : {'globalUnrolling' : unroll}})
+        return variants[:count]
+
+    def _writeVariantOpts(self, script_file):
+        """Write the SPIRAL opts settings of the variant being generated."""
+        for (k, v) in sorted(self._variant.get('Opts', {}).items()):
+            print('opts.' + k + ' := ' + str(v) + ';', file = script_file)
+
+    def _spiralISA(self):
+        """Return SPIRAL vector ISA for this solver's ISA and precision."""
+        precision = SW_STR_SINGLE if self._opts.get(SW_OPT_REALCTYPE) == "float" else SW_STR_DOUBLE
+        return isaSpiralName(self._isa, precision)
+
+    def _writeVectorOpts(self, script_file):
+        """Write SPIRAL opts for SIMD code of the FFTX CPU confs, if an ISA is requested."""
+        if self._isa == None:
+            return
+        print('Import(paradigms.vector);', file = script_file)
+        print('opts.tags := Concatenation(opts.tags, [AVecReg(' + self._spiralISA() + ')]);', file = script_file)
+
+    def _writeThreadOpts(self, script_file):
+        """Write SPIRAL opts for OpenMP parallel code, if threads are requested."""
+        if self._threads < 1:
+            return
+        print('Import(paradigms.smp);', file = script_file)
+        print('opts.tags := Concatenation([AParSMP(' + str(self._threads) + ')], opts.tags);', file = script_file)
+        print('opts.unparser := CopyFields(opts.unparser, OpenMP_UnparseMixin);', file = script_file)
+        print('Add(opts.includes, "<omp.h>");', file = script_file)
+
+    def _timeVariant(self, libpath, args):
+        """Return seconds per call of the library at libpath, None if its results are wrong."""
+        library = _SharedLibrary(libpath, self._initFuncName, self._destroyFuncName,
+                                 self._genCuda or self._genHIP)
+        library.initFunc()
+        try:
+            # only this thread's solve() calls the variant, solve() on other
+            # threads keeps using runDef or the installed library
+            self._threadLocal.variantFunc = getattr(library.access, self._mainFuncName)
+            self._threadLocal.variantOmp = getattr(library.access, 'omp_set_num_threads', None)
+            
+            result = self.solve(*args)
+            expected = self.runDef(*args)
+            xp = sw.get_array_module(result)
+            tol = 1e-3 if self._opts.get(SW_OPT_REALCTYPE) == "float" else 1e-8
+            scale = max(1.0, float(xp.max(xp.abs(expected))))
+            if float(xp.max(xp.abs(result - expected))) > tol * scale:
+                return None
+            
+            # repeat until the total time is measurable, report the median
+            times = []
+            total = 0.0
+            while (len(times) < 5) or ((total < 0.2) and (len(times) < 1000)):
+                t0 = time.perf_counter()
+                self.solve(*args)
+                if xp != np:
+                    xp.cuda.runtime.deviceSynchronize()
+                t = time.perf_counter() - t0
+                times.append(t)
+                total += t
+            return sorted(times)[len(times) // 2]
+        finally:
+            self._threadLocal.variantFunc = None
+            self._threadLocal.variantOmp = None
+            library.destroyFunc()
+
+    def _tuneLibrary(self, basename):
+        """Build variants, time them and install lib<basename> from the fastest."""
+        variants = self._tuneVariants(self._tune)
+        if len(variants) < 2:
+            print('No tuning variants for ' + type(self).__name__ + ', building default', file=sys.stderr)
+            self._setupCFuncs(basename)
+            return
+        
+        testInput = self.buildTestInput()
+        args = testInput if type(testInput) is tuple else (testInput,)
+        
+        tunedir = tempfile.mkdtemp(None, basename + '_tune_', self._buildParentDir())
+        results = []
+        try:
+            for (i, variant) in enumerate(variants):
+                self._variant = variant
+                libdir = os.path.join(tunedir, str(i))
+                os.makedirs(libdir)
+                print('Tuning variant ' + str(i + 1) + ' of ' + str(len(variants)) + ': ' +
+                      json.dumps(variant), flush = True)
+                try:
+                    self._buildLibrary(basename, self._genScript, None, libdir)
+                    secs = self._timeVariant(os.path.join(libdir, 'lib' + basename + SW_SHLIB_EXT), args)
+                    if secs == None:
+                        print('Variant ' + str(i + 1) + ' gives wrong results', file=sys.stderr)
+                except RuntimeError as ex:
+                    print('Variant ' + str(i + 1) + ' failed: ' + str(ex), file=sys.stderr)
+                    secs = None
+                results.append({SW_KEY_VARIANT : variant, SW_KEY_SECONDS : secs})
+        finally:
+            self._variant = dict()
+            if not self._keeptemp:
+                shutil.rmtree(tunedir, ignore_errors=True)
+        
+        valid = [r for r in results if r[SW_KEY_SECONDS] != None]
+        if len(valid) == 0:
+            raise RuntimeError('no valid variant of ' + basename)
+        best = min(valid, key = lambda r: r[SW_KEY_SECONDS])
+        print('Selected variant ' + json.dumps(best[SW_KEY_VARIANT]) + 
+              ', {:.3g}s per call'.format(best[SW_KEY_SECONDS]), flush = True)
+        
+        # rebuild the chosen variant with the tuning results in its metadata,
+        # the build cache saves running SPIRAL again
+        self._variant = best[SW_KEY_VARIANT]
+        self._tuning = {SW_KEY_VARIANT : best[SW_KEY_VARIANT], SW_KEY_SECONDS : best[SW_KEY_SECONDS],
+                        SW_KEY_VARIANTS : results}
+        try:
+            self._setupCFuncs(basename)
+        finally:
+            self._variant = dict()
+
+    def buildTimings(self):
+        """Return seconds spent in each step of this solver's build, empty if not built."""
+        return dict(self._buildTimings)
         
     def buildTestInput(self):
         raise NotImplementedError()
@@ -272,16 +1077,6 @@ class SWSolver:
         for i in range(len(self._callGraph)-1):
             self._callGraph[i] = self._callGraph[i] + ','
 
-    def _initFunc(self):
-        """Call the SPIRAL generated init function"""
-        gf = getattr(self._SharedLibAccess, self._initFuncName, None)
-        if gf != None:
-            ##  print ( 'SWSolver._initFunc: found init_' + self._namebase, flush = True )
-            return gf()
-        else:
-            msg = 'could not find function: ' + self._initFuncName
-            raise RuntimeError(msg)
-
     def _func(self, dst, src):
         """Call the SPIRAL generated main function"""
         
@@ -297,21 +1092,14 @@ class SWSolver:
         else:
             if not self._genCuda and not self._genHIP:
                 raise RuntimeError('CPU function requires NumPy arrays')
+            if (self._library != None) and (self._library.unusable != None):
+                raise RuntimeError(self._library.unusable)
             # CuPy array on GPU
             srcdev = ctypes.cast(src.data.ptr, ctypes.POINTER(ctypes.c_void_p))
             dstdev = ctypes.cast(dst.data.ptr, ctypes.POINTER(ctypes.c_void_p))
             return self._MainFunc(dstdev, srcdev)
 
         
-    def _destroyFunc(self):
-        """Call the SPIRAL generated destroy function"""
-        gf = getattr(self._SharedLibAccess, self._destroyFuncName, None)
-        if gf != None:
-            return gf()
-        else:
-            msg = 'could not find function: ' + self._destroyFuncName
-            raise RuntimeError(msg)
-
     def zeroEmbedBox(self, src, padding):
         xp = sw.get_array_module(src)
         retCube = xp.pad(src, padding)
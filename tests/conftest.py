@@ -0,0 +1,102 @@
+"""
+Fixtures for the SnowWhite tests.
+
+The tests run without SPIRAL: fakeSpiral puts a stub spiral script first
+on PATH, which speaks the session protocol and writes a C file with empty
+init, destroy and transform functions for every PrintTo.
+"""
+
+import os
+import shutil
+import stat
+import sys
+
+import pytest
+
+import snowwhite.metadata
+from snowwhite import *
+
+_stubScript = r'''
+import os, re, sys, time
+if '-B' in sys.argv:
+    print('Version: 8.5.0-stub')
+    print('GitHash: 0123abcd')
+    sys.exit(0)
+log = os.getenv('STUB_SPIRAL_LOG')
+if log:
+    with open(log, 'a') as f:
+        f.write('start ' + str(os.getpid()) + '\n')
+if os.getenv('STUB_SPIRAL_HANG'):
+    time.sleep(60)
+time.sleep(float(os.getenv('STUB_SPIRAL_DELAY', '0')))
+
+def generate(text):
+    names = re.findall(r'name(?:root)?\s*:=\s*"([^"]+)"', text)
+    for (i, out) in enumerate(re.findall(r'PrintTo\("([^"]+)"', text)):
+        with open(out, 'w') as f:
+            f.write('/* generated */\n')
+            if i < len(names):
+                f.write('void init_%s(void) {}\nvoid destroy_%s(void) {}\n' % (names[i], names[i]))
+                f.write('void %s(void *Y, void *X) {}\n' % names[i])
+
+failed = False
+script = ''
+for line in sys.stdin:
+    if log:
+        with open(log, 'a') as f:
+            f.write('line ' + line)
+    if 'CRASH' in line:
+        sys.exit(1)
+    if 'HANG' in line:
+        time.sleep(60)
+    if 'FAIL' in line:
+        failed = True
+        print("Error, Variable: 'FAIL' must have a value")
+        print('brk> ', end='')
+    script += line
+    m = re.search(r'Print\("(SW_SPIRAL_DONE_\w+)"', line)
+    if m:
+        generate(script)
+        script = ''
+        print('spiral> ' + m.group(1), flush=True)
+generate(script)
+sys.exit(1 if failed else 0)
+'''
+
+
+@pytest.fixture
+def fakeSpiral(tmp_path, monkeypatch):
+    """Put a stub spiral on PATH, return the path of the log of its starts and input lines."""
+    bindir = tmp_path / 'spiralbin'
+    bindir.mkdir()
+    exe = bindir / 'spiral'
+    exe.write_text('#!' + sys.executable + '\n' + _stubScript)
+    exe.chmod(exe.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+    (tmp_path / 'profiler' / 'targets' / 'include').mkdir(parents=True)
+    log = tmp_path / 'spiral.log'
+    monkeypatch.setenv('PATH', str(bindir) + os.pathsep + os.environ.get('PATH', ''))
+    monkeypatch.setenv('SPIRAL_HOME', str(tmp_path))
+    monkeypatch.setenv('STUB_SPIRAL_LOG', str(log))
+    return log
+
+
+@pytest.fixture
+def libsDir(fakeSpiral, tmp_path, monkeypatch):
+    """Build solvers with the stub spiral into a private library directory, return its path.
+    
+    Builds use the direct compiler backend, tests using this fixture are
+    skipped without a C compiler.
+    """
+    if shutil.which('cc') == None:
+        pytest.skip('needs a C compiler')
+    libs = tmp_path / 'libs'
+    libs.mkdir()
+    work = tmp_path / 'work'
+    work.mkdir()
+    monkeypatch.setattr(snowwhite.metadata, '_moduleLibsDir', str(libs))
+    monkeypatch.delenv(SW_LIBRARY_PATH, raising=False)
+    monkeypatch.delenv(SW_BUILDCACHE, raising=False)
+    monkeypatch.delenv(SW_SPIRAL_SESSIONS, raising=False)
+    monkeypatch.setenv(SW_WORKDIR, str(work))
+    snowwhite.metadata.clearMetadataIndexCache()
+    return libs
@@ -0,0 +1,43 @@
+import ctypes
+import shutil
+
+import pytest
+
+from snowwhite import *
+from snowwhite.buildbackends import *
+from snowwhite.mddftsolver import MddftProblem, MddftSolver
+
+
+def test_backend_by_name():
+    assert buildBackend(SW_BACKEND_CC).name == SW_BACKEND_CC
+    assert buildBackend(SW_BACKEND_CMAKE).name == SW_BACKEND_CMAKE
+    # only CPU code is compiled directly
+    assert buildBackend(SW_BACKEND_CC, SW_CUDA).name == SW_BACKEND_CMAKE
+    with pytest.raises(ValueError):
+        buildBackend('make')
+
+
+def test_config_includes_flags(monkeypatch):
+    monkeypatch.setenv('CC', 'cc')
+    plain = buildBackend(SW_BACKEND_CC).config('f', ['f.c'])
+    assert plain == buildBackend(SW_BACKEND_CC).config('f', ['f.c'])
+    assert plain != buildBackend(SW_BACKEND_CC, flags=['-ffast-math']).config('f', ['f.c'])
+    assert plain != buildBackend(SW_BACKEND_CC, openmp=True).config('f', ['f.c'])
+
+
+@pytest.mark.skipif(shutil.which('cc') == None, reason='needs a C compiler')
+def test_cc_backend_builds_library(fakeSpiral, tmp_path):
+    (tmp_path / 'f.c').write_text('int f(void) { return 42; }\n')
+    backend = buildBackend(SW_BACKEND_CC)
+    assert backend.build('f', ['f.c'], str(tmp_path), str(tmp_path / 'install')) == 0
+    lib = ctypes.CDLL(str(tmp_path / 'install' / ('libf' + SW_SHLIB_EXT)))
+    assert lib.f() == 42
+    assert 'Compile' in backend.timings
+
+
+@pytest.mark.parametrize('backend', [SW_BACKEND_CC, SW_BACKEND_CMAKE])
+def test_solver_builds_with_backend(libsDir, backend):
+    if shutil.which(backend) == None:
+        pytest.skip('needs ' + backend)
+    solver = MddftSolver(MddftProblem([8, 8, 8]), {SW_OPT_BUILDBACKEND : backend})
+    assert solver.buildTimings()['Backend'] == backend
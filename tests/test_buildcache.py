@@ -0,0 +1,71 @@
+import os
+
+from snowwhite import *
+from snowwhite.buildcache import *
+from snowwhite.mddftsolver import MddftProblem, MddftSolver
+from snowwhite.metadata import clearMetadataIndexCache
+
+
+def _script(path, text):
+    path.write_text(text)
+    return str(path)
+
+
+def test_sources_miss_then_hit(tmp_path):
+    cache = BuildCache(str(tmp_path / 'cache'))
+    key = scriptHash(_script(tmp_path / 'a.g', 'x := 1;\n'))
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    assert not cache.fetchSources(key, str(dest))
+
+    build = tmp_path / 'build'
+    build.mkdir()
+    (build / 'a.c').write_text('int a;\n')
+    cache.storeSources(key, str(build), ['a.c'])
+    assert cache.fetchSources(key, str(dest))
+    assert (dest / 'a.c').read_text() == 'int a;\n'
+
+
+def test_script_key_ignores_comments(tmp_path):
+    a = scriptHash(_script(tmp_path / 'a.g', '# Mon Jan 01\nx := 1;\n'))
+    b = scriptHash(_script(tmp_path / 'b.g', '# Tue Jan 02\nx := 1;\n'))
+    c = scriptHash(_script(tmp_path / 'c.g', '# Tue Jan 02\nx := 2;\n'))
+    assert a == b
+    assert a != c
+
+
+def test_script_key_includes_build_info(tmp_path):
+    script = _script(tmp_path / 'a.g', 'x := 1;\n')
+    v1 = scriptHash(script, {'Version' : '8.5.0', 'GitHash' : 'abc'})
+    v2 = scriptHash(script, {'Version' : '8.5.1', 'GitHash' : 'abc'})
+    assert v1 != v2
+    assert v1 == scriptHash(script, {'GitHash' : 'abc', 'Version' : '8.5.0'})
+
+
+def test_library_miss_then_hit(tmp_path):
+    build = tmp_path / 'build'
+    build.mkdir()
+    (build / 'a.c').write_text('int a;\n')
+    key = filesHash(str(build), ['a.c'], 'cmake\n-O2')
+    assert key != filesHash(str(build), ['a.c'], 'cmake\n-O3')
+
+    cache = BuildCache(str(tmp_path / 'cache'))
+    libs = tmp_path / 'libs'
+    libs.mkdir()
+    assert not cache.fetchLibrary(key, 'liba.so', str(libs))
+    (build / 'liba.so').write_bytes(b'library')
+    cache.storeLibrary(key, str(build / 'liba.so'))
+    assert cache.fetchLibrary(key, 'liba.so', str(libs))
+    assert (libs / 'liba.so').read_bytes() == b'library'
+
+
+def test_solver_rebuild_uses_cache(libsDir, fakeSpiral):
+    MddftSolver(MddftProblem([8, 8, 8]), {SW_OPT_BUILDBACKEND : 'cc'})
+    for f in os.listdir(libsDir):
+        if f.endswith(SW_SHLIB_EXT):
+            os.remove(libsDir / f)
+    clearMetadataIndexCache()
+    MddftSolver(MddftProblem([8, 8, 8]), {SW_OPT_BUILDBACKEND : 'cc'})
+    starts = [l for l in fakeSpiral.read_text().splitlines() if l.startswith('start ')]
+    assert len(starts) == 1
+    assert (libsDir / 'buildcache').is_dir()
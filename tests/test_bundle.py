@@ -0,0 +1,20 @@
+import os
+
+from snowwhite import *
+from snowwhite.bundle import buildBundle, bundleSolvers
+from snowwhite.mddftsolver import MddftProblem
+
+_opts = {SW_OPT_BUILDBACKEND : 'cc'}
+
+
+def test_bundle_builds_all_transforms_once(libsDir, fakeSpiral):
+    problems = [MddftProblem([n, n, n], k) for n in [4, 8] for k in [SW_FORWARD, SW_INVERSE]]
+    solvers = bundleSolvers(problems, 'testbundle', _opts)
+    libpath = str(libsDir / ('libtestbundle' + SW_SHLIB_EXT))
+    assert [s._library.path for s in solvers] == [libpath] * 4
+    assert len(set(s._mainFuncName for s in solvers)) == 4
+    assert [f for f in os.listdir(libsDir) if f.endswith(SW_SHLIB_EXT)] == ['libtestbundle' + SW_SHLIB_EXT]
+    # already installed, not built again
+    assert buildBundle(problems, 'testbundle', _opts) == None
+    starts = [l for l in fakeSpiral.read_text().splitlines() if l.startswith('start ')]
+    assert len(starts) == 1
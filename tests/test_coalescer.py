@@ -0,0 +1,86 @@
+import threading
+
+import numpy as np
+import pytest
+
+import snowwhite.coalescer
+from snowwhite import *
+from snowwhite.coalescer import BatchCoalescer
+from snowwhite.mddftsolver import MddftProblem
+
+_dims = [2, 2, 2]
+
+
+class _DoublingSolver:
+    """Stands in for MddftSolver and BatchMddftSolver, solve() doubles its input."""
+
+    def __init__(self, problem):
+        self.problem = problem
+
+    def solve(self, src):
+        return src * 2
+
+
+@pytest.fixture
+def solvers(monkeypatch):
+    """Solvers handed out by the coalescer, in order."""
+    made = []
+    def fakeGetSolver(problem, opts={}):
+        solver = _DoublingSolver(problem)
+        made.append(solver)
+        return solver
+    monkeypatch.setattr(snowwhite.coalescer, 'get_solver', fakeGetSolver)
+    return made
+
+
+def _src(i):
+    return np.full(_dims, i, np.complex128)
+
+
+def test_batch_runs_on_power_of_two_library(solvers):
+    coalescer = BatchCoalescer(MddftProblem(_dims), maxBatch=8, deadline=60)
+    try:
+        futures = [coalescer.submit(_src(i)) for i in range(5)]
+        # lowering the limit makes the waiting requests due now
+        coalescer.setMaxBatch(5)
+        for (i, f) in enumerate(futures):
+            assert np.array_equal(f.result(10), _src(i) * 2)
+    finally:
+        coalescer.close()
+    # five requests collected under a limit of five run on a library for five, not eight
+    assert [s.problem.szBatch() for s in solvers[1:]] == [5]
+    assert coalescer.stats()['Batched'] == 5
+
+
+def test_batch_size_uses_limit_when_collected(solvers):
+    coalescer = BatchCoalescer(MddftProblem(_dims), maxBatch=4, deadline=60)
+    try:
+        srcs = [_src(i) for i in range(3)]
+        # the limit drops after the group was collected under a limit of four
+        coalescer.setMaxBatch(2)
+        results = coalescer._solveBatch(srcs, 4)
+    finally:
+        coalescer.close()
+    assert solvers[-1].problem.szBatch() == 4
+    for (src, res) in zip(srcs, results):
+        assert np.array_equal(res, src * 2)
+
+
+def test_single_request_runs_unbatched(solvers):
+    coalescer = BatchCoalescer(MddftProblem(_dims), maxBatch=4, deadline=0)
+    try:
+        assert np.array_equal(coalescer.solve(_src(3)), _src(3) * 2)
+    finally:
+        coalescer.close()
+    assert len(solvers) == 1
+    assert coalescer.stats()['Batches'] == 0
+
+
+def test_close_runs_queued_requests(solvers):
+    coalescer = BatchCoalescer(MddftProblem(_dims), maxBatch=4, deadline=60)
+    futures = [coalescer.submit(_src(i)) for i in range(2)]
+    coalescer.close()
+    for (i, f) in enumerate(futures):
+        assert np.array_equal(f.result(0), _src(i) * 2)
+    with pytest.raises(RuntimeError):
+        coalescer.submit(_src(0))
@@ -0,0 +1,39 @@
+import pytest
+
+import snowwhite.cpufeatures
+from snowwhite.cpufeatures import *
+
+
+@pytest.fixture
+def hostFeatures(monkeypatch):
+    """Return function setting what _readCPUInfo() reports for the host."""
+    def setFeatures(features):
+        monkeypatch.setattr(snowwhite.cpufeatures, '_readCPUInfo', lambda: features)
+        monkeypatch.setattr(snowwhite.cpufeatures, '_hostFeatures', None)
+        monkeypatch.setattr(snowwhite.cpufeatures, '_hostFeaturesRead', False)
+    return setFeatures
+
+
+def test_known_host_filters(hostFeatures):
+    hostFeatures({'sse2', 'avx'})
+    assert hostCPUFeatures() == frozenset({'sse2', 'avx'})
+    assert isaSupported('avx')
+    assert not isaSupported('avx2')
+    assert featuresSupported(['sse2', 'avx'])
+    assert not featuresSupported(['avx512f'])
+    assert marchFeatures('native') == ['avx']
+
+
+def test_unknown_host_does_not_filter(hostFeatures):
+    hostFeatures(None)
+    assert hostCPUFeatures() == None
+    assert isaSupported('avx512')
+    assert featuresSupported(['avx512f'])
+    assert marchFeatures('native') == None
+
+
+def test_explicit_features():
+    assert featuresSupported(['avx2', 'fma'], {'avx2', 'fma', 'sse2'})
+    assert not isaSupported('avx2', {'avx2'})
+    assert marchFeatures('x86-64') == []
+    assert marchFeatures('no-such-cpu') == None
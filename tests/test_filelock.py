@@ -0,0 +1,36 @@
+import multiprocessing
+
+from snowwhite import *
+from snowwhite.filelock import FileLock
+from snowwhite.mddftsolver import MddftProblem, MddftSolver
+
+
+def test_lock_excludes_other_holder(tmp_path):
+    path = str(tmp_path / 'locks' / 'a.lock')
+    a = FileLock(path)
+    b = FileLock(path)
+    assert a.acquire()
+    try:
+        assert not b.acquire(blocking=False)
+    finally:
+        a.release()
+    assert b.acquire(blocking=False)
+    b.release()
+
+
+def _build():
+    MddftSolver(MddftProblem([8, 8, 8]), {SW_OPT_BUILDBACKEND : 'cc'})
+
+
+def test_concurrent_processes_build_once(libsDir, fakeSpiral, monkeypatch):
+    # the first build is still running when the second process starts
+    monkeypatch.setenv('STUB_SPIRAL_DELAY', '1')
+    ctx = multiprocessing.get_context('fork')
+    procs = [ctx.Process(target=_build) for i in range(2)]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join(60)
+    assert [p.exitcode for p in procs] == [0, 0]
+    starts = [l for l in fakeSpiral.read_text().splitlines() if l.startswith('start ')]
+    assert len(starts) == 1
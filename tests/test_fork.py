@@ -0,0 +1,90 @@
+import os
+import pickle
+
+import pytest
+
+import snowwhite
+import snowwhite.buildcache
+import snowwhite.cpufeatures
+import snowwhite.registry
+import snowwhite.spiral
+import snowwhite.swsolver
+from snowwhite import *
+from snowwhite.mddftsolver import MddftProblem, MddftSolver
+from snowwhite.registry import SolverRegistry
+
+pytestmark = pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs fork')
+
+
+def _inChild(check):
+    """Run check() in a forked child, return True if it returned True."""
+    pid = os.fork()
+    if pid == 0:
+        try:
+            ok = check()
+        except BaseException:
+            ok = False
+        os._exit(0 if ok else 1)
+    (pid, status) = os.waitpid(pid, 0)
+    return os.WIFEXITED(status) and (os.WEXITSTATUS(status) == 0)
+
+
+class _FakeLibrary:
+    def __init__(self, gpu):
+        self.path = 'libfake.so'
+        self.gpu = gpu
+        self.initialized = True
+        self.unusable = None
+        self.inits = 0
+
+    def initFunc(self):
+        self.inits += 1
+
+
+def test_child_reinits_cpu_libraries_only(monkeypatch):
+    cpu = _FakeLibrary(False)
+    gpu = _FakeLibrary(True)
+    monkeypatch.setattr(snowwhite.swsolver, '_sharedLibraries', {'cpu' : cpu, 'gpu' : gpu})
+    def check():
+        return ((cpu.inits == 1) and cpu.initialized and (cpu.unusable == None) and 
+                (gpu.inits == 0) and not gpu.initialized and (gpu.unusable != None))
+    assert _inChild(check)
+    assert (cpu.inits, gpu.inits) == (0, 0)
+
+
+def test_child_resets_locks():
+    registry = SolverRegistry()
+    registry._buildLocks['key'] = snowwhite.registry.threading.Lock()
+    locks = [registry._lock, snowwhite.registry._defaultRegistryLock, snowwhite.spiral._buildInfoLock,
+             snowwhite.buildcache._compilerIdsLock, snowwhite.cpufeatures._hostFeaturesLock,
+             snowwhite._cupyLock, snowwhite.swsolver._initLock]
+    for lock in locks:
+        lock.acquire()
+    try:
+        def check():
+            current = [registry._lock, snowwhite.registry._defaultRegistryLock,
+                       snowwhite.spiral._buildInfoLock, snowwhite.buildcache._compilerIdsLock,
+                       snowwhite.cpufeatures._hostFeaturesLock, snowwhite._cupyLock,
+                       snowwhite.swsolver._initLock]
+            return all(lock.acquire(blocking=False) for lock in current) and (registry._buildLocks == {})
+        assert _inChild(check)
+    finally:
+        for lock in locks:
+            lock.release()
+
+
+def test_pickled_solver_finds_library(libsDir, fakeSpiral):
+    solver = MddftSolver(MddftProblem([8, 8, 8]), {SW_OPT_BUILDBACKEND : 'cc'})
+    copy = pickle.loads(pickle.dumps(solver))
+    assert copy._library is solver._library
+    starts = [l for l in fakeSpiral.read_text().splitlines() if l.startswith('start ')]
+    assert len(starts) == 1
+
+
+def test_child_resets_solver_locks(libsDir):
+    solver = MddftSolver(MddftProblem([8, 8, 8]), {SW_OPT_DEFER : True})
+    solver._traceLock.acquire()
+    try:
+        assert _inChild(lambda: solver._traceLock.acquire(blocking=False))
+    finally:
+        solver._traceLock.release()
@@ -0,0 +1,30 @@
+import subprocess
+import sys
+
+import snowwhite
+
+
+def _importedAfter(code):
+    """Return modules imported in a new interpreter after running code."""
+    script = code + '\nimport sys\nprint(" ".join(sorted(sys.modules)))\n'
+    out = subprocess.run([sys.executable, '-c', script], stdout=subprocess.PIPE, check=True)
+    return set(out.stdout.decode().split())
+
+
+def test_import_is_lazy():
+    modules = _importedAfter('import snowwhite')
+    assert 'numpy' not in modules
+    assert 'snowwhite.swsolver' not in modules
+    assert 'cupy' not in modules
+
+
+def test_lazy_names_import_their_module():
+    modules = _importedAfter('import snowwhite\nsnowwhite.MddftSolver')
+    assert 'snowwhite.mddftsolver' in modules
+    assert 'snowwhite.dftsolver' not in modules
+
+
+def test_lazy_names_resolve():
+    for name in snowwhite._lazyNames:
+        assert getattr(snowwhite, name).__name__ == name
+    assert 'MddftSolver' in dir(snowwhite)
@@ -0,0 +1,77 @@
+import os
+
+from snowwhite import *
+from snowwhite.buildcache import SW_BUILDCACHE_SOURCES
+from snowwhite.filelock import FileLock
+from snowwhite.libcache import *
+from snowwhite.metadata import clearMetadataIndexCache
+
+
+def _writeLibrary(libdir, name, size, lastUse):
+    """Write a stand-in library of size bytes with its usage marker set to lastUse."""
+    path = libdir / name
+    path.write_bytes(b'\0' * size)
+    marker = libdir / SW_USAGEDIR / name
+    marker.parent.mkdir(exist_ok=True)
+    marker.write_bytes(b'')
+    os.utime(marker, (lastUse, lastUse))
+    return path
+
+
+def _writeCacheEntry(root, key, size, lastUse):
+    entry = root / SW_BUILDCACHE_SOURCES / key[:2] / key
+    entry.mkdir(parents=True)
+    (entry / 'a.c').write_bytes(b'\0' * size)
+    os.utime(entry, (lastUse, lastUse))
+    return entry
+
+
+def test_parse_size():
+    assert parseSize('500') == 500
+    assert parseSize('2K') == 2048
+    assert parseSize('1.5m') == 3 << 19
+    assert parseSize('2GB') == 2 << 30
+
+
+def test_gc_removes_least_recently_used(tmp_path):
+    clearMetadataIndexCache()
+    libdir = tmp_path / 'libs'
+    libdir.mkdir()
+    old = _writeLibrary(libdir, 'libold.so', 1000, 1000)
+    new = _writeLibrary(libdir, 'libnew.so', 1000, 3000)
+    entry = _writeCacheEntry(libdir / SW_BUILDCACHEDIR, 'ab12', 1000, 2000)
+    
+    removed = collectGarbage(2500, [str(libdir)], dryRun=True)
+    assert [e['Path'] for e in removed] == [str(old)]
+    assert old.exists()
+    
+    removed = collectGarbage(1500, [str(libdir)])
+    assert [e['Path'] for e in removed] == [str(old), str(entry)]
+    assert not old.exists()
+    assert not entry.exists()
+    assert new.exists()
+    assert [os.path.basename(e['Path']) for e in cacheEntries([str(libdir)])] == ['libnew.so']
+
+
+def test_gc_skips_library_being_built(tmp_path):
+    clearMetadataIndexCache()
+    libdir = tmp_path / 'libs'
+    libdir.mkdir()
+    busy = _writeLibrary(libdir, 'libbusy.so', 1000, 1000)
+    idle = _writeLibrary(libdir, 'libidle.so', 1000, 2000)
+    lock = FileLock(str(libdir / SW_LOCKSDIR / 'busy.lock'))
+    lock.acquire()
+    try:
+        removed = collectGarbage(0, [str(libdir)])
+    finally:
+        lock.release()
+    assert [e['Path'] for e in removed] == [str(idle)]
+    assert busy.exists()
+
+
+def test_gc_bad_quota_is_usage_error(tmp_path, capsys):
+    from snowwhite.__main__ import main
+    for quota in ('lots', '1.5X', '-2G'):
+        assert main(['cache', 'gc', '--quota=' + quota, '--dir', str(tmp_path)]) == 1
+        assert 'Could not read --quota' in capsys.readouterr().err
+    assert main(['cache', 'gc', '--quota', '1G', '--dir', str(tmp_path), '--dry-run']) == 0
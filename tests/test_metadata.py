@@ -0,0 +1,141 @@
+import _ctypes
+import json
+import os
+import shutil
+import subprocess
+
+import pytest
+
+import snowwhite.metadata
+from snowwhite import *
+from snowwhite.metadata import *
+
+
+def _writeLibrary(path, dims, names=None):
+    """Write a stand-in library, not ELF, with metadata for an MDDFT of dims."""
+    xform = {SW_KEY_TRANSFORMTYPE : 'MDDFT', SW_KEY_DIMENSIONS : dims}
+    if names != None:
+        xform[SW_KEY_NAMES] = names
+    metadata = {SW_KEY_TRANSFORMS : [xform]}
+    path.write_bytes(b'\0code\0' + (SW_METADATA_START + json.dumps(metadata) + SW_METADATA_END).encode())
+    return metadata
+
+
+def _dims(libdir, name):
+    metadata = metadataIndexForDir(str(libdir))[name]
+    return metadata[SW_KEY_TRANSFORMS][0][SW_KEY_DIMENSIONS]
+
+
+def test_metadata_in_non_elf_file(tmp_path):
+    metadata = _writeLibrary(tmp_path / 'liba.dll', [8, 8, 8])
+    assert metadataInFile(str(tmp_path / 'liba.dll')) == metadata
+
+
+def test_metadata_in_empty_or_missing_file(tmp_path):
+    (tmp_path / 'empty.so').write_bytes(b'')
+    assert metadataInFile(str(tmp_path / 'empty.so')) == None
+    assert metadataInFile(str(tmp_path / 'missing.so')) == None
+
+
+def test_no_metadata_in_elf_library():
+    assert metadataInFile(_ctypes.__file__) == None
+
+
+@pytest.mark.skipif(shutil.which('cc') == None, reason='needs a C compiler')
+def test_metadata_in_elf_data_section(tmp_path):
+    metadata = {SW_KEY_TRANSFORMS : [{SW_KEY_TRANSFORMTYPE : 'MDDFT', SW_KEY_DIMENSIONS : [8, 8, 8]}]}
+    writeMetadataSourceFile(metadata, 'sw_metadata', str(tmp_path / 'metadata.c'))
+    lib = tmp_path / 'libmeta.so'
+    subprocess.run(['cc', '-shared', '-fPIC', '-o', str(lib), str(tmp_path / 'metadata.c')], check=True)
+    assert metadataInFile(str(lib)) == metadata
+
+
+def test_index_records_libraries(tmp_path):
+    clearMetadataIndexCache()
+    _writeLibrary(tmp_path / 'liba.so', [8, 8, 8])
+    (tmp_path / 'libplain.so').write_bytes(b'no metadata')
+    libs = metadataIndexForDir(str(tmp_path))
+    assert set(libs) == {'liba.so', 'libplain.so'}
+    assert libs['libplain.so'] == None
+    assert (tmp_path / 'swindex.json').exists()
+
+
+def test_index_sees_new_library(tmp_path):
+    clearMetadataIndexCache()
+    _writeLibrary(tmp_path / 'liba.so', [8, 8, 8])
+    metadataIndexForDir(str(tmp_path))
+    _writeLibrary(tmp_path / 'libb.so', [16, 16, 16])
+    assert _dims(tmp_path, 'libb.so') == [16, 16, 16]
+
+
+def test_index_sees_library_replaced_in_place(tmp_path, monkeypatch):
+    monkeypatch.setattr(snowwhite.metadata, 'SW_INDEX_RECHECK_SECONDS', 0.0)
+    clearMetadataIndexCache()
+    lib = tmp_path / 'liba.so'
+    _writeLibrary(lib, [16, 16, 16])
+    assert _dims(tmp_path, 'liba.so') == [16, 16, 16]
+    dirstat = os.stat(tmp_path)
+    _writeLibrary(lib, [32, 32, 32])
+    # the directory looks unchanged, only the file is different, same size
+    os.utime(tmp_path, ns=(dirstat.st_atime_ns, dirstat.st_mtime_ns))
+    assert _dims(tmp_path, 'liba.so') == [32, 32, 32]
+
+
+def test_index_lookup_does_not_stat_libraries(tmp_path, monkeypatch):
+    clearMetadataIndexCache()
+    for i in range(20):
+        _writeLibrary(tmp_path / ('lib%d.so' % i), [i + 2, 4, 4])
+    metadataIndexForDir(str(tmp_path))
+    stats = []
+    realStat = os.stat
+    def countingStat(path, *args, **kwargs):
+        stats.append(path)
+        return realStat(path, *args, **kwargs)
+    monkeypatch.setattr(os, 'stat', countingStat)
+    for i in range(10):
+        metadataIndexForDir(str(tmp_path))
+    # the directory and its index file only
+    assert len(stats) == 20
+
+
+def test_index_sees_rewritten_index_file(tmp_path):
+    clearMetadataIndexCache()
+    _writeLibrary(tmp_path / 'liba.so', [8, 8, 8])
+    metadataIndexForDir(str(tmp_path))
+    dirstat = os.stat(tmp_path)
+    other = {SW_KEY_TRANSFORMS : [{SW_KEY_TRANSFORMTYPE : 'MDDFT', SW_KEY_DIMENSIONS : [4, 4, 4]}]}
+    addToDirIndex(str(tmp_path), {'liba.so' : other})
+    os.utime(tmp_path, ns=(dirstat.st_atime_ns, dirstat.st_mtime_ns))
+    assert _dims(tmp_path, 'liba.so') == [4, 4, 4]
+
+
+def test_lookup_sees_removed_library(tmp_path, monkeypatch):
+    monkeypatch.delenv(SW_LIBRARY_PATH, raising=False)
+    clearMetadataIndexCache()
+    _writeLibrary(tmp_path / 'liba.so', [8, 8, 8],
+                  {SW_KEY_EXEC : 'a', SW_KEY_INIT : 'init_a', SW_KEY_DESTROY : 'destroy_a'})
+    query = {SW_KEY_TRANSFORMTYPE : 'MDDFT', SW_KEY_DIMENSIONS : [8, 8, 8]}
+    (path, names) = findFunctionsWithMetadata(query, str(tmp_path))
+    assert path == str(tmp_path / 'liba.so')
+    os.remove(tmp_path / 'liba.so')
+    assert findFunctionsWithMetadata(query, str(tmp_path))[0] == None
+
+
+def test_threads_must_match():
+    query = {SW_KEY_TRANSFORMTYPE : 'MDDFT', SW_KEY_DIMENSIONS : [8, 8, 8]}
+    sequential = dict(query)
+    threaded = dict(query)
+    threaded[SW_KEY_THREADS] = 4
+    assert metadataMatches(sequential, query)
+    assert not metadataMatches(threaded, query)
+    assert metadataMatches(threaded, threaded)
+    assert not metadataMatches(sequential, threaded)
+
+
+def test_compile_flags_must_match():
+    query = {SW_KEY_TRANSFORMTYPE : 'MDDFT', SW_KEY_DIMENSIONS : [8, 8, 8]}
+    fast = dict(query)
+    fast[SW_KEY_COMPILEFLAGS] = ['-ffast-math']
+    assert not metadataMatches(fast, query)
+    assert metadataMatches(fast, fast)
+    assert not metadataMatches(query, fast)
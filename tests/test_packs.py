@@ -0,0 +1,108 @@
+import io
+import json
+import os
+import tarfile
+
+import pytest
+
+from snowwhite import *
+from snowwhite.metadata import clearMetadataIndexCache, metadataIndexForDir
+from snowwhite.packs import *
+
+
+def _metadata(dims):
+    return {SW_KEY_TRANSFORMS : [{SW_KEY_TRANSFORMTYPE : 'MDDFT', SW_KEY_DIMENSIONS : dims,
+                                  SW_KEY_DIRECTION : SW_STR_FORWARD, SW_KEY_PRECISION : SW_STR_DOUBLE,
+                                  SW_KEY_PLATFORM : SW_CPU}]}
+
+
+def _writeLibrary(path, metadata):
+    """Write a stand-in library, not ELF, with metadata unless None."""
+    data = b'\0code\0'
+    if metadata != None:
+        data += (SW_METADATA_START + json.dumps(metadata) + SW_METADATA_END).encode()
+    path.write_bytes(data)
+
+
+def test_pack_unpack_round_trip(tmp_path):
+    clearMetadataIndexCache()
+    src = tmp_path / 'src'
+    src.mkdir()
+    _writeLibrary(src / 'liba.so', _metadata([8, 8, 8]))
+    _writeLibrary(src / 'libb.so', _metadata([16, 16, 16]))
+    # found by name by the solver that built it, packed all the same
+    _writeLibrary(src / 'libplain.so', None)
+
+    archive = str(tmp_path / 'libs.tar.gz')
+    assert pack(archive, dirs=[str(src)]) == ['liba.so', 'libb.so', 'libplain.so']
+
+    dest = tmp_path / 'dest'
+    assert unpack(archive, str(dest)) == ['liba.so', 'libb.so', 'libplain.so']
+    for name in ['liba.so', 'libb.so', 'libplain.so']:
+        assert (dest / name).read_bytes() == (src / name).read_bytes()
+    # metadata comes from the manifest, nothing is scanned
+    index = json.loads((dest / 'swindex.json').read_text())[SW_KEY_LIBRARIES]
+    assert index['liba.so'][SW_KEY_METADATA] == _metadata([8, 8, 8])
+    assert index['libplain.so'][SW_KEY_METADATA] == None
+    assert metadataIndexForDir(str(dest))['libb.so'] == _metadata([16, 16, 16])
+
+
+def test_pack_by_name(tmp_path):
+    clearMetadataIndexCache()
+    _writeLibrary(tmp_path / 'liba.so', _metadata([8, 8, 8]))
+    _writeLibrary(tmp_path / 'libb.so', _metadata([16, 16, 16]))
+    archive = str(tmp_path / 'libs.tar')
+    assert pack(archive, names=['libb.so'], dirs=[str(tmp_path)]) == ['libb.so']
+
+
+def test_unpack_keeps_existing_unless_forced(tmp_path):
+    clearMetadataIndexCache()
+    src = tmp_path / 'src'
+    src.mkdir()
+    _writeLibrary(src / 'liba.so', _metadata([8, 8, 8]))
+    archive = str(tmp_path / 'libs.tar')
+    pack(archive, dirs=[str(src)])
+
+    dest = tmp_path / 'dest'
+    dest.mkdir()
+    (dest / 'liba.so').write_bytes(b'local')
+    assert unpack(archive, str(dest)) == []
+    assert (dest / 'liba.so').read_bytes() == b'local'
+    assert unpack(archive, str(dest), force=True) == ['liba.so']
+    assert (dest / 'liba.so').read_bytes() == (src / 'liba.so').read_bytes()
+
+
+def test_unpack_rejects_missing_library(tmp_path):
+    manifest = json.dumps({SW_KEY_VERSION : SW_PACK_VERSION,
+                           SW_KEY_LIBRARIES : {'liba.so' : {SW_KEY_SIZE : 1, 'SHA256' : '0'}}}).encode()
+    archive = str(tmp_path / 'bad.tar')
+    with tarfile.open(archive, 'w') as tar:
+        info = tarfile.TarInfo(SW_PACK_MANIFEST)
+        info.size = len(manifest)
+        tar.addfile(info, io.BytesIO(manifest))
+    with pytest.raises(ValueError):
+        unpack(archive, str(tmp_path / 'dest'))
+
+
+def test_unpack_corrupt_library_installs_nothing(tmp_path):
+    clearMetadataIndexCache()
+    src = tmp_path / 'src'
+    src.mkdir()
+    _writeLibrary(src / 'liba.so', _metadata([8, 8, 8]))
+    _writeLibrary(src / 'libb.so', _metadata([16, 16, 16]))
+    archive = str(tmp_path / 'libs.tar')
+    pack(archive, dirs=[str(src)])
+    
+    # corrupt the last library in the archive, after liba.so checked out
+    with tarfile.open(archive, 'r') as tar:
+        members = [(m, tar.extractfile(m).read()) for m in tar.getmembers()]
+    with tarfile.open(archive, 'w') as tar:
+        for (m, data) in members:
+            if m.name == 'libb.so':
+                data = data.replace(b'code', b'CODE')
+            tar.addfile(m, io.BytesIO(data))
+    
+    dest = tmp_path / 'dest'
+    with pytest.raises(ValueError, match='corrupt'):
+        unpack(archive, str(dest))
+    assert sorted(os.listdir(dest)) == []
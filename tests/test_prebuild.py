@@ -0,0 +1,29 @@
+import os
+
+from snowwhite import *
+from snowwhite.prebuild import prebuild
+
+_spec = {SW_KEY_TRANSFORMTYPE : 'MDDFT', SW_KEY_DIMENSIONS : [8, 8, 8],
+         SW_KEY_DIRECTION : SW_STR_FORWARD, SW_KEY_PRECISION : SW_STR_DOUBLE,
+         SW_KEY_PLATFORM : SW_CPU, SW_KEY_OPTIONS : {SW_OPT_BUILDBACKEND : 'cc'}}
+
+
+def _starts(log):
+    return sum(1 for line in log.read_text().splitlines() if line.startswith('start '))
+
+
+def test_prebuild_skips_installed(libsDir, fakeSpiral):
+    assert [r['Status'] for r in prebuild([_spec], 1)] == ['built']
+    assert [r['Status'] for r in prebuild([_spec], 1)] == ['skipped']
+    assert _starts(fakeSpiral) == 1
+
+
+def test_prebuild_force_rebuilds(libsDir, fakeSpiral):
+    prebuild([_spec], 1)
+    lib = [f for f in os.listdir(libsDir) if f.endswith(SW_SHLIB_EXT)]
+    mtime = os.stat(libsDir / lib[0]).st_mtime_ns
+    results = prebuild([_spec], 1, force=True)
+    assert [r['Status'] for r in results] == ['built']
+    # neither the installed library nor the build cache was used
+    assert _starts(fakeSpiral) == 2
+    assert os.stat(libsDir / lib[0]).st_mtime_ns != mtime
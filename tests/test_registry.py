@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+import snowwhite.registry
+from snowwhite.registry import SolverRegistry
+
+
+class _Problem:
+    def __init__(self, n):
+        self.n = n
+
+    def canonicalKey(self):
+        return ('Fake', self.n)
+
+
+class _Solver:
+    built = 0
+    
+    def __init__(self, problem, opts):
+        if problem.n < 0:
+            raise RuntimeError('build failed')
+        time.sleep(opts.get('delay', 0))
+        type(self).built += 1
+        self.problem = problem
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    monkeypatch.setattr(snowwhite.registry, 'solverClassForProblem', lambda problem: _Solver)
+    _Solver.built = 0
+    return SolverRegistry(maxSize=2)
+
+
+def test_same_problem_returns_same_solver(registry):
+    s = registry.getSolver(_Problem(8))
+    assert registry.getSolver(_Problem(8)) is s
+    assert registry.getSolver(_Problem(8), {'threads' : 2}) is not s
+    stats = registry.stats()
+    assert (stats['Hits'], stats['Misses']) == (1, 2)
+
+
+def test_least_recently_used_evicted(registry):
+    a = registry.getSolver(_Problem(1))
+    b = registry.getSolver(_Problem(2))
+    registry.getSolver(_Problem(1))
+    registry.getSolver(_Problem(3))
+    assert registry.stats()['Evictions'] == 1
+    assert registry.getSolver(_Problem(1)) is a
+    assert registry.getSolver(_Problem(2)) is not b
+
+
+def test_failed_build_leaves_no_lock(registry):
+    with pytest.raises(RuntimeError):
+        registry.getSolver(_Problem(-1))
+    assert registry._buildLocks == {}
+    assert registry.stats()['Size'] == 0
+
+
+def test_concurrent_requests_build_once(registry):
+    solvers = []
+    def get():
+        solvers.append(registry.getSolver(_Problem(8), {'delay' : 0.2}))
+    threads = [threading.Thread(target=get) for i in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert _Solver.built == 1
+    assert all(s is solvers[0] for s in solvers)
+    assert registry._buildLocks == {}
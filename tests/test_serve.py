@@ -0,0 +1,135 @@
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import snowwhite.serve
+from snowwhite import *
+from snowwhite.serve import *
+from snowwhite.serve import _recvMessage, _sendMessage
+
+from multiprocessing import shared_memory
+
+_spec = {SW_KEY_TRANSFORMTYPE : 'MDDFT', SW_KEY_DIMENSIONS : [4, 4, 4],
+         SW_KEY_DIRECTION : SW_STR_FORWARD, SW_KEY_PRECISION : SW_STR_DOUBLE,
+         SW_KEY_PLATFORM : SW_CPU}
+
+
+class _DoublingSolver:
+    """Stands in for a solver, solve() doubles its input."""
+    
+    failures = 0
+    delay = 0.0
+    
+    def __init__(self, problem, opts):
+        if type(self).failures > 0:
+            type(self).failures -= 1
+            raise RuntimeError('build failed')
+
+    def solve(self, src, dst=None):
+        time.sleep(type(self).delay)
+        if dst is None:
+            return src * 2
+        dst[...] = src * 2
+        return dst
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.setattr(snowwhite.serve, 'solverClassForProblem', lambda problem: _DoublingSolver)
+    _DoublingSolver.failures = 0
+    _DoublingSolver.delay = 0.0
+    server = SolverServer(str(tmp_path / 'sw.sock'), maxPending=1, maxWorkers=2)
+    server.start()
+    thread = threading.Thread(target=server.serveForever, daemon=True)
+    thread.start()
+    yield server
+    server.close()
+    thread.join(5)
+    assert not thread.is_alive()
+
+
+def _src(client):
+    src = client.empty((4, 4, 4), np.complex128)
+    src[...] = np.arange(64).reshape((4, 4, 4))
+    return src
+
+
+def test_solve_into_out_and_new_segment(server):
+    with SolverClient(server.path()) as client:
+        src = _src(client)
+        dst = client.empty((4, 4, 4), np.complex128)
+        assert client.solve(_spec, src, out=dst) is dst
+        assert np.array_equal(dst, src * 2)
+        # an array not in shared memory is copied
+        assert np.array_equal(client.solve(_spec, np.array(src)), src * 2)
+        stats = client.stats()
+    assert stats['Served'] == 2
+    assert stats['Transforms'] == 1
+
+
+def test_setup_failure_is_retried(server):
+    _DoublingSolver.failures = 1
+    with SolverClient(server.path()) as client:
+        src = _src(client)
+        with pytest.raises(RuntimeError, match='build failed'):
+            client.solve(_spec, src)
+        assert np.array_equal(client.solve(_spec, src), src * 2)
+
+
+def test_busy_when_max_pending(server):
+    _DoublingSolver.delay = 1.0
+    errors = []
+    def solve():
+        with SolverClient(server.path()) as client:
+            try:
+                client.solve(_spec, _src(client))
+            except RuntimeError as ex:
+                errors.append(str(ex))
+    threads = [threading.Thread(target=solve) for i in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert len(errors) == 1
+    assert 'busy' in errors[0]
+    assert server.stats()['Rejected'] == 1
+
+
+def test_unclaimed_result_unlinked(server):
+    src = shared_memory.SharedMemory(None, True, 64 * 16)
+    try:
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.connect(server.path())
+        desc = {SW_SERVE_SEGMENT : src.name, SW_SERVE_OFFSET : 0, SW_SERVE_SHAPE : [4, 4, 4],
+                SW_SERVE_DTYPE : np.dtype(np.complex128).str}
+        _sendMessage(conn, {SW_SERVE_OP : SW_SERVE_OP_SOLVE, SW_SERVE_SPEC : _spec, SW_SERVE_ARGS : [desc]})
+        reply = _recvMessage(conn)
+        assert reply[SW_SERVE_STATUS] == SW_SERVE_OK
+        result = reply[SW_SERVE_OUT][SW_SERVE_SEGMENT]
+        # disconnect without attaching or releasing the result
+        conn.close()
+        deadline = time.monotonic() + 5
+        while True:
+            try:
+                shm = shared_memory.SharedMemory(result)
+            except FileNotFoundError:
+                break
+            shm.close()
+            assert time.monotonic() < deadline, 'result segment not unlinked'
+            time.sleep(0.05)
+    finally:
+        src.close()
+        src.unlink()
+
+
+def test_unknown_request(server):
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(server.path())
+    try:
+        _sendMessage(conn, {SW_SERVE_OP : 'Frobnicate'})
+        assert _recvMessage(conn)[SW_SERVE_STATUS] == SW_SERVE_ERROR
+    finally:
+        conn.close()
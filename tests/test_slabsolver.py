@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from snowwhite import *
+from snowwhite.mddftsolver import MddftProblem
+from snowwhite.mdprdftsolver import MdprdftProblem
+from snowwhite.slabsolver import SlabSolver
+
+_dims = [6, 4, 4]
+
+
+@pytest.fixture
+def pythonStages(libsDir, fakeSpiral):
+    """Options for stage solvers that solve with runDef: SPIRAL fails, so their background builds do."""
+    exe = fakeSpiral.parent / 'spiralbin' / 'spiral'
+    exe.write_text('#!/bin/sh\nexit 1\n')
+    return {SW_OPT_BUILDBACKEND : 'cc', SW_OPT_BACKGROUND : True}
+
+
+def _check(problem, opts, src):
+    solver = SlabSolver(problem, opts, threads=2)
+    try:
+        dst = solver.solve(src)
+        for stage in (solver._planeSolver, solver._columnSolver):
+            assert stage.solvePath() == SW_PATH_PYTHON
+    finally:
+        solver.close()
+    expected = solver.runDef(src)
+    assert dst.shape == expected.shape
+    assert np.allclose(dst, expected)
+
+
+@pytest.mark.parametrize('k', [SW_FORWARD, SW_INVERSE])
+def test_mddft_matches_rundef(pythonStages, k):
+    rng = np.random.default_rng(1)
+    src = rng.random(_dims) + 1j * rng.random(_dims)
+    _check(MddftProblem(_dims, k), pythonStages, src)
+
+
+@pytest.mark.parametrize('k', [SW_FORWARD, SW_INVERSE])
+def test_mdprdft_matches_rundef(pythonStages, k):
+    rng = np.random.default_rng(2)
+    src = rng.random(_dims)
+    if k == SW_INVERSE:
+        src = np.fft.rfftn(src)
+    _check(MdprdftProblem(_dims, k), pythonStages, src)
@@ -0,0 +1,118 @@
+import os
+import time
+
+import pytest
+
+import snowwhite.spiral
+from snowwhite import *
+from snowwhite.spiral import *
+
+
+def _starts(log):
+    if not log.exists():
+        return 0
+    return sum(1 for line in log.read_text().splitlines() if line.startswith('start '))
+
+
+def _writeScript(path, body):
+    path.write_text('Load(fftx);\nImportAll(fftx);\n' + body)
+    return str(path)
+
+
+def test_session_sends_preamble_once(fakeSpiral, tmp_path):
+    session = SpiralSession()
+    try:
+        for name in ['a', 'b']:
+            script = _writeScript(tmp_path / (name + '.g'), 'PrintTo("' + name + '.c", c);\n')
+            assert session.run(script, str(tmp_path)) == SPIRAL_RET_OK
+            assert (tmp_path / (name + '.c')).exists()
+    finally:
+        session.close()
+    lines = fakeSpiral.read_text().splitlines()
+    assert _starts(fakeSpiral) == 1
+    assert lines.count('line Load(fftx);') == 1
+    assert lines.count('line ImportAll(fftx);') == 1
+    # every exchange, the preamble and both scripts, ends with its own sentinel
+    sentinels = [l for l in lines if SPIRAL_SENTINEL in l]
+    assert len(sentinels) == 3
+    assert len(set(sentinels)) == 3
+
+
+def test_session_error_restarts(fakeSpiral, tmp_path):
+    session = SpiralSession()
+    try:
+        script = _writeScript(tmp_path / 'bad.g', 'FAIL;\n')
+        assert session.run(script, str(tmp_path)) == SPIRAL_RET_ERR
+        assert not session.alive()
+        script = _writeScript(tmp_path / 'good.g', 'PrintTo("good.c", c);\n')
+        assert session.run(script, str(tmp_path)) == SPIRAL_RET_OK
+    finally:
+        session.close()
+    assert _starts(fakeSpiral) == 2
+
+
+def test_session_crash_restarts(fakeSpiral, tmp_path):
+    session = SpiralSession()
+    try:
+        script = _writeScript(tmp_path / 'crash.g', 'CRASH;\n')
+        assert session.run(script, str(tmp_path)) == SPIRAL_RET_ERR
+        script = _writeScript(tmp_path / 'good.g', 'PrintTo("good.c", c);\n')
+        assert session.run(script, str(tmp_path)) == SPIRAL_RET_OK
+        assert (tmp_path / 'good.c').exists()
+    finally:
+        session.close()
+    assert _starts(fakeSpiral) == 2
+
+
+def test_session_timeout(fakeSpiral, tmp_path):
+    session = SpiralSession(timeout=2)
+    try:
+        script = _writeScript(tmp_path / 'hang.g', 'HANG;\n')
+        assert session.run(script, str(tmp_path)) == SPIRAL_RET_ERR
+        assert not session.alive()
+        script = _writeScript(tmp_path / 'good.g', 'PrintTo("good.c", c);\n')
+        assert session.run(script, str(tmp_path)) == SPIRAL_RET_OK
+    finally:
+        session.close()
+    assert _starts(fakeSpiral) == 2
+
+
+def test_run_timeout_overrides_session(fakeSpiral, tmp_path):
+    session = SpiralSession()
+    try:
+        script = _writeScript(tmp_path / 'hang.g', 'HANG;\n')
+        assert session.run(script, str(tmp_path), timeout=1) == SPIRAL_RET_ERR
+        assert not session.alive()
+    finally:
+        session.close()
+
+
+def test_file_run_timeout(fakeSpiral, tmp_path):
+    script = _writeScript(tmp_path / 'hang.g', 'HANG;\n')
+    t0 = time.monotonic()
+    assert callSpiralWithFile(script, str(tmp_path), timeout=1) == SPIRAL_RET_ERR
+    assert time.monotonic() - t0 < 30
+
+
+@pytest.mark.parametrize('session', [False, True])
+def test_solver_spiral_timeout(libsDir, fakeSpiral, monkeypatch, session):
+    from snowwhite.mddftsolver import MddftProblem, MddftSolver
+    monkeypatch.setattr(snowwhite.spiral, '_sessionPool', None)
+    monkeypatch.setenv('STUB_SPIRAL_HANG', '1')
+    opts = {SW_OPT_BUILDBACKEND : 'cc', SW_OPT_SPIRALSESSION : session, SW_OPT_SPIRALTIMEOUT : 1}
+    t0 = time.monotonic()
+    with pytest.raises(RuntimeError, match='SPIRAL error'):
+        MddftSolver(MddftProblem([8, 8, 8]), opts)
+    assert time.monotonic() - t0 < 30
+
+
+def test_pool_reuses_sessions(fakeSpiral, tmp_path):
+    pool = SpiralSessionPool(1)
+    try:
+        for i in range(3):
+            script = _writeScript(tmp_path / ('s' + str(i) + '.g'), 'PrintTo("s' + str(i) + '.c", c);\n')
+            assert pool.run(script, str(tmp_path)) == SPIRAL_RET_OK
+    finally:
+        pool.close()
+    assert _starts(fakeSpiral) == 1
+    assert sorted(os.listdir(tmp_path)).count('s2.c') == 1
@@ -0,0 +1,139 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from snowwhite import *
+from snowwhite.mddftsolver import MddftProblem, MddftSolver
+
+_opts = {SW_OPT_BUILDBACKEND : 'cc'}
+
+
+def _noChdir(path):
+    raise AssertionError('build changed the working directory')
+
+
+def test_concurrent_builds_keep_cwd(libsDir, fakeSpiral, monkeypatch):
+    monkeypatch.setattr(os, 'chdir', _noChdir)
+    cwd = os.getcwd()
+    solvers = []
+    errors = []
+    def build(n):
+        try:
+            solvers.append(MddftSolver(MddftProblem([n, n, n]), dict(_opts)))
+        except Exception as ex:
+            errors.append(ex)
+    threads = [threading.Thread(target=build, args=(n,)) for n in (4, 6, 8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert errors == []
+    assert len(solvers) == 3
+    assert os.getcwd() == cwd
+    assert len([f for f in os.listdir(libsDir) if f.endswith(SW_SHLIB_EXT)]) == 3
+
+
+def test_background_build_solves_with_python_until_ready(libsDir, fakeSpiral, monkeypatch):
+    # SPIRAL hangs until the timeout, the build fails
+    monkeypatch.setenv('STUB_SPIRAL_HANG', '1')
+    opts = dict(_opts)
+    opts.update({SW_OPT_BACKGROUND : True, SW_OPT_SPIRALTIMEOUT : 2})
+    solver = MddftSolver(MddftProblem([4, 4, 4]), opts)
+    src = solver.buildTestInput()
+    assert np.allclose(solver.solve(src), np.fft.fftn(src))
+    assert not solver.isReady()
+    assert solver.solvePath() == SW_PATH_PYTHON
+    with pytest.raises(RuntimeError, match='background build failed'):
+        solver.waitReady(30)
+    solver.solve(src)
+    assert solver.solvePathCounts() == {SW_PATH_LIBRARY : 0, SW_PATH_PYTHON : 2}
+
+
+def test_background_build_switches_to_library(libsDir, fakeSpiral):
+    opts = dict(_opts)
+    opts[SW_OPT_BACKGROUND] = True
+    solver = MddftSolver(MddftProblem([4, 4, 4]), opts)
+    assert solver.waitReady(30)
+    solver.solve(solver.buildTestInput())
+    assert solver.solvePath() == SW_PATH_LIBRARY
+
+
+class _UntunedMddftSolver(MddftSolver):
+    def _tuneVariants(self, count):
+        return []
+
+
+def test_tune_without_variants_finds_default(libsDir, fakeSpiral):
+    opts = dict(_opts)
+    opts[SW_OPT_TUNE] = 3
+    # without the build cache every build runs SPIRAL
+    opts[SW_OPT_BUILDCACHE] = False
+    _UntunedMddftSolver(MddftProblem([8, 8, 8]), dict(opts))
+    solver = _UntunedMddftSolver(MddftProblem([8, 8, 8]), dict(opts))
+    assert solver.isReady()
+    starts = [l for l in fakeSpiral.read_text().splitlines() if l.startswith('start ')]
+    assert len(starts) == 1
+
+
+def test_threads_option(libsDir, fakeSpiral):
+    opts = dict(_opts)
+    opts[SW_OPT_THREADS] = 2
+    solver = MddftSolver(MddftProblem([8, 8, 8]), opts)
+    assert solver._namebase.endswith('_t2')
+    assert solver.threads() == 2
+    with pytest.raises(ValueError):
+        solver.setThreads(0)
+    sequential = MddftSolver(MddftProblem([8, 8, 8]), dict(_opts))
+    assert sequential.threads() == 0
+    with pytest.raises(RuntimeError):
+        sequential.setThreads(2)
+    assert sequential._library.path != solver._library.path
+
+
+def test_flag_variants_share_generated_source(libsDir, fakeSpiral):
+    plain = MddftSolver(MddftProblem([8, 8, 8]), dict(_opts))
+    opts = dict(_opts)
+    opts[SW_OPT_FASTMATH] = True
+    fast = MddftSolver(MddftProblem([8, 8, 8]), opts)
+    # separate libraries with the same functions, from one SPIRAL run
+    assert fast._library.path != plain._library.path
+    assert fast._mainFuncName == plain._mainFuncName
+    starts = [l for l in fakeSpiral.read_text().splitlines() if l.startswith('start ')]
+    assert len(starts) == 1
+    # each finds its own library again
+    assert MddftSolver(MddftProblem([8, 8, 8]), dict(opts))._library.path == fast._library.path
+    assert MddftSolver(MddftProblem([8, 8, 8]), dict(_opts))._library.path == plain._library.path
+
+
+def test_perthread_threads_call_private_copies(libsDir, fakeSpiral):
+    import ctypes
+    opts = dict(_opts)
+    opts[SW_OPT_PERTHREAD] = True
+    solver = MddftSolver(MddftProblem([4, 4, 4]), opts)
+    def address(func):
+        return ctypes.cast(func, ctypes.c_void_p).value
+    addresses = []
+    def resolve():
+        addresses.append(address(solver._MainFunc))
+    for i in range(2):
+        # the second thread starts after the first exited and takes over its copy
+        t = threading.Thread(target=resolve)
+        t.start()
+        t.join()
+    assert solver.privateCopies() == 1
+    assert addresses[0] == addresses[1]
+    assert addresses[0] != address(solver._sharedMainFunc)
+    # threads running at the same time each have their own copy
+    barrier = threading.Barrier(2)
+    def resolveTogether():
+        resolve()
+        barrier.wait()
+    threads = [threading.Thread(target=resolveTogether) for i in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert solver.privateCopies() == 2
+    assert len(set(addresses[2:])) == 2
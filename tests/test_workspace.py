@@ -0,0 +1,91 @@
+import shutil
+import subprocess
+import threading
+
+import pytest
+
+import snowwhite
+import snowwhite.swsolver
+from snowwhite import *
+from snowwhite.mddftsolver import MddftProblem, MddftSolver
+from snowwhite.swsolver import _SharedLibrary
+
+_opts = {SW_OPT_BUILDBACKEND : 'cc'}
+
+_WORKSPACE = 8 << 20
+
+_source = """
+#include <stdlib.h>
+#include <string.h>
+#include <unistd.h>
+static char *buf;
+int init_ws(void) { buf = malloc(%d); memset(buf, 1, %d); usleep(200000); return 0; }
+void destroy_ws(void) { free(buf); buf = NULL; }
+""" % (_WORKSPACE, _WORKSPACE)
+
+
+@pytest.fixture
+def noBudget():
+    yield
+    snowwhite.setWorkspaceBudget(None)
+
+
+@pytest.mark.skipif(shutil.which('cc') == None, reason='needs cc')
+@pytest.mark.skipif(snowwhite.swsolver._mallinfo2 == None, reason='needs glibc malloc statistics')
+def test_concurrent_inits_measure_own_allocations(tmp_path):
+    src = tmp_path / 'ws.c'
+    src.write_text(_source)
+    libs = []
+    for i in range(2):
+        # a copy of the file is a separate library with its own workspace
+        lib = tmp_path / ('libws%d%s' % (i, SW_SHLIB_EXT))
+        subprocess.run(['cc', '-shared', '-fPIC', '-o', str(lib), str(src)], check=True)
+        libs.append(_SharedLibrary(str(lib), 'init_ws', 'destroy_ws'))
+    threads = [threading.Thread(target=lib.initFunc) for lib in libs]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    for lib in libs:
+        assert _WORKSPACE <= lib.workspaceBytes < _WORKSPACE + (1 << 20)
+        lib.destroyFunc()
+
+
+def test_budget_evicts_least_recently_used(libsDir, fakeSpiral, noBudget):
+    solvers = [MddftSolver(MddftProblem([n, n, n]), dict(_opts)) for n in (4, 6)]
+    libs = [s._library for s in solvers]
+    for lib in libs:
+        lib.workspaceBytes = 1000
+    srcs = [s.buildTestInput() for s in solvers]
+    solvers[0].solve(srcs[0])
+    solvers[1].solve(srcs[1])
+    
+    before = snowwhite.workspaceStats()
+    snowwhite.setWorkspaceBudget(1500)
+    assert (not libs[0].initialized) and libs[1].initialized
+    solvers[0].solve(srcs[0])
+    assert libs[0].initialized and (not libs[1].initialized)
+    stats = snowwhite.workspaceStats()
+    # libraries left loaded by other tests may be evicted too
+    assert stats['Evictions'] - before['Evictions'] >= 2
+    assert stats['Reinits'] - before['Reinits'] == 1
+    
+    # without a budget every library is set up again
+    snowwhite.setWorkspaceBudget(None)
+    assert libs[0].initialized and libs[1].initialized
+
+
+def test_running_library_is_not_evicted(libsDir, fakeSpiral, noBudget):
+    solver = MddftSolver(MddftProblem([4, 4, 4]), dict(_opts))
+    lib = solver._library
+    lib.workspaceBytes = 1000
+    # solve() counts as running even while no budget is set
+    run = solver._MainFunc
+    snowwhite.swsolver._beginWorkspaceUse(lib)
+    try:
+        assert run == solver._callWithWorkspace
+        snowwhite.setWorkspaceBudget(0)
+        assert lib.initialized
+    finally:
+        snowwhite.swsolver._endWorkspaceUse(lib)
+    assert not lib.initialized